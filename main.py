@@ -1,47 +1,134 @@
 """This module is a command-line script for all functions."""
 import argparse
-from src.data import dataset
+import cProfile
+import json
+import os
+import sys
+
 from src import config
 
 
-def run_gen_all(x):
-    # Parse sent_formats and sent_masks
-    if x.sent_formats[0] == 'all':
-        x.sent_formats = 'all'
-    if x.sent_masks[0] == 'all':
-        x.sent_masks = 'all'
+def _run_profiled(x, run, *args):
+    # Dump a cProfile of the main process if requested
+    if x.cprofile is None:
+        return run(*args)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return run(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(x.cprofile)
+
+
+def _report_skipped(summary):
+    if summary['skipped']:
+        print("Skipped up-to-date groups: " + ", ".join(summary['skipped']))
 
-    # Parse split
-    split = {
-        'train': x.split[0],
-        'val': x.split[1],
-        'test': x.split[2],
-    }
-    dataset.generate_all(
-        val_range=x.val_range, len_range=x.len_range, path=x.path,
-        rewrite=x.rewrite, sent_formats=x.sent_formats,
-        sent_masks=x.sent_masks, split=split)
 
+def run_generate(x):
+    from src import spec
+
+    # Arguments of generate_all and generate_random form a job; split and names are parsed by spec
+    job = {name: value for name, value in vars(x).items() if name not in ('func', 'cprofile')}
+    result = _run_profiled(x, spec.run_job, job)
+
+    # Print the estimate of a dry run
+    if job.get('dry_run'):
+        print(json.dumps(result, indent=2))
+    else:
+        _report_skipped(result)
+
+
+def run_spec(x):
+    from src import spec
+
+    jobs = spec.load_spec(x.file)
+    if x.plan:
+        print(json.dumps(spec.plan_jobs(jobs), indent=2))
+        return
+    for result in _run_profiled(x, spec.run_spec, jobs):
+        _report_skipped(result)
+
+
+def run_export(x):
+    import tables
+    from src.data import dataset, export
 
-def run_gen_random(x):
     # Parse sent_formats and sent_masks
     if x.sent_formats[0] == 'all':
         x.sent_formats = 'all'
     if x.sent_masks[0] == 'all':
         x.sent_masks = 'all'
 
-    # Parse split
-    split = {
-        'train': x.split[0],
-        'val': x.split[1],
-        'test': x.split[2],
-    }
+    # Export each generated format-mask group to its own directory
+    sent_formats, sent_masks = dataset._parse_params(x.sent_formats, x.sent_masks)
+    with tables.open_file(x.path, mode='r') as h5file:
+        group_names = set(h5file.root.datasets._v_children)
+    for sent_format in sent_formats:
+        for sent_mask in sent_masks:
+            group_name = "{sent_format}_{sent_mask}".format(sent_format=sent_format, sent_mask=sent_mask)
+            if group_name not in group_names:
+                continue
+            export.export_group(x.path, group_name, os.path.join(x.out, group_name), layout=x.layout,
+                                shard_size=x.shard_size)
+
 
-    # Parse rewrite
-    dataset.generate_random(
-        count=x.count[0], val_range=x.val_range, len_range=x.len_range,
-        path=x.path, rewrite=x.rewrite,
-        sent_formats=x.sent_formats, sent_masks=x.sent_masks, split=split)
+def _report_regressions(results, baseline, threshold):
+    from src import benchmark
+
+    # Print regressions and exit with an error if there are any
+    regressions = benchmark.compare_results(results, baseline, threshold)
+    for regression in regressions:
+        print(f"{regression.name}: {regression.baseline:.0f} -> {regression.current:.0f} samples/s "
+              f"({regression.change:+.1%})")
+    if regressions:
+        sys.exit(1)
+    print("No regressions.")
+
+
+def run_benchmark(x):
+    from src import benchmark
+
+    results = benchmark.run_benchmarks(samples=x.samples, repeat=x.repeat, names=x.names)
+    for name, result in results['results'].items():
+        print(f"{name}: {result['samples_per_sec']:.0f} samples/s")
+    benchmark.save_results(results, x.out)
+
+    # Compare with a baseline
+    if x.baseline:
+        _report_regressions(results, benchmark.load_results(x.baseline), x.threshold)
+
+
+def run_compare(x):
+    from src import benchmark
+
+    _report_regressions(benchmark.load_results(x.results), benchmark.load_results(x.baseline), x.threshold)
+
+
+def _add_generate_arguments(cmd):
+    # Add options shared by generate_all and generate_random
+    cmd.add_argument('--val_range', nargs=2, type=int, default=config.NUMS_VAL_RANGE)
+    cmd.add_argument('--len_range', nargs=2, type=int, default=config.NUMS_LEN_RANGE)
+    cmd.add_argument('--path', type=str, default=config.DATASET_PATH)
+    cmd.add_argument('--rewrite', default=config.DATASET_REWRITE,
+                     action='store_false' if config.DATASET_REWRITE else 'store_true')
+    cmd.add_argument('--sent_formats', nargs='*', type=str, default='all')
+    cmd.add_argument('--sent_masks', nargs='*', type=str, default='all')
+    cmd.add_argument('--split', nargs=3, type=float, default=(config.SPLIT['train'], config.SPLIT['val'],
+                                                              config.SPLIT['test']))
+    cmd.add_argument('--chunk_size', type=int, default=config.CHUNK_SIZE)
+    cmd.add_argument('--workers', type=int, default=config.WORKERS)
+    cmd.add_argument('--storage', type=str, choices=['strings', 'tokens', 'strings_tokens', 'canonical'],
+                     default='strings')
+    cmd.add_argument('--resume', action='store_true')
+    cmd.add_argument('--split_mode', type=str, choices=list(config.SPLIT_MODES), default=config.SPLIT_MODE)
+    cmd.add_argument('--progress', action='store_true')
+    cmd.add_argument('--profile', type=str, default=None)
+    cmd.add_argument('--cprofile', type=str, default=None)
+    cmd.add_argument('--incremental', action='store_true')
+    cmd.add_argument('--pipeline', action='store_true')
+    cmd.add_argument('--queue_size', type=int, default=config.QUEUE_SIZE)
 
 
 def setup_parsers():
@@ -56,29 +143,55 @@ def setup_parsers():
 
     # Add options for generate_all
     cmd_gen_all = cmd_gen_types.add_parser('all')
-    cmd_gen_all.set_defaults(func=run_gen_all)
-    cmd_gen_all.add_argument('--val_range', nargs=2, type=int, default=config.NUMS_VAL_RANGE)
-    cmd_gen_all.add_argument('--len_range', nargs=2, type=int, default=config.NUMS_LEN_RANGE)
-    cmd_gen_all.add_argument('--path', nargs=1, type=str, default=config.DATASET_PATH)
-    cmd_gen_all.add_argument('--rewrite', default=config.DATASET_REWRITE,
-                             action='store_false' if config.DATASET_REWRITE else 'store_true')
-    cmd_gen_all.add_argument('--sent_formats', nargs='*', type=str, default='all')
-    cmd_gen_all.add_argument('--sent_masks', nargs='*', type=str, default='all')
-    cmd_gen_all.add_argument('--split', nargs=3, type=int, default=(config.SPLIT['train'], config.SPLIT['val'],
-                                                                    config.SPLIT['test']))
+    cmd_gen_all.set_defaults(func=run_generate, kind='all')
+    _add_generate_arguments(cmd_gen_all)
+    cmd_gen_all.add_argument('--dry_run', action='store_true')
+    cmd_gen_all.add_argument('--max_bytes', type=float, default=config.MAX_BYTES)
+    cmd_gen_all.add_argument('--max_seconds', type=float, default=config.MAX_SECONDS)
 
     # Add options for generate_random
-    cmd_gen_all = cmd_gen_types.add_parser('random')
-    cmd_gen_all.set_defaults(func=run_gen_random)
-    cmd_gen_all.add_argument('count', nargs=1, type=int)
-    cmd_gen_all.add_argument('--val_range', nargs=2, type=int, default=config.NUMS_VAL_RANGE)
-    cmd_gen_all.add_argument('--len_range', nargs=2, type=int, default=config.NUMS_LEN_RANGE)
-    cmd_gen_all.add_argument('--path', nargs=1, type=str, default=config.DATASET_PATH)
-    cmd_gen_all.add_argument('--rewrite', default=config.DATASET_REWRITE,
-                             action='store_false' if config.DATASET_REWRITE else 'store_true')
-    cmd_gen_all.add_argument('--sent_formats', nargs='*', type=str, default='all')
-    cmd_gen_all.add_argument('--sent_masks', nargs='*', type=str, default='all')
-    cmd_gen_all.add_argument('--split', nargs=3, type=int, default=(config.SPLIT['train'], config.SPLIT['val'], config.SPLIT['test']))
+    cmd_gen_random = cmd_gen_types.add_parser('random')
+    cmd_gen_random.set_defaults(func=run_generate, kind='random')
+    cmd_gen_random.add_argument('count', type=int)
+    _add_generate_arguments(cmd_gen_random)
+    cmd_gen_random.add_argument('--seed', type=int, default=config.SEED)
+
+    # Add options for specs of several jobs
+    cmd_gen_spec = cmd_gen_types.add_parser('spec')
+    cmd_gen_spec.set_defaults(func=run_spec)
+    cmd_gen_spec.add_argument('file', type=str)
+    cmd_gen_spec.add_argument('--plan', action='store_true')
+    cmd_gen_spec.add_argument('--cprofile', type=str, default=None)
+
+    # Add options for export
+    cmd_export = subparsers.add_parser('export')
+    cmd_export.set_defaults(func=run_export)
+    cmd_export.add_argument('--path', type=str, default=config.DATASET_PATH)
+    cmd_export.add_argument('--out', type=str, default=config.EXPORT_PATH)
+    cmd_export.add_argument('--sent_formats', nargs='*', type=str, default='all')
+    cmd_export.add_argument('--sent_masks', nargs='*', type=str, default='all')
+    cmd_export.add_argument('--layout', type=str, choices=['strings', 'tokens'], default='tokens')
+    cmd_export.add_argument('--shard_size', type=int, default=config.EXPORT_SHARD_SIZE)
+
+    # Add options for benchmarks
+    cmd_bench = subparsers.add_parser('benchmark')
+    cmd_bench.set_defaults(func=lambda arguments: cmd_bench.print_help())
+    cmd_bench_types = cmd_bench.add_subparsers(help='Run benchmarks or compare results')
+
+    cmd_bench_run = cmd_bench_types.add_parser('run')
+    cmd_bench_run.set_defaults(func=run_benchmark)
+    cmd_bench_run.add_argument('--out', type=str, default=config.BENCH_PATH)
+    cmd_bench_run.add_argument('--baseline', type=str, default=None)
+    cmd_bench_run.add_argument('--samples', type=int, default=config.BENCH_SAMPLES)
+    cmd_bench_run.add_argument('--repeat', type=int, default=config.BENCH_REPEAT)
+    cmd_bench_run.add_argument('--names', nargs='*', type=str, default=None)
+    cmd_bench_run.add_argument('--threshold', type=float, default=config.BENCH_THRESHOLD)
+
+    cmd_bench_compare = cmd_bench_types.add_parser('compare')
+    cmd_bench_compare.set_defaults(func=run_compare)
+    cmd_bench_compare.add_argument('results', type=str)
+    cmd_bench_compare.add_argument('baseline', type=str)
+    cmd_bench_compare.add_argument('--threshold', type=float, default=config.BENCH_THRESHOLD)
 
     args = parser.parse_args()
     args.func(args)
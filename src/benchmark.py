@@ -0,0 +1,209 @@
+"""This module contains throughput benchmarks of dataset generation.
+
+Every benchmark measures samples per second of one path: each format in
+formats.formats, each mask in masks.masks, the generation of all and random
+samples, and the HDF5 write and read paths. Generation runs the shards of
+generate_all and generate_random; all samples are generated from the first
+combinations of the shortest length. Benchmarks are swept across value
+ranges and list lengths. Results are stored as JSON, such that a run can be
+compared with a stored baseline to flag regressions.
+
+Example:
+    `
+    results = run_benchmarks()
+    save_results(results, 'benchmark.json')
+    regressions = compare_results(results, load_results('baseline.json'))
+    `
+"""
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+import tables
+
+from src import config
+from src.data import dataset, formats, masks
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+class Regression(NamedTuple):
+    name: str
+    baseline: float
+    current: float
+    change: float
+
+
+def _measure(fn: Callable[[], int], repeat: int) -> Dict[str, float]:
+    """Runs a benchmark several times and keeps the fastest run.
+
+    The function returns the number of samples it processed.
+    """
+    best, samples = float('inf'), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        samples = fn()
+        best = min(best, time.perf_counter() - start)
+    return {'samples': samples, 'seconds': best, 'samples_per_sec': samples / best if best > 0 else float('inf')}
+
+
+def _random_block(count: int, val_range: Tuple[int, int], len_range: Tuple[int, int], rng: np.random.Generator)\
+        -> dataset.SampleBlock:
+    """Draws a block of random number lists with a single masked variant each."""
+    return next(dataset._random_blocks(count, 'mask_one_number', 'maximum', val_range, len_range, rng, count))
+
+
+def _benchmark_formats(block: dataset.SampleBlock, repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, sentence_format in formats.formats.items():
+        def run():
+            return len(sentence_format.format_batch('maximum', block.nums, block.targets, block.lengths))
+        results[f"format/{name}"] = _measure(run, repeat)
+    return results
+
+
+def _benchmark_masks(block: dataset.SampleBlock, repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    sentences = formats.format_1.format_batch('maximum', block.nums, block.targets, block.lengths)
+    for name, mask_fn in masks.masks.items():
+        def run():
+            return sum(1 for sentence in sentences for _ in mask_fn(sentence))
+        results[f"mask/{name}"] = _measure(run, repeat)
+    return results
+
+
+def _benchmark_generation(count: int, val_range: Tuple[int, int], len_range: Tuple[int, int],
+                          repeat: int) -> Dict[str, Dict[str, float]]:
+    # Produce single shards the way generate_all and generate_random do, masked by mask_one_number
+    length = len_range[0]
+
+    # Every combination has length + 1 variants, so about count samples are generated
+    shard_all = next(dataset._all_shards('format_1', ('mask_one_number',), val_range, (length, length + 1),
+                                         shard_size=-(-count // (length + 1))))
+    shard_random = next(dataset._random_shards(count, 'format_1', ('mask_one_number',), val_range, len_range,
+                                               shard_size=count))._replace(entropy=0)
+
+    def run(shard):
+        rows, _, _ = dataset._produce_shard(shard)['mask_one_number']
+        return len(rows)
+
+    return {
+        'generate/all': _measure(lambda: run(shard_all), repeat),
+        'generate/random': _measure(lambda: run(shard_random), repeat),
+    }
+
+
+def _benchmark_hdf5(count: int, val_range: Tuple[int, int], len_range: Tuple[int, int],
+                    repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for storage in ('strings', 'canonical'):
+            path = os.path.join(tmpdir, f"{storage}.h5")
+            dataset.generate_random(count, val_range, len_range, path=path, rewrite=True, sent_formats='format_1',
+                                    sent_masks='mask_one_number', split={'train': 1.0}, seed=0, storage=storage)
+            with tables.open_file(path, mode='r') as h5file:
+                group = h5file.root.datasets.format_1_mask_one_number
+                rows = group.train.read()
+                description, filters, chunkshape = group.train.description, group.train.filters, group.train.chunkshape
+
+                def run_read():
+                    return len(dataset.read_samples(group.train))
+                results[f"hdf5/read/{storage}"] = _measure(run_read, repeat)
+
+            def run_write():
+                with tables.open_file(os.path.join(tmpdir, "write.h5"), mode='w') as h5file:
+                    table = h5file.create_table('/', 'train', description, filters=filters, chunkshape=chunkshape)
+                    writer = dataset._ChunkWriter({'train': table}, {'train': 1.0})
+                    writer.write_rows(rows)
+                    writer.flush()
+                return len(rows)
+            results[f"hdf5/write/{storage}"] = _measure(run_write, repeat)
+    return results
+
+
+def run_benchmarks(
+        samples: int = config.BENCH_SAMPLES,
+        val_ranges: List[Tuple[int, int]] = config.BENCH_VAL_RANGES,
+        len_ranges: List[Tuple[int, int]] = config.BENCH_LEN_RANGES,
+        repeat: int = config.BENCH_REPEAT, names: Optional[List[str]] = None) -> Dict:
+    """Runs all benchmarks for every value range and list length range.
+
+    Args:
+        samples: The number of samples processed by each benchmark.
+        val_ranges: Value ranges [start, end) to sweep.
+        len_ranges: List length ranges [start, end) to sweep.
+        repeat: The number of runs of each benchmark. The fastest is kept.
+        names: Prefixes of the benchmarks to run, such as 'format' or
+            'hdf5/read'. Defaults to all benchmarks.
+
+    Returns:
+        A dictionary with the environment of the run under 'meta', and the
+        results under 'results', keyed by benchmark name, value range and
+        length range.
+    """
+    suites = {
+        'format': lambda block, val_range, len_range: _benchmark_formats(block, repeat),
+        'mask': lambda block, val_range, len_range: _benchmark_masks(block, repeat),
+        'generate': lambda block, val_range, len_range: _benchmark_generation(samples, val_range, len_range, repeat),
+        'hdf5': lambda block, val_range, len_range: _benchmark_hdf5(samples, val_range, len_range, repeat),
+    }
+    results = {}
+    for val_range in val_ranges:
+        for len_range in len_ranges:
+            block = _random_block(samples, tuple(val_range), tuple(len_range), np.random.default_rng(0))
+            for suite_name, suite in suites.items():
+                if names and not any(name.split('/')[0] == suite_name for name in names):
+                    continue
+                for name, result in suite(block, tuple(val_range), tuple(len_range)).items():
+                    if names and not any(name.startswith(prefix) for prefix in names):
+                        continue
+                    key = "{name}/val={val[0]}:{val[1]}/len={len[0]}:{len[1]}".format(
+                        name=name, val=val_range, len=len_range)
+                    results[key] = result
+
+    meta = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tables': tables.__version__,
+        'platform': platform.platform(),
+        'samples': samples,
+        'repeat': repeat,
+    }
+    return {'meta': meta, 'results': results}
+
+
+def save_results(results: Dict, path: str):
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> Dict:
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def compare_results(results: Dict, baseline: Dict, threshold: float = config.BENCH_THRESHOLD) -> List[Regression]:
+    """Returns the benchmarks that are slower than the baseline.
+
+    Args:
+        results: Results of run_benchmarks.
+        baseline: Results of a previous run.
+        threshold: The relative drop of samples per second that counts as a
+            regression, e.g. 0.1 for 10%.
+
+    Returns:
+        List of regressions, ordered from the largest drop. Benchmarks missing
+        from either run are ignored.
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        before, after = baseline['results'][name]['samples_per_sec'], result['samples_per_sec']
+        change = after / before - 1
+        if change < -threshold:
+            regressions.append(Regression(name=name, baseline=before, current=after, change=change))
+    return sorted(regressions, key=lambda regression: regression.change)
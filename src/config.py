@@ -1,5 +1,7 @@
 import os
 
+import numpy as np
+
 cwd = os.getcwd()
 
 NUMS_VAL_RANGE = (0, 100)
@@ -8,8 +10,50 @@ TASKS = {
     "minimum": min,
     "maximum": max,
 }
+# Vectorized counterparts of TASKS, reduced along the last axis of a block
+TASKS_VECTORIZED = {
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+}
 DATASET_COLS = ["feature", "label"]
 DATASET_PATH = os.path.join(cwd, "data/pretrain/dataset.h5")
 MASK_TOKEN = "<extra_id_{0}>"
 SPLIT = {'train': 0.7, 'val': 0.1, 'test': 0.2}
 DATASET_REWRITE = False
+BLOCK_SIZE = 10000
+BATCH_SIZE = 10000
+SEED = None
+CHUNK_SIZE = 10000
+SHARD_SIZE = 10000
+WORKERS = 1
+QUEUE_SIZE = 4
+COMPLIB = 'blosc:zstd'
+COMPLEVEL = 5
+CANONICAL_CHUNKSHAPE = 16384
+READ_BATCH_SIZE = 256
+READ_SIZE = 16384
+SHUFFLE_BUFFER = 65536
+PREFETCH = 4
+MASK_SENTINELS = 100
+# Numbers masked at once by mask_multiple_numbers, and the number of subsets
+# sampled per sentence with more subsets (None for all of them)
+MASK_SPANS = 2
+MASK_SPANS_CAP = 10
+MASK_SPANS_SEED = 0
+# Sentences whose sampled subsets, and ranks whose subsets, are kept for reuse
+MASK_SPANS_CACHE = 4096
+# Digit totals and target counts of prefixes kept for reuse by virtual datasets
+VIRTUAL_CACHE = 65536
+EXPORT_PATH = os.path.join(cwd, "data/export")
+EXPORT_SHARD_SIZE = 1000000
+SPLIT_MODES = ('index', 'hash', 'hash_format')
+SPLIT_MODE = 'index'
+BENCH_SAMPLES = 20000
+BENCH_VAL_RANGES = [(0, 100), (-10000, 10000)]
+BENCH_LEN_RANGES = [(5, 10), (10, 20)]
+BENCH_REPEAT = 3
+BENCH_THRESHOLD = 0.1
+BENCH_PATH = os.path.join(cwd, "benchmark.json")
+DRY_RUN_SAMPLES = 2000
+MAX_BYTES = None
+MAX_SECONDS = None
@@ -3,17 +3,41 @@
 The datasets are stored in a single HDF5 file for faster access. Both generation
 functions write all data to a common file, such that each format-mask pair is
 stored as a separate table, named with the format {sent_format}_{sent_mask}.
+
+Along with the samples, every table stores indexed metadata columns, such as
+the list length, value range and target position, to select subsets with
+read_where without scanning the table.
+
+Every completed group records a manifest in its attributes: the generation
+parameters, a hash of the code of its format and mask, the seed and the row
+counts. Incremental runs skip groups whose manifest matches, and only rebuild
+groups that are missing or stale.
 """
-import random
+import contextlib
+import hashlib
+import inspect
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections import deque
 
-from src.data import formats, masks
+from src.data import formats, masks, progress as progress_, tokenizer, utils
 from src import config
+import numpy as np
 import tables
-from itertools import product
+from fractions import Fraction
+from functools import lru_cache
+from itertools import chain, product
 from tables.table import Table
 from tables.group import Group
+from tables.attributeset import AttributeSet
 from src.data.masks import Sample
-from typing import List, Tuple, Union, Dict, Generator
+from typing import Callable, List, Tuple, Union, Dict, Generator, Iterable, NamedTuple, Optional
 
 
 class SampleTable(tables.IsDescription):
@@ -21,17 +45,21 @@ class SampleTable(tables.IsDescription):
     label = tables.StringCol(50)
 
 
-def _combine_iter(combinations: List[List[int]], data: List[int]) -> List[List[int]]:
-    """Returns a cartesian product of combinations and data."""
-    combinations_ = []
-    for combination in combinations:
-        for x in data:
-            nums = combination + [x]
-            combinations_.append(nums)
-    return combinations_
+class SampleBlock(NamedTuple):
+    """A block of samples before rendering.
 
+    Rows of nums are padded to a common width; only the first lengths[i]
+    entries of row i are valid. positions[i] is the index of the masked
+    variant of the sentence, in the order yielded by the masking function.
+    """
+    nums: np.ndarray
+    lengths: np.ndarray
+    targets: np.ndarray
+    positions: np.ndarray
 
-def _create_tables(h5file, sent_format, sent_mask, rewrite) -> Dict[str, Table]:
+
+def _create_tables(h5file, sent_format, sent_mask, rewrite, description=SampleTable,
+                   filters: Optional[tables.Filters] = None, chunkshape: Optional[int] = None) -> Dict[str, Table]:
     """Creates train-val-test tables for a format-mask pair."""
     group_name = "{sent_format}_{sent_mask}".format(sent_format=sent_format, sent_mask=sent_mask)
 
@@ -45,20 +73,220 @@ def _create_tables(h5file, sent_format, sent_mask, rewrite) -> Dict[str, Table]:
     # Create group and tables
     h5file.create_group(f"/datasets", group_name, group_name)
     data_tables = {
-        'train': h5file.create_table(h5file.root.datasets[group_name], 'train', SampleTable, 'train'),
-        'val': h5file.create_table(h5file.root.datasets[group_name], 'val', SampleTable, 'val'),
-        'test': h5file.create_table(h5file.root.datasets[group_name], 'test', SampleTable, 'test'),
+        table_type: h5file.create_table(h5file.root.datasets[group_name], table_type, description, table_type,
+                                        filters=filters, chunkshape=chunkshape)
+        for table_type in ('train', 'val', 'test')
     }
     return data_tables
 
 
-def _get_row(data_tables, counts, split: Dict[str, float]):
-    """Returns the row of the table that's lacking the most samples."""
-    count_total = max(1, sum(counts.values()))
-    caps = {table_type: split[table_type] * count_total - count for table_type, count in counts.items()}
-    table_type = max(caps, key=caps.get)
-    row = data_tables[table_type].row
-    return row, table_type
+def _nums_dtype(val_range: Tuple[int, int]) -> np.dtype:
+    """Returns the smallest integer type holding every value of a range."""
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= val_range[0] and val_range[1] - 1 <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _canonical_description(val_range: Tuple[int, int], len_range: Tuple[int, int]) -> Dict[str, tables.Col]:
+    """Returns the description of a table of canonical samples.
+
+    A canonical sample stores the numbers, padded to the maximum length, and
+    the ids of its task, format and mask along with the index of the masked
+    variant. Ids index the names stored in the group attributes.
+    """
+    max_len = len_range[1] - 1
+    return {
+        'nums': tables.Col.from_dtype(np.dtype((_nums_dtype(val_range), (max_len,))), pos=0),
+        'length': tables.UInt8Col(pos=1),
+        'task': tables.UInt8Col(pos=2),
+        'format': tables.UInt8Col(pos=3),
+        'mask': tables.UInt8Col(pos=4),
+        'position': tables.UInt16Col(pos=5),
+    }
+
+
+def _metadata_description(val_range: Tuple[int, int]) -> Dict[str, tables.Col]:
+    """Returns the description of the metadata columns written for every storage.
+
+    Columns:
+        length: The number of listed numbers.
+        min_value, max_value: The smallest and largest listed number.
+        target: The task target.
+        target_index: Index of the first listed number equal to the target.
+        masked_index: Index of the first masked number in the list, or -1 if
+            it is the target.
+    """
+    value_dtype = _nums_dtype(val_range)
+    return {
+        'length': tables.UInt8Col(pos=10),
+        'min_value': tables.Col.from_dtype(value_dtype, pos=11),
+        'max_value': tables.Col.from_dtype(value_dtype, pos=12),
+        'target': tables.Col.from_dtype(value_dtype, pos=13),
+        'target_index': tables.UInt8Col(pos=14),
+        'masked_index': tables.Int8Col(pos=15),
+    }
+
+
+# Modes of assigning samples to splits
+SPLIT_MODES = config.SPLIT_MODES
+
+_METADATA_COLUMNS = ('length', 'min_value', 'max_value', 'target', 'target_index', 'masked_index')
+
+
+def _token_description(val_range: Tuple[int, int], len_range: Tuple[int, int]) -> Dict[str, tables.Col]:
+    """Returns the description of token id columns, padded to the longest sample."""
+    sent_width, label_width = tokenizer.max_lengths(val_range, len_range)
+    return {
+        'sent_ids': tables.Int16Col(shape=(sent_width,), dflt=tokenizer.get_tokenizer().pad_id, pos=2),
+        'sent_len': tables.UInt16Col(pos=3),
+        'label_ids': tables.Int16Col(shape=(label_width,), dflt=tokenizer.get_tokenizer().pad_id, pos=4),
+        'label_len': tables.UInt16Col(pos=5),
+    }
+
+
+@lru_cache(maxsize=None)
+def _storage_layout(storage: str, val_range: Tuple[int, int], len_range: Tuple[int, int])\
+        -> Tuple[Dict[str, tables.Col], Optional[tables.Filters], Optional[int]]:
+    """Returns the description, filters and chunkshape of a storage layout.
+
+    Layouts:
+        strings: Rendered sentences and labels.
+        tokens: Padded token ids and lengths of sentences and labels.
+        strings_tokens: Both of the above.
+        canonical: Compressed numbers and ids, rendered on read.
+
+    All layouts include the metadata columns of _metadata_description.
+    """
+    strings = {'sent': tables.StringCol(200, pos=0), 'label': tables.StringCol(50, pos=1)}
+    metadata = _metadata_description(val_range)
+    if storage == 'strings':
+        return dict(strings, **metadata), None, None
+    if storage == 'tokens':
+        return dict(_token_description(val_range, len_range), **metadata), None, None
+    if storage == 'strings_tokens':
+        return dict(strings, **_token_description(val_range, len_range), **metadata), None, None
+    if storage == 'canonical':
+        filters = tables.Filters(complevel=config.COMPLEVEL, complib=config.COMPLIB, shuffle=True)
+        return dict(_canonical_description(val_range, len_range), **metadata), filters, config.CANONICAL_CHUNKSHAPE
+    raise KeyError(f"Storage \"{storage}\" does not exist.")
+
+
+def _storage_dtype(storage: str, val_range: Tuple[int, int], len_range: Tuple[int, int]) -> np.dtype:
+    """Returns the row type of a storage layout."""
+    return tables.Description(_storage_layout(storage, tuple(val_range), tuple(len_range))[0])._v_dtype
+
+
+def _split_indices(points: np.ndarray, split: Dict[str, float]) -> np.ndarray:
+    """Maps points in [0, 1) to splits by their cumulative ratios.
+
+    Returns:
+        Array of indices into the keys of split.
+    """
+    ratios = np.array(list(split.values()), dtype=np.float64)
+    thresholds = np.cumsum(ratios) / ratios.sum()
+    return np.minimum(np.searchsorted(thresholds, points, side='right'), len(ratios) - 1)
+
+
+def _assign_splits(start: int, size: int, split: Dict[str, float]) -> np.ndarray:
+    """Assigns the samples [start, start + size) to splits.
+
+    Each sample index is mapped to [0, 1) with a golden-ratio (Weyl) sequence,
+    which spreads consecutive indices evenly, and then to a split by its
+    cumulative ratio. The assignment depends only on the index, so a whole
+    chunk is assigned at once.
+
+    Returns:
+        Array of indices into the keys of split.
+    """
+    indices = np.arange(start, start + size, dtype=np.uint64)
+    points = (indices * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(11)
+    return _split_indices(points.astype(np.float64) / 2 ** 53, split)
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    """Scrambles 64-bit hashes with the SplitMix64 finalizer."""
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def _hash_splits(block: SampleBlock, task_name: str, sent_format: Optional[str], split: Dict[str, float])\
+        -> np.ndarray:
+    """Assigns the samples of a block to splits by hashing their numbers.
+
+    The key of a sample is its task and number list, and its format if passed.
+    Samples with the same key land in the same split regardless of the mask,
+    the generation order or the number of workers.
+
+    Returns:
+        Array of indices into the keys of split.
+    """
+    key = list(config.TASKS).index(task_name) + 1
+    if sent_format is not None:
+        key += (list(formats.formats).index(sent_format) + 1) << 8
+    hashes = _mix(np.full(len(block.lengths), key, dtype=np.uint64))
+
+    # Combine the valid numbers of each row in order, then the length
+    valid = utils.length_mask(block.lengths, block.nums.shape[1])
+    nums = block.nums.astype(np.int64).view(np.uint64)
+    for col in range(block.nums.shape[1]):
+        hashes = np.where(valid[:, col], _mix(hashes ^ nums[:, col]), hashes)
+    hashes = _mix(hashes ^ block.lengths.astype(np.uint64))
+    return _split_indices((hashes >> np.uint64(11)).astype(np.float64) / 2 ** 53, split)
+
+
+class _ChunkWriter:
+    """Writes samples to train-val-test tables in chunks.
+
+    Samples are buffered in a preallocated structured array matching the
+    tables. Once chunk_size samples are buffered, they are assigned to
+    splits at once and appended to each table with a single Table.append.
+    """
+    def __init__(self, data_tables: Dict[str, Table], split: Dict[str, float],
+                 chunk_size: int = config.CHUNK_SIZE, counts: Optional[Dict[str, int]] = None):
+        self.data_tables = data_tables
+        self.split = split
+        self.chunk_size = chunk_size
+        self.buffer = np.empty(chunk_size, dtype=next(iter(data_tables.values())).dtype)
+        self.splits = np.empty(chunk_size, dtype=np.int64)
+        self.size = 0
+        self.counts = dict(counts) if counts else {table_type: 0 for table_type in split}
+
+    def write_rows(self, rows: np.ndarray, splits: Optional[np.ndarray] = None):
+        """Buffers table rows, appending full chunks to the tables.
+
+        Args:
+            rows: Structured array of table rows.
+            splits: Index of the split of each row. Defaults to the assignment
+                by row index of _assign_splits.
+        """
+        if splits is None:
+            splits = _assign_splits(sum(self.counts.values()) + self.size, len(rows), self.split)
+        while len(rows):
+            count = min(len(rows), self.chunk_size - self.size)
+            self.buffer[self.size:self.size + count] = rows[:count]
+            self.splits[self.size:self.size + count] = splits[:count]
+            self.size += count
+            rows, splits = rows[count:], splits[count:]
+            if self.size == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """Appends buffered samples to their tables and flushes the tables."""
+        if self.size:
+            # Append the rows of each split at once
+            buffer = self.buffer[:self.size]
+            assignment = self.splits[:self.size]
+            for i, table_type in enumerate(self.split):
+                rows = buffer[assignment == i]
+                if len(rows):
+                    self.data_tables[table_type].append(rows)
+                    self.counts[table_type] += len(rows)
+            self.size = 0
+        for table in self.data_tables.values():
+            table.flush()
 
 
 def _parse_params(sent_formats: Union[str, List[str]], sent_masks: Union[str, List[str]]) -> (List[str], List[str]):
@@ -91,29 +319,11 @@ def _generate_samples_all(
         sent_format: str, sent_mask: str, task_name: str,
         val_range: Tuple[int, int], len_range: Tuple[int, int])\
         -> Generator[Sample, None, None]:
-    # Generate examples
-    start, end = len_range
-    data = list(range(*val_range))
-    combinations = list(map(lambda x: [x], data))
-
-    # Create initial data
-    for i in range(start - 2):
-        combinations = _combine_iter(combinations, data)
-
-    # Generate tasks for combinations
-    for _ in range(start, end):
-        combinations = _combine_iter(combinations, data)
-
-        # For each combination, generate all samples
-        for combination in combinations:
-            # Generate samples for combination
-            target = config.TASKS[task_name](combination)
-            sentence = formats.formats[sent_format](task_name, combination, target)
-            samples = masks.masks[sent_mask](sentence)
-
-            # Write samples to table
-            for sample in samples:
-                yield sample
+    """Generates the samples of all combinations of a task, in the order written by generate_all."""
+    for shard in _all_shards(sent_format, (sent_mask,), val_range, len_range):
+        if shard.task_name == task_name:
+            rows, _, _ = _produce_shard(shard)[sent_mask]
+            yield from _string_samples(rows)
 
 
 def generate_all(
@@ -122,13 +332,19 @@ def generate_all(
         path: str = config.DATASET_PATH, rewrite: bool = False,
         sent_formats: Union[str, List[str]] = 'all',
         sent_masks: Union[str, List[str]] = 'all',
-        split: Dict[str, float] = config.SPLIT):
+        split: Dict[str, float] = config.SPLIT, chunk_size: int = config.CHUNK_SIZE,
+        workers: int = config.WORKERS, storage: str = 'strings', resume: bool = False,
+        split_mode: str = config.SPLIT_MODE, progress: bool = False, profile: Optional[str] = None,
+        dry_run: bool = False, max_bytes: Optional[float] = config.MAX_BYTES,
+        max_seconds: Optional[float] = config.MAX_SECONDS, incremental: bool = False, pipeline: bool = False,
+        queue_size: int = config.QUEUE_SIZE) -> Dict:
     """Generates and writes a dataset with all combinations.
 
     This method generates all possible combinations of numbers in a value range
     config.NUMS_VAL_RANGE and of a length between config.NUMS_LEN_RANGE. Each
     combination is then formatted into a sentence. This sentence has different
-    parts masked to generate several masks.
+    parts masked to generate several masks. Each combination is formatted once
+    per format and masked by all masks in the same pass.
 
     Example:
         Numbers: [1, 2, 3, 4]; Task: maximum
@@ -146,53 +362,503 @@ def generate_all(
         sent_formats: One or more sentence formats.
         sent_masks: One or more methods of masking.
         split: A train-val-test split ratio.
+        chunk_size: The number of samples appended to the tables at once.
+        workers: The number of worker processes generating shards.
+        storage: Table layout: 'strings' for rendered samples, 'tokens' for
+            padded token ids, 'strings_tokens' for both, or 'canonical' for
+            compressed numbers and ids. All layouts can be read as samples
+            with read_samples.
+        resume: If set, existing groups continue from their checkpoint where
+            the previous run stopped, instead of raising an error or being
+            rewritten.
+        split_mode: Assignment of samples to splits: 'index' by row index,
+            'hash' by a hash of the task and numbers, or 'hash_format' by a
+            hash of the task, numbers and format. Hashed modes keep all
+            samples of a number list in the same split.
+        progress: If set, throughput, completion and ETA are printed while
+            generating.
+        profile: Path of a JSON summary with the time spent in every stage
+            per group. Optional.
+        dry_run: If set, the run is only estimated with estimate_all.
+        max_bytes: Budget of the file size. Runs estimated to exceed it, or
+            the free disk space, are refused. Optional.
+        max_seconds: Budget of the run time. Runs estimated to exceed it are
+            refused. Optional.
+        incremental: If set, groups completed with the same parameters and
+            code are skipped, and missing or stale groups are rebuilt.
+        pipeline: If set, a separate thread writes shards while the next
+            ones are produced.
+        queue_size: The maximum number of produced shards waiting for the
+            writer thread.
+
+    Returns:
+        Summary of the run, as returned by progress.Tracker.summary, with the
+        names of skipped groups under 'skipped', or the estimate of
+        estimate_all for dry runs.
+
+    Raises:
+        ValueError: If the run is estimated to exceed a budget.
     """
     # Check arguments
     sent_formats_, sent_masks_ = _parse_params(sent_formats, sent_masks)
 
-    # Open or create dataset file
-    with tables.open_file(path, mode="a", title="Datasets") as h5file:
-        # Create a group if it doesn't exist
-        if '/datasets' not in h5file:
-            h5file.create_group('/', 'datasets', 'Datasets')
+    # Estimate the run before writing anything
+    if dry_run or max_bytes is not None or max_seconds is not None:
+        estimate = estimate_all(val_range, len_range, sent_formats_, sent_masks_, split, workers, storage)
+        if dry_run:
+            return estimate
+        _check_budget(estimate, path, max_bytes, max_seconds)
 
-        # Generate all task-format-mask pairs
-        for sent_format, sent_mask in product(sent_formats_, sent_masks_):
-            # Initialize counts
-            counts = {'train': 0, 'val': 0, 'test': 0}
-
-            # Create train-val-test tables
-            data_tables = _create_tables(h5file, sent_format, sent_mask, rewrite)
-            for task_name in config.TASKS.keys():
-                for sample in _generate_samples_all(sent_format, sent_mask, task_name, val_range, len_range):
-                    # Pick row and append a sample
-                    row, table_type = _get_row(data_tables, counts, split)
-                    row['sent'] = sample.sent
-                    row['label'] = sample.label
-                    row.append()
-                    counts[table_type] += 1
-
-        # Flush tables
-        for table in data_tables.values():
-            table.flush()
+    params = {
+        'kind': 'all', 'val_range': tuple(val_range), 'len_range': tuple(len_range),
+        'split': dict(split), 'split_mode': split_mode, 'storage': storage, 'shard_size': config.SHARD_SIZE,
+    }
 
+    # Split every task-format stream into shards of combinations, masked by all masks at once
+    groups = list(product(sent_formats_, sent_masks_))
+    shards = chain.from_iterable(
+        _all_shards(sent_format, tuple(sent_masks_), val_range, len_range, storage, params['shard_size'], split,
+                    split_mode)
+        for sent_format in sent_formats_)
+    units = len(config.TASKS) * sum(utils.count_combinations(val_range, length) for length in range(*len_range))
+    return _generate(path, groups, shards, params, rewrite, chunk_size, workers, resume=resume, units=units,
+                     progress=progress, profile=profile, incremental=incremental, pipeline=pipeline,
+                     queue_size=queue_size)
 
-def _generate_samples_random(
-        count: int, sent_format: str, sent_mask: str, task_name: str,
-        val_range: Tuple[int, int], len_range: Tuple[int, int])\
+
+def _sample_costs(sent_format: str, sent_mask: str, val_range: Tuple[int, int], len_range: Tuple[int, int],
+                  storage: str, sample_size: int) -> Tuple[float, float, float]:
+    """Generates and writes a sample of a group to measure its costs.
+
+    The sample is a run of combinations of the longest length, which make up
+    most of the samples, starting at a random combination. Starts are drawn
+    among the combinations that can be indexed with int64, so oversized ranges
+    are sampled as well.
+
+    Returns:
+        produce: Seconds to generate a sample.
+        write: Seconds to write a sample.
+        size: Bytes of a sample in the file.
+    """
+    length = len_range[1] - 1
+    total = min(utils.count_combinations(val_range, length), np.iinfo(np.int64).max)
+    start = int(np.random.default_rng(0).integers(max(total - sample_size, 0) + 1))
+    shard = _Shard(sent_format, (sent_mask,), next(iter(config.TASKS)), val_range, len_range, start,
+                   min(start + sample_size, total), length=length, storage=storage)
+
+    times = progress_.StageTimes()
+    with times.stage('produce'):
+        rows, splits, _ = _produce_shard(shard)[sent_mask]
+    description, filters, chunkshape = _storage_layout(storage, tuple(val_range), tuple(len_range))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "sample.h5")
+        with times.stage('write'):
+            with tables.open_file(path, mode='w') as h5file:
+                table = h5file.create_table('/', 'train', description, filters=filters, chunkshape=chunkshape)
+                writer = _ChunkWriter({'train': table}, {'train': 1.0})
+                writer.write_rows(rows)
+                writer.flush()
+                _index_metadata(table)
+        size = os.path.getsize(path)
+    count = max(len(rows), 1)
+    return times.seconds['produce'] / count, times.seconds['write'] / count, size / count
+
+
+def _split_counts(samples: int, split: Dict[str, float]) -> Dict[str, int]:
+    """Divides a number of samples by the split ratios with exact integer arithmetic."""
+    ratios = {table_type: Fraction(ratio).limit_denominator(10 ** 6) for table_type, ratio in split.items()}
+    total = sum(ratios.values())
+    counts = {table_type: int(samples * ratio / total) for table_type, ratio in ratios.items()}
+
+    # Give the remainder to the first split
+    counts[next(iter(counts))] += samples - sum(counts.values())
+    return counts
+
+
+def estimate_all(
+        val_range: Tuple[int, int] = config.NUMS_VAL_RANGE,
+        len_range: Tuple[int, int] = config.NUMS_LEN_RANGE,
+        sent_formats: Union[str, List[str]] = 'all',
+        sent_masks: Union[str, List[str]] = 'all',
+        split: Dict[str, float] = config.SPLIT, workers: int = config.WORKERS, storage: str = 'strings',
+        sample_size: int = config.DRY_RUN_SAMPLES) -> Dict:
+    """Estimates the size and the duration of generate_all without running it.
+
+    Sample counts are exact and computed in closed form. Counts per split
+    follow the split ratios; the actual counts differ by a few samples. Bytes
+    and seconds are extrapolated from generating and writing sample_size
+    combinations of each group. Pass sample_size=0 to only count samples.
+
+    Returns:
+        A dictionary with the number of samples, bytes and seconds of the run,
+        and the samples of each group and split under 'groups'.
+    """
+    sent_formats_, sent_masks_ = _parse_params(sent_formats, sent_masks)
+    estimate = {'samples': 0, 'bytes': 0.0 if sample_size else None, 'seconds': 0.0 if sample_size else None,
+                'groups': {}}
+    for sent_format, sent_mask in product(sent_formats_, sent_masks_):
+        samples = sum(_count_all_samples(sent_mask, task_name, val_range, length)
+                      for task_name in config.TASKS for length in range(*len_range))
+        group = {'samples': samples, 'splits': _split_counts(samples, split)}
+        if sample_size:
+            produce, write, size = _sample_costs(sent_format, sent_mask, val_range, len_range, storage, sample_size)
+            group['bytes'] = samples * size
+            group['seconds'] = samples * (produce / max(workers, 1) + write)
+            estimate['bytes'] += group['bytes']
+            estimate['seconds'] += group['seconds']
+        estimate['samples'] += samples
+        estimate['groups']["{sent_format}_{sent_mask}".format(sent_format=sent_format, sent_mask=sent_mask)] = group
+    return estimate
+
+
+def _check_budget(estimate: Dict, path: str, max_bytes: Optional[float], max_seconds: Optional[float]):
+    """Refuses runs exceeding the disk or time budget, or the free disk space."""
+    directory = os.path.dirname(os.path.abspath(path))
+    free = shutil.disk_usage(directory).free if os.path.isdir(directory) else None
+    if max_bytes is not None and estimate['bytes'] > max_bytes:
+        raise ValueError(f"Estimated size of {estimate['bytes']:.3g} bytes exceeds the budget of "
+                         f"{max_bytes:.3g} bytes.")
+    if free is not None and estimate['bytes'] > free:
+        raise ValueError(f"Estimated size of {estimate['bytes']:.3g} bytes exceeds the free space of {free:.3g} bytes.")
+    if max_seconds is not None and estimate['seconds'] > max_seconds:
+        raise ValueError(f"Estimated time of {estimate['seconds']:.0f}s exceeds the budget of {max_seconds:.0f}s.")
+
+
+def _block_targets(task_name: str, nums: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Computes the task target of every row of a padded block."""
+    # Pad each row with its first value, which never changes the target
+    padded = np.where(utils.length_mask(lengths, nums.shape[1]), nums, nums[:, :1])
+    return config.TASKS_VECTORIZED[task_name].reduce(padded, axis=1)
+
+
+def _count_candidates(sent_mask: str, nums: np.ndarray, lengths: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Counts the masked variants of each row's sentence without rendering it."""
+    if sent_mask == 'mask_one_digit':
+        digits = np.where(utils.length_mask(lengths, nums.shape[1]), utils.count_digits(nums), 0)
+        return digits.sum(axis=1) + utils.count_digits(targets)
+    if sent_mask == 'mask_one_number':
+        # Every sentence contains the numbers and the target
+        return lengths + 1
+    if sent_mask == 'mask_multiple_numbers':
+        counts = [masks.count_span_sets(count, config.MASK_SPANS, config.MASK_SPANS_CAP)
+                  for count in range(int(lengths.max(initial=0)) + 2)]
+        return np.array(counts, dtype=np.int64)[lengths + 1]
+    raise KeyError(f"Mask \"{sent_mask}\" does not exist.")
+
+
+def _count_all_samples(sent_mask: str, task_name: str, val_range: Tuple[int, int], length: int) -> int:
+    """Counts the samples of all combinations of a length in closed form.
+
+    Equals the sum of _count_candidates over all combinations, without
+    enumerating them.
+    """
+    base = val_range[1] - val_range[0]
+    combinations = utils.count_combinations(val_range, length)
+    if sent_mask == 'mask_one_number':
+        return combinations * (length + 1)
+    if sent_mask == 'mask_multiple_numbers':
+        return combinations * masks.count_span_sets(length + 1, config.MASK_SPANS, config.MASK_SPANS_CAP)
+    if sent_mask != 'mask_one_digit':
+        raise KeyError(f"Mask \"{sent_mask}\" does not exist.")
+
+    # Every value appears base ** (length - 1) times in each position
+    intervals = utils.digit_intervals(val_range)
+    digits = length * base ** (length - 1) * sum((last - first + 1) * count for first, last, count in intervals)
+
+    # The number of combinations with a target in [first, last] telescopes
+    lo, hi = val_range
+    for first, last, count in intervals:
+        if task_name == 'maximum':
+            targets = (last - lo + 1) ** length - (first - lo) ** length
+        elif task_name == 'minimum':
+            targets = (hi - first) ** length - (hi - last - 1) ** length
+        else:
+            raise KeyError(f"Task \"{task_name}\" cannot be counted in closed form.")
+        digits += count * targets
+    return digits
+
+
+def _random_combinations(
+        count: int, task_name: str, val_range: Tuple[int, int], len_range: Tuple[int, int],
+        rng: np.random.Generator, batch_size: int = config.BATCH_SIZE)\
+        -> Generator[SampleBlock, None, None]:
+    """Draws random number lists in blocks of at most batch_size rows, without masked positions."""
+    max_len = len_range[1] - 1
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+
+        # Draw lengths and values, including padding
+        lengths = rng.integers(*len_range, size=size)
+        nums = rng.integers(*val_range, size=(size, max_len))
+        yield SampleBlock(nums=nums, lengths=lengths, targets=_block_targets(task_name, nums, lengths),
+                          positions=None)
+
+
+def _expand_block(block: SampleBlock, sent_mask: str, rng: Optional[np.random.Generator] = None)\
+        -> Tuple[SampleBlock, np.ndarray]:
+    """Assigns masked variants to the number lists of a block.
+
+    With rng, a random variant is picked for each row. Otherwise, each row is
+    repeated once per variant.
+
+    Returns:
+        block: The block of samples.
+        rows: Index of the row of the input block of each sample.
+    """
+    candidates = _count_candidates(sent_mask, block.nums, block.lengths, block.targets)
+    if rng is not None:
+        rows = np.arange(len(candidates))
+        positions = (rng.random(len(candidates)) * candidates).astype(np.int64)
+    else:
+        rows = np.repeat(np.arange(len(candidates)), candidates)
+        positions = np.arange(len(rows)) - np.repeat(np.cumsum(candidates) - candidates, candidates)
+    return SampleBlock(nums=block.nums[rows], lengths=block.lengths[rows], targets=block.targets[rows],
+                       positions=positions), rows
+
+
+def _random_blocks(
+        count: int, sent_mask: str, task_name: str,
+        val_range: Tuple[int, int], len_range: Tuple[int, int],
+        rng: np.random.Generator, batch_size: int = config.BATCH_SIZE)\
+        -> Generator[SampleBlock, None, None]:
+    """Draws random samples in blocks of at most batch_size rows."""
+    for block in _random_combinations(count, task_name, val_range, len_range, rng, batch_size):
+        yield _expand_block(block, sent_mask, rng)[0]
+
+
+def _render_block(block: SampleBlock, sent_format: str, sent_mask: str, task_name: str)\
         -> Generator[Sample, None, None]:
-    for _ in range(count):
-        # Generate random length
-        nums_l = random.randrange(*len_range)
-        nums = [random.randrange(*val_range) for _ in range(nums_l)]
+    """Renders the samples of a block as masked sentences."""
+    sentences, spans = formats.formats[sent_format].spans_batch(task_name, block.nums, block.targets, block.lengths)
+    mask_fn = masks.masks_at[sent_mask]
+    for sentence, sentence_spans, position in zip(sentences, spans, block.positions.tolist()):
+        yield mask_fn(sentence, position, sentence_spans)
+
+
+def _combinations(task_name: str, val_range: Tuple[int, int], length: int, start: int = 0,
+                  stop: Optional[int] = None, block_size: int = config.BLOCK_SIZE)\
+        -> Generator[SampleBlock, None, None]:
+    """Yields the combinations [start, stop) in blocks, without masked positions."""
+    for nums in utils.combination_blocks(val_range, length, block_size, start, stop):
+        lengths = np.full(len(nums), length)
+        yield SampleBlock(nums=nums, lengths=lengths, targets=_block_targets(task_name, nums, lengths),
+                          positions=None)
+
+
+def _canonical_rows(block: SampleBlock, dtype: np.dtype, sent_format: str, sent_mask: str, task_name: str)\
+        -> np.ndarray:
+    """Converts a block to rows of a canonical table."""
+    rows = np.zeros(len(block.lengths), dtype=dtype)
+    width = block.nums.shape[1]
+    rows['nums'][:, :width] = np.where(utils.length_mask(block.lengths, width), block.nums, 0)
+    rows['length'] = block.lengths
+    rows['task'] = list(config.TASKS).index(task_name)
+    rows['format'] = list(formats.formats).index(sent_format)
+    rows['mask'] = list(masks.masks).index(sent_mask)
+    rows['position'] = block.positions
+    return rows
+
+
+def _masked_numbers(block: SampleBlock, sent_format: str, sent_mask: str, task_name: str) -> np.ndarray:
+    """Returns the index of the first masked number of each row in the sentence order."""
+    if sent_mask == 'mask_one_number':
+        return block.positions
+    template = formats.formats[sent_format].template
+    spans = np.empty(len(block.lengths), dtype=np.int64)
+    if sent_mask == 'mask_multiple_numbers':
+        # Find the first number of the masked subset
+        for length in np.unique(block.lengths).tolist():
+            rows = np.flatnonzero(block.lengths == length)
+            count, spans_k, cap = length + 1, config.MASK_SPANS, config.MASK_SPANS_CAP
+            total = masks.count_span_sets(count, spans_k)
+            if cap is None or total <= cap:
+                # All subsets are masked, in the same order for every sentence
+                firsts = [masks.span_set_at(count, spans_k, k)[0] for k in range(total)]
+                spans[rows] = np.array(firsts, dtype=np.int64)[block.positions[rows]]
+                continue
+
+            # Sampled subsets depend on the numbers of each sentence
+            _, _, fields = formats._compile(template, task_name, length)
+            args = np.concatenate([block.nums[rows, :length], block.targets[rows, None]], axis=1)
+            firsts = {}
+            for row, numbers, position in zip(rows.tolist(), np.abs(args[:, fields]).tolist(),
+                                              block.positions[rows].tolist()):
+                # Sample the subsets of every sentence once for all of its variants
+                numbers = tuple(numbers)
+                if numbers not in firsts:
+                    key = masks.sample_key(map(str, numbers))
+                    firsts[numbers] = [subset[0] for subset in masks.span_sets(count, spans_k, cap, key)]
+                spans[row] = firsts[numbers][position]
+        return spans
+    if sent_mask == 'mask_one_digit':
+        # Find the number containing the masked digit
+        for length in np.unique(block.lengths).tolist():
+            rows = np.flatnonzero(block.lengths == length)
+            _, _, fields = formats._compile(template, task_name, length)
+            args = np.concatenate([block.nums[rows, :length], block.targets[rows, None]], axis=1)
+            ends = np.cumsum(utils.count_digits(args[:, fields]), axis=1)
+            spans[rows] = (ends <= block.positions[rows, None]).sum(axis=1)
+        return spans
+    raise KeyError(f"Mask \"{sent_mask}\" does not exist.")
+
+
+def _metadata_rows(rows: np.ndarray, block: SampleBlock, sent_format: str, sent_mask: str, task_name: str):
+    """Fills the metadata columns of the rows of a block."""
+    valid = utils.length_mask(block.lengths, block.nums.shape[1])
+    rows['length'] = block.lengths
+    rows['min_value'] = _block_targets('minimum', block.nums, block.lengths)
+    rows['max_value'] = _block_targets('maximum', block.nums, block.lengths)
+    rows['target'] = block.targets
+    rows['target_index'] = np.argmax(valid & (block.nums == block.targets[:, None]), axis=1)
+
+    # Map the masked number from the sentence order to the list order
+    spans = _masked_numbers(block, sent_format, sent_mask, task_name)
+    masked_index = np.empty(len(spans), dtype=np.int64)
+    template = formats.formats[sent_format].template
+    for length in np.unique(block.lengths).tolist():
+        rows_ = np.flatnonzero(block.lengths == length)
+        _, _, fields = formats._compile(template, task_name, length)
+        masked_index[rows_] = np.where(fields[spans[rows_]] == length, -1, fields[spans[rows_]])
+    rows['masked_index'] = masked_index
+
+
+def render_samples(rows: np.ndarray, attrs: AttributeSet) -> List[Sample]:
+    """Renders rows of a canonical table as samples.
+
+    Args:
+        rows: Structured array read from a canonical table.
+        attrs: Attributes of the table's group, naming the ids.
+
+    Returns:
+        List of samples.
+    """
+    samples = [None] * len(rows)
+    task_names, format_names, mask_names = attrs.tasks, attrs.formats, attrs.masks
+
+    # Render rows sharing a task, format and mask as one block
+    keys = np.stack([rows['task'], rows['format'], rows['mask']], axis=1)
+    for key in np.unique(keys, axis=0):
+        indices = np.flatnonzero((keys == key).all(axis=1))
+        task, sent_format, sent_mask = key.tolist()
+        nums = rows['nums'][indices].astype(np.int64)
+        lengths = rows['length'][indices].astype(np.int64)
+        block = SampleBlock(nums=nums, lengths=lengths, targets=_block_targets(task_names[task], nums, lengths),
+                            positions=rows['position'][indices].astype(np.int64))
+        rendered = _render_block(block, format_names[sent_format], mask_names[sent_mask], task_names[task])
+        for i, sample in zip(indices.tolist(), rendered):
+            samples[i] = sample
+    return samples
+
+
+def read_samples(table: Table, start: Optional[int] = None, stop: Optional[int] = None) -> List[Sample]:
+    """Reads samples from a table of any storage layout.
+
+    Example:
+        `
+        h5file, datasets = load_datasets(sent_formats='format_1', sent_masks='mask_one_digit')
+        samples = read_samples(datasets['format_1_mask_one_digit']['train'], 0, 100)
+        `
+
+    Args:
+        table: A train, val, or test table.
+        start: Index of the first row. Optional.
+        stop: Index after the last row. Optional.
+
+    Returns:
+        List of samples.
+    """
+    return _decode_rows(table, table.read(start, stop))
+
+
+def _decode_rows(table: Table, rows: np.ndarray) -> List[Sample]:
+    """Converts rows read from a table of any storage layout to samples."""
+    attrs = table._v_parent._v_attrs
+    if getattr(attrs, 'storage', 'strings') == 'canonical':
+        return render_samples(rows, attrs)
+    if 'sent' not in rows.dtype.names:
+        # Decode token ids with the vocabulary they were written with
+        tokenizer_ = tokenizer.Tokenizer(attrs.vocab)
+        return [Sample(sent=sent, label=label) for sent, label in zip(
+            tokenizer_.decode_batch(rows['sent_ids'], rows['sent_len']),
+            tokenizer_.decode_batch(rows['label_ids'], rows['label_len']))]
+    return _string_samples(rows)
 
-        # Generate samples for combination
-        target = config.TASKS[task_name](nums)
-        sentence = formats.formats[sent_format](task_name, nums, target)
-        samples = masks.masks[sent_mask](sentence)
 
-        # Yield a single sample
-        yield random.choice(list(samples))
+def _string_samples(rows: np.ndarray) -> List[Sample]:
+    """Converts rows with sentence and label strings to samples."""
+    return [Sample(sent=sent.decode(), label=label.decode())
+            for sent, label in zip(rows['sent'].tolist(), rows['label'].tolist())]
+
+
+def _where_condition(condition: Optional[str], conditions: Dict) -> Tuple[str, Dict]:
+    """Builds an in-kernel condition and its variables from conditions on metadata columns."""
+    parts = [f"({condition})"] if condition else []
+    condvars = {}
+    for i, (name, value) in enumerate(sorted(conditions.items())):
+        if name not in _METADATA_COLUMNS:
+            raise KeyError(f"Column \"{name}\" is not a metadata column.")
+        if isinstance(value, tuple):
+            # Ranges [low, high) with optional bounds
+            low, high = value
+            if low is not None:
+                parts.append(f"({name} >= low_{i})")
+                condvars[f"low_{i}"] = low
+            if high is not None:
+                parts.append(f"({name} < high_{i})")
+                condvars[f"high_{i}"] = high
+        else:
+            parts.append(f"({name} == value_{i})")
+            condvars[f"value_{i}"] = value
+    return " & ".join(parts), condvars
+
+
+def read_where(table: Table, condition: Optional[str] = None, **conditions) -> np.ndarray:
+    """Reads the rows of a table matching conditions on its metadata columns.
+
+    Conditions are evaluated with Table.read_where, which uses the indexes of
+    the metadata columns instead of scanning the table.
+
+    Example:
+        `
+        h5file, datasets = load_datasets(sent_formats='format_1', sent_masks='mask_one_number')
+        rows = read_where(datasets['format_1_mask_one_number']['test'], length=9, max_value=(91, None))
+        `
+
+    Args:
+        table: A train, val, or test table.
+        condition: A condition in the syntax of Table.where. Optional.
+        conditions: Conditions on metadata columns, by column name. A value
+            selects equal rows and a tuple (low, high) selects rows in
+            [low, high). Either bound of a range may be None.
+
+    Returns:
+        Structured array of the matching rows, in table order.
+    """
+    condition, condvars = _where_condition(condition, conditions)
+    if not condition:
+        return table.read()
+    return table.read_where(condition, condvars)
+
+
+def read_samples_where(table: Table, condition: Optional[str] = None, **conditions) -> List[Sample]:
+    """Reads the samples of a table matching conditions on its metadata columns.
+
+    Arguments are the same as read_where.
+    """
+    return _decode_rows(table, read_where(table, condition, **conditions))
+
+
+def _generate_samples_random(
+        count: int, sent_format: str, sent_mask: str, task_name: str,
+        val_range: Tuple[int, int], len_range: Tuple[int, int],
+        seed: Optional[int] = config.SEED, batch_size: int = config.BATCH_SIZE)\
+        -> Generator[Sample, None, None]:
+    """Generates the random samples of a task, in the order written by generate_random with the seed."""
+    entropy = np.random.SeedSequence(seed).entropy
+    for shard in _random_shards(count, sent_format, (sent_mask,), val_range, len_range, batch_size):
+        if shard.task_name == task_name:
+            rows, _, _ = _produce_shard(shard._replace(entropy=entropy))[sent_mask]
+            yield from _string_samples(rows)
 
 
 def generate_random(
@@ -201,11 +867,21 @@ def generate_random(
         path: str = config.DATASET_PATH, rewrite: bool = False,
         sent_formats: Union[str, List[str]] = 'all',
         sent_masks: Union[str, List[str]] = 'all',
-        split: Dict[str, float] = config.SPLIT):
+        split: Dict[str, float] = config.SPLIT, chunk_size: int = config.CHUNK_SIZE,
+        seed: Optional[int] = config.SEED, batch_size: int = config.BATCH_SIZE,
+        workers: int = config.WORKERS, storage: str = 'strings', resume: bool = False,
+        split_mode: str = config.SPLIT_MODE, progress: bool = False, profile: Optional[str] = None,
+        incremental: bool = False, pipeline: bool = False, queue_size: int = config.QUEUE_SIZE) -> Dict:
     """Generates and writes a dataset with random samples.
 
     The samples generated have values similar to generate_all, except for the
-    random generation.
+    random generation. Lengths, values, targets and masked positions are drawn
+    in blocks of batch_size samples with vectorized operations, and strings are
+    rendered only at the end. Every shard of config.SHARD_SIZE samples draws
+    from its own random streams derived from the seed, so the output does not
+    depend on the number of workers and an interrupted run can be resumed.
+    Number lists are drawn and formatted once per format and masked by all
+    masks, so the groups of a format share their number lists.
 
     Args:
         count: The number of samples.
@@ -216,36 +892,519 @@ def generate_random(
         sent_formats: One or more sentence formats.
         sent_masks: One or more methods of masking.
         split: A train-val-test split ratio.
+        chunk_size: The number of samples appended to the tables at once.
+        seed: Seed of the random number generator. Optional.
+        batch_size: The number of samples drawn at once.
+        workers: The number of worker processes generating shards.
+        storage: Table layout: 'strings' for rendered samples, 'tokens' for
+            padded token ids, 'strings_tokens' for both, or 'canonical' for
+            compressed numbers and ids. All layouts can be read as samples
+            with read_samples.
+        resume: If set, existing groups continue from their checkpoint where
+            the previous run stopped, instead of raising an error or being
+            rewritten.
+        split_mode: Assignment of samples to splits: 'index' by row index,
+            'hash' by a hash of the task and numbers, or 'hash_format' by a
+            hash of the task, numbers and format. Hashed modes keep all
+            samples of a number list in the same split.
+        progress: If set, throughput, completion and ETA are printed while
+            generating.
+        profile: Path of a JSON summary with the time spent in every stage
+            per group. Optional.
+        incremental: If set, groups completed with the same parameters, code
+            and seed are skipped, and missing or stale groups are rebuilt.
+        pipeline: If set, a separate thread writes shards while the next
+            ones are produced.
+        queue_size: The maximum number of produced shards waiting for the
+            writer thread.
+
+    Returns:
+        Summary of the run, as returned by progress.Tracker.summary, with the
+        names of skipped groups under 'skipped'.
     """
     # Parse arguments
     sent_formats_, sent_masks_ = _parse_params(sent_formats, sent_masks)
+    params = {
+        'kind': 'random', 'count': count, 'val_range': tuple(val_range), 'len_range': tuple(len_range),
+        'split': dict(split), 'split_mode': split_mode, 'storage': storage, 'shard_size': config.SHARD_SIZE,
+        'batch_size': batch_size,
+    }
+
+    # Split every task-format stream into shards of samples, masked by all masks at once
+    groups = list(product(sent_formats_, sent_masks_))
+    shards = chain.from_iterable(
+        _random_shards(count, sent_format, tuple(sent_masks_), val_range, len_range, batch_size, storage,
+                       params['shard_size'], split, split_mode)
+        for sent_format in sent_formats_)
+    return _generate(path, groups, shards, params, rewrite, chunk_size, workers, seed, resume,
+                     units=len(config.TASKS) * count, progress=progress, profile=profile, incremental=incremental,
+                     pipeline=pipeline, queue_size=queue_size)
+
+
+class _Shard(NamedTuple):
+    """An index range [start, stop) of one task-format stream, masked by every mask of sent_masks.
+
+    Shards of generate_all range over the combinations of a single length.
+    Shards of generate_random range over samples and draw them from their own
+    random streams, derived from the seed entropy: one for the number lists,
+    shared by all masks, and one per mask for the masked positions.
+    """
+    sent_format: str
+    sent_masks: Tuple[str, ...]
+    task_name: str
+    val_range: Tuple[int, int]
+    len_range: Tuple[int, int]
+    start: int
+    stop: int
+    length: Optional[int] = None
+    entropy: Optional[int] = None
+    batch_size: int = config.BATCH_SIZE
+    storage: str = 'strings'
+    split: Optional[Dict[str, float]] = None
+    split_mode: str = 'index'
+
+
+def _all_shards(
+        sent_format: str, sent_masks: Tuple[str, ...], val_range: Tuple[int, int], len_range: Tuple[int, int],
+        storage: str = 'strings', shard_size: int = config.SHARD_SIZE,
+        split: Optional[Dict[str, float]] = None, split_mode: str = 'index') -> Generator[_Shard, None, None]:
+    """Splits the combinations of a format into shards for all of its masks."""
+    for task_name in config.TASKS.keys():
+        for length in range(*len_range):
+            total = utils.count_combinations(val_range, length)
+            for start in range(0, total, shard_size):
+                yield _Shard(sent_format, sent_masks, task_name, val_range, len_range,
+                             start, min(start + shard_size, total), length=length, storage=storage,
+                             split=split, split_mode=split_mode)
+
+
+def _random_shards(
+        count: int, sent_format: str, sent_masks: Tuple[str, ...], val_range: Tuple[int, int],
+        len_range: Tuple[int, int], batch_size: int = config.BATCH_SIZE, storage: str = 'strings',
+        shard_size: int = config.SHARD_SIZE,
+        split: Optional[Dict[str, float]] = None, split_mode: str = 'index') -> Generator[_Shard, None, None]:
+    """Splits the random samples of a format into shards for all of its masks."""
+    for task_name in config.TASKS.keys():
+        for start in range(0, count, shard_size):
+            yield _Shard(sent_format, sent_masks, task_name, val_range, len_range,
+                         start, min(start + shard_size, count), batch_size=batch_size, storage=storage,
+                         split=split, split_mode=split_mode)
+
+
+def _shard_rng(shard: _Shard, sent_mask: Optional[str] = None) -> np.random.Generator:
+    """Returns a random stream of a shard, independent of all other shards.
+
+    The stream of the number lists is returned by default, and the stream of
+    the masked positions of sent_mask if passed. Groups therefore hold the
+    same samples whichever masks are generated along with them.
+    """
+    spawn_key = (list(formats.formats).index(shard.sent_format), list(config.TASKS).index(shard.task_name),
+                 shard.start)
+    if sent_mask is not None:
+        spawn_key += (list(masks.masks).index(sent_mask),)
+    return np.random.default_rng(np.random.SeedSequence(shard.entropy, spawn_key=spawn_key))
+
+
+def _to_rows(samples: Iterable[Sample], dtype: np.dtype) -> np.ndarray:
+    """Converts samples to rows of a strings or tokens table."""
+    samples = list(samples)
+    sents = [sample.sent for sample in samples]
+    labels = [sample.label for sample in samples]
+    rows = np.zeros(len(samples), dtype=dtype)
+    if 'sent' in dtype.names:
+        rows['sent'] = sents
+        rows['label'] = labels
+    if 'sent_ids' in dtype.names:
+        # Store token ids padded to the column width
+        tokenizer_ = tokenizer.get_tokenizer()
+        rows['sent_ids'], rows['sent_len'] = tokenizer_.encode_batch(sents, dtype['sent_ids'].shape[0])
+        rows['label_ids'], rows['label_len'] = tokenizer_.encode_batch(labels, dtype['label_ids'].shape[0])
+    return rows
+
+
+def _produce_shard(shard: _Shard) -> Dict[str, Tuple[np.ndarray, Optional[np.ndarray], Dict[str, float]]]:
+    """Generates the samples of a shard as rows of the table of every mask.
+
+    Each block of number lists is enumerated and formatted once, then masked
+    by every mask of the shard.
+
+    Returns:
+        For every mask of the shard:
+        rows: Structured array of table rows.
+        splits: Index of the split of each row, or None if rows are assigned
+            to splits by their index when written.
+        times: Seconds spent in each stage of progress.STAGES. Stages shared
+            by all masks are divided among them.
+    """
+    shared, times = progress_.StageTimes(), {sent_mask: progress_.StageTimes() for sent_mask in shard.sent_masks}
+    dtype = _storage_dtype(shard.storage, shard.val_range, shard.len_range)
+    if shard.length is None:
+        blocks = _random_combinations(shard.stop - shard.start, shard.task_name, shard.val_range, shard.len_range,
+                                      _shard_rng(shard), shard.batch_size)
+        rngs = {sent_mask: _shard_rng(shard, sent_mask) for sent_mask in shard.sent_masks}
+    else:
+        blocks = _combinations(shard.task_name, shard.val_range, shard.length, shard.start, shard.stop)
+        rngs = {sent_mask: None for sent_mask in shard.sent_masks}
+    sent_format = formats.formats[shard.sent_format]
+
+    chunks = {sent_mask: [] for sent_mask in shard.sent_masks}
+    splits = {sent_mask: [] for sent_mask in shard.sent_masks}
+    while True:
+        with shared.stage('enumerate'):
+            combinations = next(blocks, None)
+        if combinations is None:
+            break
+
+        # Format the number lists once for all masks
+        if shard.storage != 'canonical':
+            with shared.stage('format'):
+                sentences, spans = sent_format.spans_batch(shard.task_name, combinations.nums, combinations.targets,
+                                                           combinations.lengths)
+        if shard.split_mode != 'index':
+            with shared.stage('split'):
+                key_format = shard.sent_format if shard.split_mode == 'hash_format' else None
+                combination_splits = _hash_splits(combinations, shard.task_name, key_format, shard.split)
+
+        for sent_mask in shard.sent_masks:
+            mask_times = times[sent_mask]
+            with mask_times.stage('enumerate'):
+                block, rows_ = _expand_block(combinations, sent_mask, rngs[sent_mask])
+            if shard.storage == 'canonical':
+                # Store blocks without rendering them
+                with mask_times.stage('encode'):
+                    rows = _canonical_rows(block, dtype, shard.sent_format, sent_mask, shard.task_name)
+            else:
+                with mask_times.stage('mask'):
+                    mask_fn = masks.masks_at[sent_mask]
+                    samples = [mask_fn(sentences[row], position, spans[row])
+                               for row, position in zip(rows_.tolist(), block.positions.tolist())]
+                with mask_times.stage('encode'):
+                    rows = _to_rows(samples, dtype)
+            with mask_times.stage('encode'):
+                _metadata_rows(rows, block, shard.sent_format, sent_mask, shard.task_name)
+            chunks[sent_mask].append(rows)
+            if shard.split_mode != 'index':
+                splits[sent_mask].append(combination_splits[rows_])
+
+    produced = {}
+    for sent_mask in shard.sent_masks:
+        times[sent_mask].add({name: seconds / len(shard.sent_masks) for name, seconds in shared.seconds.items()})
+        rows = np.concatenate(chunks[sent_mask]) if chunks[sent_mask] else np.zeros(0, dtype=dtype)
+        if shard.split_mode == 'index':
+            produced[sent_mask] = (rows, None, times[sent_mask].as_dict())
+        else:
+            mask_splits = np.concatenate(splits[sent_mask]) if splits[sent_mask] else np.zeros(0, dtype=np.int64)
+            produced[sent_mask] = (rows, mask_splits, times[sent_mask].as_dict())
+    return produced
+
+
+def _map_shards(shards: Iterable[_Shard], pool: Optional[multiprocessing.pool.Pool], workers: int)\
+        -> Generator[Tuple[_Shard, Dict[str, Tuple[np.ndarray, Optional[np.ndarray], Dict[str, float]]]], None, None]:
+    """Produces shards in order, using a process pool of workers processes if passed.
+
+    At most two shards per worker are in flight, so memory stays bounded when
+    the writer falls behind.
+    """
+    if pool is None:
+        for shard in shards:
+            yield shard, _produce_shard(shard)
+        return
+
+    pending = deque()
+    for shard in shards:
+        pending.append((shard, pool.apply_async(_produce_shard, (shard,))))
+        if len(pending) >= 2 * workers:
+            shard_, result = pending.popleft()
+            yield shard_, result.get()
+    while pending:
+        shard_, result = pending.popleft()
+        yield shard_, result.get()
+
+
+def _write_pipelined(
+        produced: Generator[Tuple[_Shard, Dict[str, Tuple[np.ndarray, Optional[np.ndarray], Dict[str, float]]]],
+                            None, None],
+        write: Callable[..., None], queue_size: int):
+    """Writes produced shards in a separate thread, overlapping production and writing.
 
-    # Open or create dataset file
-    with tables.open_file(path, mode="a", title="Datasets") as h5file:
+    Shards are passed through a queue of at most queue_size shards, which
+    blocks the producer while the writer falls behind and thereby caps memory.
+    The writer thread is the only one accessing the file. Errors of the writer
+    stop the producer, which is closed, and are raised; if the producer fails,
+    the queued shards are still written before its error is raised.
+    """
+    shards = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def drain():
+        try:
+            while True:
+                item = shards.get()
+                if item is None:
+                    return
+                write(*item)
+        except BaseException as error:
+            errors.append(error)
+
+    def put(item) -> bool:
+        # Block while the queue is full, unless the writer has stopped
+        while thread.is_alive():
+            try:
+                shards.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    thread = threading.Thread(target=drain, name='writer', daemon=True)
+    thread.start()
+    try:
+        for item in produced:
+            if not put(item):
+                break
+    finally:
+        produced.close()
+        put(None)
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _restore_tables(h5file, group_name: str, params: Dict, code: Optional[str] = None)\
+        -> Tuple[Dict[str, Table], Dict]:
+    """Reopens the tables of an interrupted group at its last checkpoint."""
+    group = h5file.root.datasets[group_name]
+    if 'checkpoint' not in group._v_attrs:
+        raise tables.NodeError(f"Group {group_name} has no checkpoint to resume from")
+    checkpoint = group._v_attrs.checkpoint
+    if checkpoint['params'] != params:
+        raise ValueError(f"Group {group_name} was generated with different parameters: {checkpoint['params']}")
+    if checkpoint.get('code', code) != code:
+        raise ValueError(f"Group {group_name} was generated with different code")
+
+    # Drop rows written after the checkpoint
+    data_tables = {table_type: group[table_type] for table_type in ('train', 'val', 'test')}
+    for table_type, count in checkpoint['counts'].items():
+        data_tables[table_type].truncate(count)
+    return data_tables, checkpoint
+
+
+# Code shared by all formats and masks, hashed along with the code of each group
+_FORMAT_CODE = (formats._escape, formats._compile, formats.Format)
+_MASK_CODE = (masks._number_spans, masks._digit_spans, masks._mask_span, masks._nth_span, masks._check_spans,
+              masks.count_span_sets, masks._unrank_span_set, masks._is_sampled, masks._sampled_sets, masks.sample_key,
+              masks.span_sets, masks.span_set_at, masks.mask_spans, masks._multiple_sets)
+
+# Options read by each mask, hashed along with its code
+_MASK_OPTIONS = {
+    'mask_multiple_numbers': ('MASK_SPANS', 'MASK_SPANS_CAP', 'MASK_SPANS_SEED'),
+}
+
+
+def _code_hash(sent_format: str, sent_mask: str) -> str:
+    """Returns a hash of the code generating the samples of a format-mask pair.
+
+    Only the template of the format and the functions of the mask are hashed
+    along with the shared code, so adding a format or a mask leaves the hashes
+    of other groups unchanged.
+    """
+    sources = [formats.formats[sent_format].template]
+    sources += [inspect.getsource(obj) for obj in _FORMAT_CODE + _MASK_CODE]
+    sources += [inspect.getsource(functions[sent_mask]) for functions in (masks.masks, masks.counts, masks.masks_at)]
+    sources += [repr(getattr(config, name)) for name in _MASK_OPTIONS.get(sent_mask, ())]
+    return hashlib.sha256("\0".join(sources).encode()).hexdigest()
+
+
+def _is_current(group: Group, manifest: Dict) -> bool:
+    """Checks if a group was completed with the parameters, code and seed of a manifest."""
+    attrs = group._v_attrs
+    if 'manifest' not in attrs:
+        return False
+    recorded = attrs.manifest
+    if any(recorded[key] != manifest[key] for key in ('params', 'code', 'seed')):
+        return False
+    # Tables modified after the run are stale as well
+    return all(table_type in group and group[table_type].nrows == count
+               for table_type, count in recorded['counts'].items())
+
+
+def _record_manifest(attrs: AttributeSet, manifest: Dict, checkpoint: Dict, units: int):
+    """Records the manifest of a group once all of its units are completed."""
+    if sum(checkpoint['completed'].values()) >= units and 'manifest' not in attrs:
+        attrs.manifest = dict(manifest, counts=dict(checkpoint['counts']))
+
+
+def _pending_shards(shards: Iterable[_Shard], checkpoints: Dict[Tuple[str, str], Dict])\
+        -> Generator[_Shard, None, None]:
+    """Keeps the masks of every shard with groups pending after their checkpoint, and seeds the shards.
+
+    Masks of groups with different seed entropies are split into separate
+    shards, since their number lists differ.
+    """
+    completed = {group: dict(checkpoint['completed']) for group, checkpoint in checkpoints.items()}
+    positions = {}
+    for shard in shards:
+        pending = {}
+        key = (shard.sent_format, shard.task_name)
+        positions[key] = positions.get(key, 0) + shard.stop - shard.start
+        for sent_mask in shard.sent_masks:
+            group = (shard.sent_format, sent_mask)
+            if group in completed and positions[key] > completed[group][shard.task_name]:
+                pending.setdefault(checkpoints[group]['entropy'], []).append(sent_mask)
+        for entropy, sent_masks in pending.items():
+            yield shard._replace(sent_masks=tuple(sent_masks), entropy=entropy)
+
+
+def _is_resumable(group: Group, manifest: Dict, incremental: bool) -> bool:
+    """Checks if an existing group can be resumed from its checkpoint.
+
+    Outside of incremental runs, every existing group is resumed, and
+    _restore_tables refuses groups of other parameters.
+    """
+    if not incremental:
+        return True
+    attrs = group._v_attrs
+    return ('checkpoint' in attrs and 'manifest' not in attrs and attrs.checkpoint['params'] == manifest['params']
+            and attrs.checkpoint.get('code') == manifest['code'])
+
+
+def _index_metadata(table: Table):
+    """Creates the indexes of all metadata columns of a table."""
+    for name in _METADATA_COLUMNS:
+        column = table.cols._f_col(name)
+        if not column.is_indexed:
+            column.create_index()
+
+
+def _generate(
+        path: str, groups: List[Tuple[str, str]], shards: Iterable[_Shard], params: Dict, rewrite: bool,
+        chunk_size: int, workers: int, seed: Optional[int] = None, resume: bool = False, units: int = 0,
+        progress: bool = False, profile: Optional[str] = None, incremental: bool = False,
+        pipeline: bool = False, queue_size: int = config.QUEUE_SIZE) -> Dict:
+    """Generates shards and writes them to the tables of their format-mask pair.
+
+    Shards are written in order by a single writer, so the file is identical
+    for any number of workers. After every shard, the group records a
+    checkpoint in its attributes: the number of completed samples or
+    combinations per task, the row counts per split, and the seed entropy
+    from which the random stream of every shard is derived. Resuming from a
+    checkpoint produces the same file as an uninterrupted run.
+
+    Every group is expected to complete units combinations or samples. The
+    stages of every shard are timed, and the summary of progress.Tracker is
+    returned and written to profile as JSON if passed.
+
+    Once a group completes, its manifest is recorded. Incremental runs skip
+    groups with a matching manifest, resume interrupted groups if resume is
+    set, and rebuild all other groups.
+
+    If pipeline is set, shards are written by a separate thread, see
+    _write_pipelined.
+    """
+    storage, split = params['storage'], params['split']
+    if params['split_mode'] not in SPLIT_MODES:
+        raise KeyError(f"Split mode \"{params['split_mode']}\" does not exist.")
+    description, filters, chunkshape = _storage_layout(storage, params['val_range'], params['len_range'])
+    entropy = np.random.SeedSequence(seed).entropy
+    tracker = progress_.Tracker({"{sent_format}_{sent_mask}".format(sent_format=sent_format, sent_mask=sent_mask):
+                                 units for sent_format, sent_mask in groups}, show=progress)
+
+    # Start the workers before opening the file, so they never inherit its handle
+    with multiprocessing.Pool(workers) if workers > 1 else contextlib.nullcontext() as pool, \
+            tables.open_file(path, mode="a", title="Datasets") as h5file:
         # Create a group if it doesn't exist
         if '/datasets' not in h5file:
             h5file.create_group('/', 'datasets', 'Datasets')
 
-        # Generate all task-format-mask pairs
-        for sent_format, sent_mask in product(
-                sent_formats_, sent_masks_):
-            # Initialize counts
-            counts = {'train': 0, 'val': 0, 'test': 0}
-
-            # Create train-val-test tables
-            data_tables = _create_tables(h5file, sent_format, sent_mask, rewrite)
-            for task_name in config.TASKS.keys():
-                for sample in _generate_samples_random(count, sent_format, sent_mask, task_name, val_range, len_range):
-                    # Pick row and append a sample
-                    row, table_type = _get_row(data_tables, counts, split)
-                    row['sent'] = sample.sent
-                    row['label'] = sample.label
-                    row.append()
-                    counts[table_type] += 1
-
-        # Flush tables
-        for table in data_tables.values():
-            table.flush()
+        # Create or restore train-val-test tables for all format-mask pairs
+        writers, checkpoints, manifests, skipped = {}, {}, {}, []
+        for sent_format, sent_mask in groups:
+            group_name = "{sent_format}_{sent_mask}".format(sent_format=sent_format, sent_mask=sent_mask)
+            manifest = {'params': params, 'code': _code_hash(sent_format, sent_mask), 'seed': seed}
+            exists = group_name in h5file.root.datasets
+            if incremental and exists and _is_current(h5file.root.datasets[group_name], manifest):
+                # Skip groups that are up to date
+                skipped.append(group_name)
+                tracker.resume(group_name, units)
+                continue
+
+            if resume and exists and _is_resumable(h5file.root.datasets[group_name], manifest, incremental):
+                data_tables, checkpoint = _restore_tables(h5file, group_name, params, manifest['code'])
+            else:
+                data_tables = _create_tables(h5file, sent_format, sent_mask, rewrite or incremental, description,
+                                             filters, chunkshape)
+                checkpoint = {
+                    'completed': {task_name: 0 for task_name in config.TASKS},
+                    'counts': {table_type: 0 for table_type in split},
+                    'entropy': entropy,
+                    'params': params,
+                    'code': manifest['code'],
+                }
+
+                # Record the layout and the names of ids
+                attrs = data_tables['train']._v_parent._v_attrs
+                attrs.storage = storage
+                attrs.tasks = list(config.TASKS)
+                attrs.formats = list(formats.formats)
+                attrs.masks = list(masks.masks)
+                attrs.vocab = tokenizer.get_tokenizer().vocab
+                attrs.checkpoint = checkpoint
+            writers[(sent_format, sent_mask)] = _ChunkWriter(data_tables, split, chunk_size, checkpoint['counts'])
+            checkpoints[(sent_format, sent_mask)] = checkpoint
+            manifests[(sent_format, sent_mask)] = manifest
+            tracker.resume(group_name, sum(checkpoint['completed'].values()))
+
+        def write_shard(shard: _Shard, produced: Dict[str, Tuple[np.ndarray, Optional[np.ndarray], Dict[str, float]]]):
+            # Write the rows of every mask to its group
+            for sent_mask, (rows, splits, times) in produced.items():
+                stage_times = progress_.StageTimes()
+                with stage_times.stage('write'):
+                    writer = writers[(shard.sent_format, sent_mask)]
+                    writer.write_rows(rows, splits)
+                    writer.flush()
+
+                    checkpoint = checkpoints[(shard.sent_format, sent_mask)]
+                    checkpoint['completed'][shard.task_name] += shard.stop - shard.start
+                    checkpoint['counts'] = dict(writer.counts)
+                    attrs = writer.data_tables['train']._v_parent._v_attrs
+                    attrs.checkpoint = checkpoint
+                    _record_manifest(attrs, manifests[(shard.sent_format, sent_mask)], checkpoint, units)
+                    h5file.flush()
+                stage_times.add(times)
+                group_name = "{sent_format}_{sent_mask}".format(sent_format=shard.sent_format, sent_mask=sent_mask)
+                tracker.update(group_name, shard.stop - shard.start, len(rows), stage_times.as_dict())
+
+        # Write shards as they are produced, checkpointing after each
+        produced = _map_shards(_pending_shards(shards, checkpoints), pool, workers)
+        if pipeline:
+            _write_pipelined(produced, write_shard, queue_size)
+        else:
+            for shard, shard_produced in produced:
+                write_shard(shard, shard_produced)
+
+        # Groups without pending shards are completed as well
+        for group, writer in writers.items():
+            attrs = writer.data_tables['train']._v_parent._v_attrs
+            _record_manifest(attrs, manifests[group], checkpoints[group], units)
+
+    # Index the metadata columns once all rows are written
+    with tables.open_file(path, mode="a") as h5file:
+        for sent_format, sent_mask in groups:
+            group_name = "{sent_format}_{sent_mask}".format(sent_format=sent_format, sent_mask=sent_mask)
+            stage_times = progress_.StageTimes()
+            with stage_times.stage('index'):
+                for table_type in split:
+                    _index_metadata(h5file.get_node(f"/datasets/{group_name}/{table_type}"))
+            tracker.add_times(group_name, stage_times.as_dict())
+
+    if progress:
+        tracker.report()
+    summary = tracker.summary()
+    summary['skipped'] = skipped
+    if profile is not None:
+        with open(profile, 'w') as profile_file:
+            json.dump(summary, profile_file, indent=2)
+    return summary
 
 
 def load_datasets(
@@ -256,12 +1415,12 @@ def load_datasets(
 
     Example:
         `
-        h5file, tables = load_dataset(sent_formats='format_1', sent_masks='mask_1d')
+        h5file, tables = load_dataset(sent_formats='format_1', sent_masks='mask_one_digit')
 
         # Accessing datasets
-        train_dataset = tables['format_1_mask_1d']['train']
-        val_dataset = tables['format_1_mask_1d']['val']
-        test_dataset = tables['format_1_mask_1d']['test']
+        train_dataset = tables['format_1_mask_one_digit']['train']
+        val_dataset = tables['format_1_mask_one_digit']['val']
+        test_dataset = tables['format_1_mask_one_digit']['test']
         ...
         `
 
@@ -290,3 +1449,114 @@ def load_datasets(
         datasets[group_name] = h5file.root.datasets[group_name]
 
     return h5file, datasets
+
+
+def _read_chunks(
+        tables_: Dict[str, Table], columns: List[str], weights: Dict[str, float], read_size: int,
+        rng: Optional[np.random.Generator]) -> Generator[np.ndarray, None, None]:
+    """Reads contiguous chunks of projected columns, interleaving tables by weight.
+
+    If rng is passed, the chunks of every table are visited in random order.
+    """
+    # Plan the chunks of every table
+    plans = {}
+    for name, table in tables_.items():
+        starts = np.arange(0, table.nrows, read_size)
+        plans[name] = deque((rng.permutation(starts) if rng is not None else starts).tolist())
+
+    names = [name for name in tables_ if plans[name] and weights[name] > 0]
+    while names:
+        # Pick a table by weight among the tables that are not exhausted
+        probs = np.array([weights[name] for name in names], dtype=np.float64)
+        name = names[rng.choice(len(names), p=probs / probs.sum())] if rng is not None else names[0]
+        table = tables_[name]
+        start = plans[name].popleft()
+        stop = min(start + read_size, table.nrows)
+
+        # Read only the projected columns
+        chunk = np.empty(stop - start, dtype=[(column, table.dtype[column]) for column in columns])
+        for column in columns:
+            chunk[column] = table.read(start, stop, field=column)
+        yield chunk
+
+        if not plans[name]:
+            names.remove(name)
+
+
+def iter_batches(
+        datasets: Dict[str, Group], split: str = 'train', batch_size: int = config.READ_BATCH_SIZE,
+        columns: Optional[List[str]] = None, weights: Optional[Dict[str, float]] = None,
+        shuffle_buffer: int = config.SHUFFLE_BUFFER, read_size: int = config.READ_SIZE,
+        prefetch: int = config.PREFETCH, seed: Optional[int] = None, drop_last: bool = False)\
+        -> Generator[np.ndarray, None, None]:
+    """Yields fixed-size batches of rows from one or more dataset groups.
+
+    Contiguous chunks of read_size rows are read in a background thread, up to
+    prefetch chunks ahead. Chunks are drawn from the groups at random in
+    proportion to their weights. If shuffle_buffer is positive, chunks are
+    visited in random order and their rows are shuffled through a buffer of
+    about shuffle_buffer rows. The file must not be used by other threads while
+    iterating.
+
+    Example:
+        `
+        h5file, datasets = load_datasets(sent_formats='format_1', sent_masks='all')
+        for batch in iter_batches(datasets, 'train', batch_size=64, seed=0):
+            sents, labels = batch['sent'], batch['label']
+            ...
+        `
+
+    Args:
+        datasets: Dictionary of dataset groups, as returned by load_datasets.
+        split: The table to read from each group: train, val, or test.
+        batch_size: The number of rows per batch.
+        columns: The columns to read. Defaults to all columns.
+        weights: Sampling weight of each group. Defaults to the number of rows,
+            which samples all rows uniformly. Requires shuffling.
+        shuffle_buffer: The approximate number of rows shuffled together. If 0,
+            rows are read in order, one group after another.
+        read_size: The number of contiguous rows read at once.
+        prefetch: The number of chunks read ahead.
+        seed: Seed of the shuffling. The reading thread and the buffer draw
+            from independent streams of the seed, so batches are reproducible.
+            Optional.
+        drop_last: If set, the last incomplete batch is dropped.
+
+    Returns:
+        Generator of structured arrays with the requested columns.
+
+    Raises:
+        ValueError: If weights are passed without shuffling.
+    """
+    if weights is not None and shuffle_buffer <= 0:
+        raise ValueError("Groups are only interleaved by weight when shuffling.")
+    tables_ = {name: group[split] for name, group in datasets.items()}
+    columns = columns or list(next(iter(tables_.values())).colnames)
+    weights = weights or {name: table.nrows for name, table in tables_.items()}
+    read_rng, rng = None, None
+    if shuffle_buffer > 0:
+        read_rng, rng = (np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(2))
+
+    pool = None
+    for chunk in utils.prefetch(_read_chunks(tables_, columns, weights, read_size, read_rng), prefetch):
+        pool = chunk if pool is None else np.concatenate([pool, chunk])
+        if rng is None:
+            ready = len(pool) // batch_size * batch_size
+        elif len(pool) >= shuffle_buffer + batch_size:
+            # Shuffle the buffer and emit batches, keeping the rest for mixing
+            pool = pool[rng.permutation(len(pool))]
+            ready = (len(pool) - shuffle_buffer) // batch_size * batch_size
+        else:
+            continue
+        for start in range(0, ready, batch_size):
+            yield pool[start:start + batch_size]
+        pool = pool[ready:]
+
+    # Emit the remaining rows
+    if pool is not None and len(pool):
+        if rng is not None:
+            pool = pool[rng.permutation(len(pool))]
+        for start in range(0, len(pool), batch_size):
+            if drop_last and start + batch_size > len(pool):
+                break
+            yield pool[start:start + batch_size]
@@ -0,0 +1,237 @@
+"""This module exports dataset groups to memory-mapped NumPy shards.
+
+HDF5 handles cannot be shared between processes, and reading single rows of a
+table is slow. An exported group is a directory of flat .npy shards per split,
+which any number of processes can map and share through the page cache.
+
+Every field (sent, label) of a shard is stored as two arrays: the values of
+all rows concatenated, and the offset of each row into them. Values are either
+the UTF-8 bytes of the text (layout 'strings') or the ids of
+tokenizer.Tokenizer (layout 'tokens'). Directory structure:
+
+    {directory}/meta.json
+    {directory}/{split}_{shard:05d}.{field}.npy
+    {directory}/{split}_{shard:05d}.{field}_offsets.npy
+
+Example:
+    `
+    export_group('data/pretrain/dataset.h5', 'format_1_mask_one_digit', 'data/export/format_1_mask_one_digit')
+    train = MappedDataset('data/export/format_1_mask_one_digit', 'train')
+    sent_ids, label_ids = train[12345]
+    `
+"""
+import json
+import os
+from itertools import chain
+
+import numpy as np
+import tables
+
+from src import config
+from src.data import dataset, tokenizer, utils
+from src.data.masks import Sample
+from tables.group import Group
+from tables.table import Table
+from typing import Dict, List, Tuple
+
+_FIELDS = ('sent', 'label')
+
+# Value type of each layout
+_LAYOUTS = {
+    'strings': np.uint8,
+    'tokens': np.int16,
+}
+
+Flat = Tuple[np.ndarray, np.ndarray]
+
+
+def _flat_strings(column: np.ndarray) -> Flat:
+    """Returns the concatenated bytes of a fixed-width string column and their lengths."""
+    column = np.ascontiguousarray(column)
+    lengths = np.char.str_len(column)
+    values = column.view(np.uint8).reshape(len(column), column.itemsize)
+    return values[utils.length_mask(lengths, column.itemsize)], lengths
+
+
+def _flat_texts(texts: List[str], layout: str) -> Flat:
+    """Returns the concatenated values of texts in a layout and their lengths."""
+    if layout == 'strings':
+        encoded = [text.encode() for text in texts]
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), np.array([len(text) for text in encoded])
+    ids = [tokenizer.get_tokenizer().encode(text) for text in texts]
+    return np.fromiter(chain.from_iterable(ids), dtype=np.int16), np.array([len(text_ids) for text_ids in ids])
+
+
+def _read_fields(table: Table, start: int, stop: int, layout: str) -> Dict[str, Flat]:
+    """Reads rows of a table as flat values of each field.
+
+    Columns already in the layout are copied; other storages are read as
+    samples and converted.
+    """
+    colnames = table.colnames
+    if layout == 'strings' and 'sent' in colnames:
+        rows = table.read(start, stop)
+        return {field: _flat_strings(rows[field]) for field in _FIELDS}
+    if layout == 'tokens' and 'sent_ids' in colnames:
+        rows = table.read(start, stop)
+        return {field: (rows[f'{field}_ids'][utils.length_mask(rows[f'{field}_len'], rows[f'{field}_ids'].shape[1])],
+                        rows[f'{field}_len']) for field in _FIELDS}
+    samples = dataset.read_samples(table, start, stop)
+    return {field: _flat_texts([getattr(sample, field) for sample in samples], layout) for field in _FIELDS}
+
+
+def _offsets(lengths: np.ndarray) -> np.ndarray:
+    """Returns the offset of each row into the concatenated values, followed by the total."""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _vocab(group: Group) -> List[str]:
+    """Returns the vocabulary of the token ids read from a group."""
+    # Token ids copied from the tables refer to their own vocabulary
+    copied = 'sent_ids' in next(iter(group)).colnames
+    return list(group._v_attrs.vocab) if copied else tokenizer.get_tokenizer().vocab
+
+
+class _ShardWriter:
+    """Writes rows of a split to shards of a fixed number of rows."""
+    def __init__(self, directory: str, split: str, shard_size: int, dtype: np.dtype):
+        self.directory = directory
+        self.split = split
+        self.shard_size = shard_size
+        self.dtype = dtype
+        self.values = {field: [] for field in _FIELDS}
+        self.lengths = {field: [] for field in _FIELDS}
+        self.size = 0
+        self.shards = []
+
+    def write(self, fields: Dict[str, Flat]):
+        """Buffers rows, writing full shards."""
+        offsets = {field: _offsets(lengths) for field, (_, lengths) in fields.items()}
+        count = len(offsets[_FIELDS[0]]) - 1
+        start = 0
+        while start < count:
+            stop = start + min(count - start, self.shard_size - self.size)
+            for field, (values, lengths) in fields.items():
+                self.values[field].append(values[offsets[field][start]:offsets[field][stop]])
+                self.lengths[field].append(lengths[start:stop])
+            self.size += stop - start
+            start = stop
+            if self.size == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        """Writes the buffered rows as a shard."""
+        if not self.size:
+            return
+        name = os.path.join(self.directory, f"{self.split}_{len(self.shards):05d}")
+        for field in _FIELDS:
+            np.save(f"{name}.{field}.npy", np.concatenate(self.values[field]).astype(self.dtype))
+            np.save(f"{name}.{field}_offsets.npy", _offsets(np.concatenate(self.lengths[field])))
+            self.values[field], self.lengths[field] = [], []
+        self.shards.append(self.size)
+        self.size = 0
+
+
+def export_group(path: str, group_name: str, directory: str, layout: str = 'tokens',
+                 shard_size: int = config.EXPORT_SHARD_SIZE, read_size: int = config.READ_SIZE) -> Dict:
+    """Exports a dataset group to memory-mapped shards.
+
+    Groups of any storage can be exported. The metadata is written last, such
+    that an interrupted export is not loaded.
+
+    Args:
+        path: Path to the dataset.
+        group_name: The group to export, named {sent_format}_{sent_mask}.
+        directory: Directory of the shards. Created if it does not exist.
+        layout: Either 'strings' for UTF-8 bytes or 'tokens' for token ids.
+        shard_size: The maximum number of rows per shard.
+        read_size: The number of rows read from the dataset at once.
+
+    Returns:
+        The metadata of the export.
+    """
+    if layout not in _LAYOUTS:
+        raise KeyError(f"Layout \"{layout}\" does not exist.")
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    meta = {'group': group_name, 'layout': layout, 'splits': {}}
+
+    with tables.open_file(path, mode='r') as h5file:
+        group = h5file.root.datasets[group_name]
+        for table in group:
+            # Stream each split through a shard writer
+            writer = _ShardWriter(directory, table.name, shard_size, _LAYOUTS[layout])
+            for start in range(0, table.nrows, read_size):
+                writer.write(_read_fields(table, start, min(start + read_size, table.nrows), layout))
+            writer.flush()
+            meta['splits'][table.name] = writer.shards
+
+        if layout == 'tokens':
+            meta['vocab'] = _vocab(group)
+
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return meta
+
+
+class MappedDataset:
+    """A split of an exported group with zero-copy access to every row.
+
+    Shards are memory-mapped read-only, such that processes reading the same
+    export share its pages. Indexing returns views of the mapped arrays.
+    Pickling only stores the directory and split, so the dataset can be sent
+    to worker processes, which map the shards again.
+
+    Example:
+        `
+        train = MappedDataset('data/export/format_1_mask_one_digit', 'train')
+        sent_ids, label_ids = train[0]
+        sample = train.sample(0)
+        `
+    """
+    def __init__(self, directory: str, split: str = 'train'):
+        self.directory = directory
+        self.split = split
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        self.layout = self.meta['layout']
+        self.tokenizer = tokenizer.Tokenizer(self.meta['vocab']) if self.layout == 'tokens' else None
+
+        # Map every shard, along with the index of its first row
+        sizes = self.meta['splits'][split]
+        self.starts = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+        self.shards = []
+        for shard in range(len(sizes)):
+            name = os.path.join(directory, f"{split}_{shard:05d}")
+            self.shards.append([(np.load(f"{name}.{field}.npy", mmap_mode='r'),
+                                 np.load(f"{name}.{field}_offsets.npy", mmap_mode='r')) for field in _FIELDS])
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def __getitem__(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns views of the values of the sentence and the label of a row."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} is out of range.")
+        shard = int(np.searchsorted(self.starts, index, side='right')) - 1
+        row = index - int(self.starts[shard])
+        return tuple(values[offsets[row]:offsets[row + 1]] for values, offsets in self.shards[shard])
+
+    def sample(self, index: int) -> Sample:
+        """Returns a row decoded as a sample."""
+        sent, label = self[index]
+        if self.tokenizer is not None:
+            return Sample(sent=self.tokenizer.decode(sent.tolist()), label=self.tokenizer.decode(label.tolist()))
+        return Sample(sent=sent.tobytes().decode(), label=label.tobytes().decode())
+
+    def __getstate__(self) -> Dict:
+        return {'directory': self.directory, 'split': self.split}
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
@@ -8,91 +8,170 @@ is as follows:
 
 def format_N(task_name: str, nums: List[int], target: int) -> str:
     ...
+
+Every format is declared by a single template in `templates`, with the fields
+{task}, {nums_str} and {target}. Templates are compiled once per task name and
+list length into a plain str.format pattern. Each format also renders the
+character span of every number in the sentence (Format.spans), which masking
+functions accept to avoid searching the sentence again, and whole blocks of
+number lists at once (Format.format_batch).
 """
-from typing import List
+from functools import lru_cache
+from string import Formatter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from src.data import utils
+
+Span = Tuple[int, int]
+
+# Templates of all formats. Adding a format only requires a new entry.
+templates = {
+    # The maximum value among 1, 2, 3, 4, and 5 is 5.
+    'format_1': "The {task} value among {nums_str} is {target}.",
+    # 5 is the maximum value among 1, 2, 3, 4, and 5
+    'format_2': "{target} is the {task} value among {nums_str}",
+    # Among 1, 2, 3, 4, and 5, 5 is the maximum value.
+    'format_3': "Among {nums_str}, {target} is the {task} value.",
+    # The number 1 is the minimum among the numbers 1, 2, 3, 4, and 5.
+    'format_4': "The number {target} is the {task} among the numbers {nums_str}.",
+    # Between 1, 2, 3, 4, and 5, 5 is the maximum number.
+    'format_5': "Between {nums_str}, {target} is the {task} number.",
+}
 
 
-def format_1(task_name: str, nums: List[int], target: int) -> str:
-    """Returns a sentence with format 1.
+def _escape(text: str) -> str:
+    """Escapes literal text for str.format."""
+    return text.replace("{", "{{").replace("}", "}}")
 
-    Example:
-        The maximum value among 1, 2, 3, 4, and 5 is 5.
-    """
-    # Stringify the list.
-    nums_str = ", ".join([str(num) for num in nums[:-1]]) + ", and " + str(nums[-1])
 
-    # Generate the sentence
-    sentence = "The {task} value among {nums_str} is {target}.".format(
-        task=task_name, nums_str=nums_str, target=target
-    )
-    return sentence
+@lru_cache(maxsize=None)
+def _compile(template: str, task_name: str, length: int) -> Tuple[str, np.ndarray, np.ndarray]:
+    """Compiles a template for a task and a list length.
 
-def format_2(task_name: str, nums: List[int], target: int) -> str:
-    """Returns a sentence with format 2.
-
-    Example:
-        5 is the maximum value among 1, 2, 3, 4, and 5.
+    Returns:
+        pattern: A str.format pattern taking the numbers followed by the target
+            as positional arguments.
+        literals: Length of the literal text before each number, in sentence
+            order.
+        fields: Argument index of each number, in sentence order.
     """
-    # Stringify the list.
-    nums_str = ", ".join([str(num) for num in nums[:-1]]) + ", and " + str(nums[-1])
-
-    # Generate the sentence
-    sentence = "{target} is the {task} value among {nums_str}".format(
-        task=task_name, nums_str=nums_str, target=target
-    )
-    return sentence
-
-def format_3(task_name: str, nums: List[int], target: int) -> str:
-    """Returns a sentence with format 3.
-
-    Example:
-        Among 1, 2, 3, 4, and 5, 5 is the highest value.
+    pattern, literals, fields = [], [], []
+    literal = 0
+    for text, field, _, _ in Formatter().parse(template):
+        pattern.append(_escape(text))
+        literal += len(text)
+        if field == 'task':
+            pattern.append(_escape(task_name))
+            literal += len(task_name)
+        elif field == 'target':
+            pattern.append("{%d}" % length)
+            literals.append(literal)
+            fields.append(length)
+            literal = 0
+        elif field == 'nums_str':
+            # Numbers are listed as "1, 2, and 3"
+            for i in range(length):
+                separator = ", and " if i == length - 1 else ", " if i else ""
+                pattern.append(separator + "{%d}" % i)
+                literals.append(literal + len(separator))
+                fields.append(i)
+                literal = 0
+    return "".join(pattern), np.array(literals), np.array(fields)
+
+
+class Format:
+    """A sentence format compiled from a template.
+
+    Calling a format returns the sentence for a task, numbers and target, like
+    any other formatting function.
     """
-    # Stringify the list.
-    nums_str = ", ".join([str(num) for num in nums[:-1]]) + ", and " + str(nums[-1])
+    def __init__(self, template: str):
+        self.template = template
+
+    def __call__(self, task_name: str, nums: List[int], target: int) -> str:
+        pattern, _, _ = _compile(self.template, task_name, len(nums))
+        return pattern.format(*nums, target)
+
+    def spans(self, task_name: str, nums: List[int], target: int) -> Tuple[str, List[Span]]:
+        """Returns the sentence along with the span of every number in it.
+
+        Returns:
+            sentence: The formatted sentence.
+            spans: List of [start, end) offsets of the digits of every number,
+                in sentence order. Signs are excluded from the spans.
+        """
+        pattern, literals, fields = _compile(self.template, task_name, len(nums))
+        args = list(nums) + [target]
+        spans = []
+        offset = 0
+        for literal, field in zip(literals.tolist(), fields.tolist()):
+            num_str = str(args[field])
+            offset += literal
+            spans.append((offset + (num_str[0] == "-"), offset + len(num_str)))
+            offset += len(num_str)
+        return pattern.format(*args), spans
+
+    def format_batch(self, task_name: str, nums_block: np.ndarray, targets: np.ndarray,
+                     lengths: Optional[np.ndarray] = None) -> List[str]:
+        """Returns the sentences of a block of number lists.
+
+        Args:
+            task_name: The task, as defined in config.TASKS.
+            nums_block: Integer array of shape (count, width), one list per row.
+            targets: Integer array of shape (count,).
+            lengths: Number of valid entries of each row. Defaults to the width.
+
+        Returns:
+            List of sentences.
+        """
+        return self._batch(task_name, nums_block, targets, lengths, with_spans=False)[0]
+
+    def spans_batch(self, task_name: str, nums_block: np.ndarray, targets: np.ndarray,
+                    lengths: Optional[np.ndarray] = None) -> Tuple[List[str], List[List[Span]]]:
+        """Returns the sentences of a block of number lists and their spans.
+
+        Spans are computed with vectorized operations from the lengths of the
+        numbers, and are returned as [start, end] lists. Arguments are the same
+        as format_batch.
+        """
+        return self._batch(task_name, nums_block, targets, lengths, with_spans=True)
+
+    def _batch(self, task_name: str, nums_block: np.ndarray, targets: np.ndarray,
+               lengths: Optional[np.ndarray], with_spans: bool) -> Tuple[List[str], List[List[Span]]]:
+        nums_block, targets = np.asarray(nums_block), np.asarray(targets)
+        lengths = np.full(len(nums_block), nums_block.shape[1]) if lengths is None else np.asarray(lengths)
+        sentences = [None] * len(nums_block)
+        spans = [None] * len(nums_block) if with_spans else []
+
+        # Render rows of the same length with a single compiled pattern
+        for length in np.unique(lengths).tolist():
+            rows = np.flatnonzero(lengths == length)
+            pattern, literals, fields = _compile(self.template, task_name, length)
+            args = np.concatenate([nums_block[rows, :length], targets[rows, None]], axis=1)
+            for i, row in zip(rows.tolist(), args.tolist()):
+                sentences[i] = pattern.format(*row)
+
+            if with_spans:
+                # Offsets follow from the lengths of the numbers in sentence order
+                ordered = args[:, fields]
+                widths = utils.count_digits(ordered) + (ordered < 0)
+                ends = np.cumsum(literals + widths, axis=1)
+                starts = ends - widths + (ordered < 0)
+                for i, row_spans in zip(rows.tolist(), np.stack([starts, ends], axis=2).tolist()):
+                    spans[i] = row_spans
+        return sentences, spans
 
-    # Generate the sentence
-    sentence = "Among {nums_str}, {target} is the {task} value.".format(
-        task=task_name, nums_str=nums_str, target=target
-    )
-    return sentence
 
-def format_4(task_name: str, nums: List[int], target: int) -> str:
-    """Returns a sentence with format 4.
-
-    Example:
-        The number 1 is the smallest among the numbers 1, 2, 3, 4, and 5.
-    """
-    # Stringify the list.
-    nums_str = ", ".join([str(num) for num in nums[:-1]]) + ", and " + str(nums[-1])
-
-    # Generate the sentence
-    sentence = "The number {target} is the {task} among the numbers {nums_str}.".format(
-        task=task_name, nums_str=nums_str, target=target
-    )
-    return sentence
-
-def format_5(task_name: str, nums: List[int], target: int) -> str:
-    """Returns a sentence with format 5.
-
-    Example:
-        Between 1, 2, 3, 4, and 5, 5 is the minimum number.
-    """
-    # Stringify the list.
-    nums_str = ", ".join([str(num) for num in nums[:-1]]) + ", and " + str(nums[-1])
-
-    # Generate the sentence
-    sentence = "Between {nums_str}, {target} is the {task} number.".format(
-        task=task_name, nums_str=nums_str, target=target
-    )
-    return sentence
+# List of all formats
+formats = {name: Format(template) for name, template in templates.items()}
 
+# Formats returning the sentence and the spans of its numbers
+format_spans = {name: sentence_format.spans for name, sentence_format in formats.items()}
 
-# List of all formats
-formats = {
-    'format_1': format_1,
-    'format_2': format_2,
-    'format_3': format_3,
-    'format_4': format_4,
-    'format_5': format_5,
-}
+format_1 = formats['format_1']
+format_2 = formats['format_2']
+format_3 = formats['format_3']
+format_4 = formats['format_4']
+format_5 = formats['format_5']
@@ -1,10 +1,27 @@
 """This module contains functions for sentence masking.
 
 A masking function masks parts of an input sentence as defined in
+
+Every masking function optionally accepts the spans of the numbers in the
+sentence, as returned by formats.format_spans. If passed, the sentence is not
+searched for numbers again.
+
+Several spans are masked at once by a k-span engine working on span offsets:
+span_sets lazily yields the k-subsets of the spans of a sentence, or a seeded
+uniform sample of at most cap subsets, and mask_spans masks a subset with the
+mask tokens numbered in order.
 """
+import random
 import re
+from functools import lru_cache
+from itertools import combinations
+from math import comb
 from src import config
-from typing import Generator, NamedTuple
+from typing import Generator, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+_DIGIT = re.compile(r"\d")
+_NUMBER = re.compile(r"\d+")
+_TOKENS = [config.MASK_TOKEN.format(i) for i in range(config.MASK_SENTINELS)]
 
 
 class Sample(NamedTuple):
@@ -12,7 +29,157 @@ class Sample(NamedTuple):
     label: str
 
 
-def mask_one_digit(sentence: str) -> Generator[Sample, None, None]:
+Span = Tuple[int, int]
+
+
+def _number_spans(sentence: str, spans: Optional[List[Span]]) -> List[Span]:
+    """Returns the spans of all numbers, searching the sentence if not passed."""
+    if spans is None:
+        return [match.span() for match in _NUMBER.finditer(sentence)]
+    return spans
+
+
+def _digit_spans(sentence: str, spans: Optional[List[Span]]) -> List[Span]:
+    """Returns the spans of all digits, derived from number spans if passed."""
+    if spans is None:
+        return [match.span() for match in _DIGIT.finditer(sentence)]
+    return [(i, i + 1) for start, end in spans for i in range(start, end)]
+
+
+def _mask_span(sentence: str, span: Span) -> Sample:
+    """Masks a single span of a sentence."""
+    start, end = span
+    masked = sentence[:start] + _TOKENS[0] + sentence[end:]
+    label = _TOKENS[0] + " " + sentence[start:end] + " " + _TOKENS[1]
+    return Sample(sent=masked, label=label)
+
+
+def _nth_span(spans: List[Span], k: int) -> Span:
+    """Returns the k-th span, refusing negative indices."""
+    if not 0 <= k < len(spans):
+        raise IndexError(f"Sentence has no masked variant {k}.")
+    return spans[k]
+
+
+def _check_spans(k: int):
+    """Refuses subsets without a mask token for each span and the end of the label."""
+    if not 0 < k < len(_TOKENS):
+        raise ValueError(f"Cannot mask {k} spans with {len(_TOKENS)} mask tokens.")
+
+
+def count_span_sets(count: int, k: int, cap: Optional[int] = None) -> int:
+    """Returns the number of k-subsets of count spans yielded by span_sets."""
+    total = comb(count, k)
+    return total if cap is None else min(total, cap)
+
+
+@lru_cache(maxsize=config.MASK_SPANS_CACHE)
+def _unrank_span_set(count: int, k: int, rank: int) -> Tuple[int, ...]:
+    """Returns the k-subset of range(count) with a rank in lexicographic order."""
+    subset, first = [], 0
+    for remaining in range(k, 0, -1):
+        # Skip the subsets starting with smaller indices
+        while rank >= comb(count - first - 1, remaining - 1):
+            rank -= comb(count - first - 1, remaining - 1)
+            first += 1
+        subset.append(first)
+        first += 1
+    return tuple(subset)
+
+
+def _is_sampled(count: int, k: int, cap: Optional[int], key: Optional[str]) -> bool:
+    """Checks if the subsets of count spans are sampled, which requires a key."""
+    if cap is None or comb(count, k) <= cap:
+        return False
+    if key is None:
+        raise ValueError(f"Sampling {cap} of the {comb(count, k)} subsets requires a key.")
+    return True
+
+
+@lru_cache(maxsize=config.MASK_SPANS_CACHE)
+def _sampled_sets(count: int, k: int, cap: int, key: str) -> Tuple[Tuple[int, ...], ...]:
+    """Returns cap k-subsets in lexicographic order, sampled uniformly without replacement.
+
+    The subsets of a sentence are sampled once and reused for each of its
+    variants.
+    """
+    ranks = sorted(random.Random(key).sample(range(comb(count, k)), cap))
+    return tuple(_unrank_span_set(count, k, rank) for rank in ranks)
+
+
+def sample_key(numbers: Iterable[str]) -> str:
+    """Returns the key seeding the sampled subsets of a sentence with these numbers in sentence order."""
+    return f"{config.MASK_SPANS_SEED}:" + ",".join(numbers)
+
+
+def span_sets(count: int, k: int, cap: Optional[int] = None, key: Optional[str] = None)\
+        -> Iterator[Tuple[int, ...]]:
+    """Lazily yields k-subsets of count spans, in lexicographic order.
+
+    All subsets are yielded if there are at most cap of them. Otherwise, cap
+    subsets are sampled uniformly without replacement, seeded by key, such
+    that the same sentence always yields the same subsets.
+
+    Example:
+        list(span_sets(4, 2, cap=3, key="0:1,2,3,3")) -> [(0, 1), (0, 3), (1, 3)]
+
+    Args:
+        count: The number of spans.
+        k: The number of spans per subset.
+        cap: The maximum number of subsets. Optional.
+        key: Seed of the sample, e.g. from sample_key. Required if subsets
+            are sampled.
+
+    Returns:
+        Iterator of tuples of span indices.
+
+    Raises:
+        ValueError: If subsets are sampled without a key.
+    """
+    _check_spans(k)
+    if not _is_sampled(count, k, cap, key):
+        return combinations(range(count), k)
+    return iter(_sampled_sets(count, k, cap, key))
+
+
+def span_set_at(count: int, k: int, index: int, cap: Optional[int] = None, key: Optional[str] = None)\
+        -> Tuple[int, ...]:
+    """Returns the index-th subset of span_sets without generating the others."""
+    _check_spans(k)
+    if not 0 <= index < count_span_sets(count, k, cap):
+        raise IndexError(f"Sentence has no masked variant {index}.")
+    if not _is_sampled(count, k, cap, key):
+        return _unrank_span_set(count, k, index)
+    return _sampled_sets(count, k, cap, key)[index]
+
+
+def mask_spans(sentence: str, spans: List[Span], subset: Sequence[int]) -> Sample:
+    """Masks a subset of sorted, disjoint spans, numbering the mask tokens in order.
+
+    Example:
+        Original: 311, 342, 435
+        Masked: <extra_id_0>, 342, <extra_id_1>
+        Label: <extra_id_0> 311 <extra_id_1> 435 <extra_id_2>
+    """
+    _check_spans(len(subset))
+    parts, label, end = [], [], 0
+    for token, index in zip(_TOKENS, subset):
+        start, stop = spans[index]
+        parts += [sentence[end:start], token]
+        label += [token, sentence[start:stop]]
+        end = stop
+    parts.append(sentence[end:])
+    label.append(_TOKENS[len(subset)])
+    return Sample(sent="".join(parts), label=" ".join(label))
+
+
+def _multiple_sets(sentence: str, spans: List[Span]) -> Tuple[int, int, Optional[int], str]:
+    """Returns the arguments of span_sets for the numbers of a sentence."""
+    return (len(spans), config.MASK_SPANS, config.MASK_SPANS_CAP,
+            sample_key(sentence[start:end] for start, end in spans))
+
+
+def mask_one_digit(sentence: str, spans: Optional[List[Span]] = None) -> Generator[Sample, None, None]:
     """Masks a single digit.
 
     Example:
@@ -21,28 +188,29 @@ def mask_one_digit(sentence: str) -> Generator[Sample, None, None]:
 
     Args:
         sentence: A sentence to be masked.
+        spans: Spans of the numbers in the sentence. Optional.
     Returns:
         List of samples, such that each sample contains
             sent: A masked sentence.
             targets: The masked part(s) of the input.
     """
-    samples = []
+    # Replace each digit with a mask token
+    for span in _digit_spans(sentence, spans):
+        yield _mask_span(sentence, span)
+
+def count_one_digit(sentence: str, spans: Optional[List[Span]] = None) -> int:
+    """Returns the number of samples mask_one_digit generates for a sentence."""
+    if spans is None:
+        return len(_DIGIT.findall(sentence))
+    return sum(end - start for start, end in spans)
 
-    # Find all matches using Regex
-    pattern = re.compile(r"\d")
-    for match in pattern.finditer(sentence):
-        # Extract match
-        start, end = match.span()
-        text = match.group()
 
-        # Replace match with mask token
-        masked = sentence[:start] + config.MASK_TOKEN.format(0) + sentence[end:]
-        label = config.MASK_TOKEN.format(0) + " " + text + " " + config.MASK_TOKEN.format(1)
+def mask_one_digit_at(sentence: str, k: int, spans: Optional[List[Span]] = None) -> Sample:
+    """Returns the k-th sample of mask_one_digit without generating the others."""
+    return _mask_span(sentence, _nth_span(_digit_spans(sentence, spans), k))
 
-        # Append sample
-        yield Sample(sent=masked, label=label)
 
-def mask_one_number(sentence: str) -> Generator[Sample, None, None]:
+def mask_one_number(sentence: str, spans: Optional[List[Span]] = None) -> Generator[Sample, None, None]:
     """Masks the entire digit Eg 435.
 
     Example:
@@ -51,29 +219,31 @@ def mask_one_number(sentence: str) -> Generator[Sample, None, None]:
 
     Args:
         sentence: A sentence to be masked.
+        spans: Spans of the numbers in the sentence. Optional.
     Returns:
         List of samples, such that each sample contains
             sent: A masked sentence.
             targets: The masked part(s) of the input.
     """
-    samples = []
+    # Replace each number with a mask token
+    for span in _number_spans(sentence, spans):
+        yield _mask_span(sentence, span)
 
-    # Find all matches using Regex
-    pattern = re.compile(r"\d+")
-    for match in pattern.finditer(sentence):
-        # Extract match
-        start, end = match.span()
-        text = match.group()
+def count_one_number(sentence: str, spans: Optional[List[Span]] = None) -> int:
+    """Returns the number of samples mask_one_number generates for a sentence."""
+    return len(_number_spans(sentence, spans))
 
-        # Replace match with mask token
-        masked = sentence[:start] + config.MASK_TOKEN.format(0) + sentence[end:]
-        label = config.MASK_TOKEN.format(0) + " " + text + " " + config.MASK_TOKEN.format(1)
 
-        # Append sample
-        yield Sample(sent=masked, label=label)
+def mask_one_number_at(sentence: str, k: int, spans: Optional[List[Span]] = None) -> Sample:
+    """Returns the k-th sample of mask_one_number without generating the others."""
+    return _mask_span(sentence, _nth_span(_number_spans(sentence, spans), k))
 
-def mask_multiple_numbers(sentence: str) -> Generator[Sample, None, None]:
-    """Masks the multiple digits.
+
+def mask_multiple_numbers(sentence: str, spans: Optional[List[Span]] = None) -> Generator[Sample, None, None]:
+    """Masks several numbers at once.
+
+    Every subset of config.MASK_SPANS numbers is masked. Sentences with more
+    than config.MASK_SPANS_CAP subsets are masked with a seeded sample of them.
 
     Example:
         Original: The maximum of 311, 342, 435, 237, 218 is 435.
@@ -81,30 +251,27 @@ def mask_multiple_numbers(sentence: str) -> Generator[Sample, None, None]:
 
     Args:
         sentence: A sentence to be masked.
+        spans: Spans of the numbers in the sentence. Optional.
     Returns:
         List of samples, such that each sample contains
             sent: A masked sentence.
             targets: The masked part(s) of the input.
     """
-    samples = []
-
-    # Find all matches using Regex
-    pattern = re.compile(r"\d+")
-    for match in pattern.finditer(sentence):
-        start, end = match.span()
-        text_one = match.group()
-        # Replace match with mask token
-        masked_one = sentence[:start] + config.MASK_TOKEN.format(0) + sentence[end:0]
-        newSentence = sentence[end:]
-        for match in pattern.finditer(newSentence):
-            start, end = match.span()
-            text_two = match.group()
-            # Replace match with mask token
-            masked = masked_one + newSentence[:start] + config.MASK_TOKEN.format(1) + newSentence[end:]
-            label = config.MASK_TOKEN.format(0) + " " + text_one + " " + config.MASK_TOKEN.format(1) + " " +  text_two + " " + config.MASK_TOKEN.format(2)
-
-        # Append sample
-        yield Sample(sent=masked, label=label)
+    spans = _number_spans(sentence, spans)
+    for subset in span_sets(*_multiple_sets(sentence, spans)):
+        yield mask_spans(sentence, spans, subset)
+
+
+def count_multiple_numbers(sentence: str, spans: Optional[List[Span]] = None) -> int:
+    """Returns the number of samples mask_multiple_numbers generates for a sentence."""
+    return count_span_sets(len(_number_spans(sentence, spans)), config.MASK_SPANS, config.MASK_SPANS_CAP)
+
+
+def mask_multiple_numbers_at(sentence: str, k: int, spans: Optional[List[Span]] = None) -> Sample:
+    """Returns the k-th sample of mask_multiple_numbers without generating the others."""
+    spans = _number_spans(sentence, spans)
+    count, spans_k, cap, key = _multiple_sets(sentence, spans)
+    return mask_spans(sentence, spans, span_set_at(count, spans_k, k, cap, key))
 
 
 masks = {
@@ -112,3 +279,17 @@ masks = {
     'mask_one_number': mask_one_number,
     'mask_multiple_numbers':mask_multiple_numbers
 }
+
+# Number of samples of each masking function for a sentence
+counts = {
+    'mask_one_digit': count_one_digit,
+    'mask_one_number': count_one_number,
+    'mask_multiple_numbers': count_multiple_numbers,
+}
+
+# Functions returning only the k-th sample of each masking function
+masks_at = {
+    'mask_one_digit': mask_one_digit_at,
+    'mask_one_number': mask_one_number_at,
+    'mask_multiple_numbers': mask_multiple_numbers_at,
+}
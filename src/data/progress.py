@@ -0,0 +1,141 @@
+"""This module tracks the progress and the stage timings of dataset generation.
+
+Each shard of generation is timed per stage: enumerating number lists,
+formatting sentences, masking them, encoding table rows, assigning splits,
+writing to the file and indexing the tables. Tracker aggregates the timings
+per format-mask group, reports throughput, completion and ETA while a run is
+going, and summarizes the run as a dictionary that can be stored as JSON.
+"""
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Generator, Optional, TextIO
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ('enumerate', 'format', 'mask', 'encode', 'split', 'write', 'index')
+
+
+class StageTimes:
+    """Accumulates the time spent in each stage."""
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name: str) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def add(self, other: Dict[str, float]):
+        for name, seconds in other.items():
+            self.seconds[name] += seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: self.seconds[name] for name in STAGES if name in self.seconds}
+
+
+def peak_rss() -> Optional[int]:
+    """Returns the peak resident set size of the process and its workers in bytes."""
+    if resource is None:
+        return None
+    # Linux reports kilobytes, macOS bytes
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+
+class Tracker:
+    """Tracks completed work and stage timings of the groups of a run.
+
+    Work is counted in units, i.e. combinations for generate_all and samples
+    for generate_random, such that completion and ETA are known before any
+    sample is rendered.
+
+    Args:
+        totals: The number of units of each group.
+        show: If set, progress is printed to stream.
+        interval: Minimum number of seconds between two printed lines.
+        stream: The stream progress is printed to. Defaults to stderr.
+    """
+    def __init__(self, totals: Dict[str, int], show: bool = False, interval: float = 1.0,
+                 stream: Optional[TextIO] = None):
+        self.totals = dict(totals)
+        self.show = show
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.units = {group: 0 for group in totals}
+        self.resumed = {group: 0 for group in totals}
+        self.rows = {group: 0 for group in totals}
+        self.times = {group: StageTimes() for group in totals}
+        self.start = time.perf_counter()
+        self.last_report = 0.0
+
+    def resume(self, group: str, units: int):
+        """Records units completed by a previous run."""
+        self.resumed[group] += units
+
+    def add_times(self, group: str, times: Dict[str, float]):
+        """Records the timings of work outside of shards, such as indexing."""
+        self.times[group].add(times)
+
+    def update(self, group: str, units: int, rows: int, times: Dict[str, float]):
+        """Records a completed shard of a group."""
+        self.units[group] += units
+        self.rows[group] += rows
+        self.times[group].add(times)
+        if self.show and time.perf_counter() - self.last_report >= self.interval:
+            self.report(group)
+
+    def report(self, group: Optional[str] = None):
+        """Prints the throughput, completion and ETA of the run, labeled with the last updated group if passed."""
+        self.last_report = time.perf_counter()
+        elapsed = self.last_report - self.start
+        units = sum(self.units.values())
+        done, total = units + sum(self.resumed.values()), sum(self.totals.values())
+        rate = sum(self.rows.values()) / elapsed if elapsed > 0 else 0.0
+        eta = elapsed * (total - done) / units if units else float('inf')
+        rss = peak_rss()
+        label = f"[{group}] " if group is not None else "[total] "
+        print(f"{label}{done}/{total} ({done / max(total, 1):.1%}) | {rate:.0f} samples/s | "
+              f"ETA {_format_seconds(eta)}" + (f" | peak RSS {rss / 2 ** 20:.0f} MiB" if rss else ""),
+              file=self.stream, flush=True)
+
+    def summary(self) -> Dict:
+        """Returns the timings and throughput of the run and of each group."""
+        elapsed = time.perf_counter() - self.start
+        groups = {}
+        for group in self.totals:
+            stage_times = self.times[group].as_dict()
+            busy = sum(stage_times.values())
+            groups[group] = {
+                'units': self.units[group],
+                'resumed_units': self.resumed[group],
+                'total_units': self.totals[group],
+                'rows': self.rows[group],
+                'stages': stage_times,
+                'samples_per_sec': self.rows[group] / busy if busy > 0 else None,
+            }
+        rows = sum(self.rows.values())
+        return {
+            'seconds': elapsed,
+            'rows': rows,
+            'samples_per_sec': rows / elapsed if elapsed > 0 else None,
+            'peak_rss': peak_rss(),
+            'groups': groups,
+        }
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds == float('inf'):
+        return "--:--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,158 @@
+"""This module shares a split of a dataset group between processes in memory.
+
+A split is read from the HDF5 file once and stored in shared memory blocks,
+in the layout of export.MappedDataset: for every field (sent, label), the
+values of all rows concatenated into a fixed-width array (UTF-8 bytes or
+token ids), and the offset of each row into them. Loader workers attach to the
+blocks through a small picklable descriptor instead of opening the file, so
+every chunk is decompressed once and held in memory once for all workers.
+
+The process sharing the split owns the blocks and unlinks them when it is
+closed. Workers must be started by the owning process, such that they share
+its resource tracker.
+
+Example:
+    `
+    with share_split('data/pretrain/dataset.h5', 'format_1_mask_one_digit', 'train') as train:
+        loader = torch.utils.data.DataLoader(train, num_workers=16, ...)
+        ...
+    `
+"""
+import weakref
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import tables
+
+from src import config
+from src.data import export, tokenizer
+
+_ARRAYS = tuple(name for field in export._FIELDS for name in (field, f"{field}_offsets"))
+
+
+class SharedDescriptor(NamedTuple):
+    """Everything a process needs to attach to a shared split.
+
+    blocks maps the name of every array to the name of its shared memory
+    block, its length and its dtype.
+    """
+    group: str
+    split: str
+    layout: str
+    vocab: Optional[List[str]]
+    blocks: Dict[str, Tuple[str, int, str]]
+
+
+def _release(blocks: List[shared_memory.SharedMemory], unlink: bool):
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+class SharedDataset(export.MappedDataset):
+    """A split in shared memory with zero-copy access to every row.
+
+    Rows are accessed like export.MappedDataset, as a single shard. Pickling
+    only stores the descriptor, so the dataset can be sent to worker
+    processes, which attach to the same blocks. Create shared datasets with
+    share_split, or attach with SharedDataset(descriptor).
+    """
+    def __init__(self, descriptor: SharedDescriptor, owner: bool = False):
+        self.descriptor = descriptor
+        self.owner = owner
+        self.layout = descriptor.layout
+        self.tokenizer = tokenizer.Tokenizer(descriptor.vocab) if descriptor.layout == 'tokens' else None
+
+        # Attach to every block and view it as an array
+        self.blocks, arrays = [], {}
+        for name, (block_name, length, dtype) in descriptor.blocks.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            self.blocks.append(block)
+            arrays[name] = np.ndarray((length,), dtype=dtype, buffer=block.buf)
+        self.shards = [[(arrays[field], arrays[f"{field}_offsets"]) for field in export._FIELDS]]
+        self.starts = np.array([0, len(arrays[f"{export._FIELDS[0]}_offsets"]) - 1], dtype=np.int64)
+
+        # Release the blocks once the dataset is closed or collected
+        self._finalizer = weakref.finalize(self, _release, self.blocks, owner)
+
+    def close(self):
+        """Detaches from the blocks, and unlinks them if this process owns them.
+
+        Rows returned by indexing must be released before.
+        """
+        self.shards = []
+        self._finalizer()
+
+    def __enter__(self) -> 'SharedDataset':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getstate__(self) -> Dict:
+        return {'descriptor': self.descriptor}
+
+    def __setstate__(self, state: Dict):
+        self.__init__(SharedDescriptor(*state['descriptor']))
+
+
+def _share_array(values: np.ndarray) -> shared_memory.SharedMemory:
+    """Copies an array to a new shared memory block."""
+    block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+    return block
+
+
+def share_split(path: str, group_name: str, split: str = 'train', layout: str = 'tokens',
+                read_size: int = config.READ_SIZE) -> SharedDataset:
+    """Reads a split of a dataset group into shared memory.
+
+    Groups of any storage can be shared. Rows are read in chunks of read_size
+    and held until the split is read, then copied to the blocks.
+
+    Args:
+        path: Path to the dataset.
+        group_name: The group to share, named {sent_format}_{sent_mask}.
+        split: The split to share, e.g. 'train'.
+        layout: Either 'strings' for UTF-8 bytes or 'tokens' for token ids.
+        read_size: The number of rows read from the dataset at once.
+
+    Returns:
+        The shared split, owned by this process. Close it to release the
+        blocks.
+    """
+    if layout not in export._LAYOUTS:
+        raise KeyError(f"Layout \"{layout}\" does not exist.")
+    chunks = {field: [] for field in export._FIELDS}
+    with tables.open_file(path, mode='r') as h5file:
+        group = h5file.root.datasets[group_name]
+        table = group[split]
+        for start in range(0, table.nrows, read_size):
+            for field, flat in export._read_fields(table, start, min(start + read_size, table.nrows), layout).items():
+                chunks[field].append(flat)
+        vocab = export._vocab(group) if layout == 'tokens' else None
+
+    # Concatenate the chunks of every field
+    arrays = {}
+    dtype = export._LAYOUTS[layout]
+    for field in export._FIELDS:
+        arrays[field] = np.concatenate([np.zeros(0, dtype=dtype)] + [values for values, _ in chunks[field]])\
+            .astype(dtype)
+        arrays[f"{field}_offsets"] = export._offsets(
+            np.concatenate([np.zeros(0, dtype=np.int64)] + [lengths for _, lengths in chunks[field]]))
+    del chunks
+
+    # Copy every array to its own block
+    blocks = {}
+    try:
+        for name in _ARRAYS:
+            blocks[name] = _share_array(arrays[name])
+    except BaseException:
+        _release(list(blocks.values()), unlink=True)
+        raise
+    descriptor = SharedDescriptor(group=group_name, split=split, layout=layout, vocab=vocab, blocks={
+        name: (block.name, len(arrays[name]), arrays[name].dtype.str) for name, block in blocks.items()})
+    _release(list(blocks.values()), unlink=False)
+    return SharedDataset(descriptor, owner=True)
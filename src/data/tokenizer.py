@@ -0,0 +1,115 @@
+"""This module contains a tokenizer for the closed vocabulary of the datasets.
+
+Sentences and labels only contain the words of the format templates, the task
+names, digits, punctuation, spaces, and mask tokens. The vocabulary is built
+deterministically from these, such that every token maps to a fixed id and
+decoding restores the original text. Numbers are split into single digits.
+
+Example:
+    tokenizer = get_tokenizer()
+    ids = tokenizer.encode("The maximum value among <extra_id_0>, and 2 is 2.")
+    text = tokenizer.decode(ids)
+"""
+import re
+from functools import lru_cache
+from itertools import product
+from string import Formatter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from src import config
+from src.data import formats, masks
+
+PAD = "<pad>"
+UNK = "<unk>"
+
+# Mask tokens, single digits, words, spaces, and any other single character
+_TOKEN = re.compile("{mask}|\\d|\\w+|\\s|[^\\w\\s]".format(
+    mask=re.escape(config.MASK_TOKEN).replace(re.escape("{0}"), "\\d+")))
+
+
+def build_vocab() -> List[str]:
+    """Returns the vocabulary of all formats, tasks and mask tokens.
+
+    The padding token has id 0 and the unknown token id 1, followed by the mask
+    tokens and all other tokens in sorted order.
+    """
+    tokens = set(str(digit) for digit in range(10)) | {" ", ",", ".", "-"}
+    for template, task_name in product(formats.templates.values(), config.TASKS):
+        # Compiled patterns contain the task names and number separators
+        pattern, _, _ = formats._compile(template, task_name, 2)
+        for literal, _, _, _ in Formatter().parse(pattern):
+            tokens.update(_TOKEN.findall(literal))
+    sentinels = [config.MASK_TOKEN.format(i) for i in range(config.MASK_SENTINELS)]
+    return [PAD, UNK] + sentinels + sorted(tokens - set(sentinels))
+
+
+class Tokenizer:
+    """Maps text to token ids of a closed vocabulary and back."""
+    def __init__(self, vocab: Optional[List[str]] = None):
+        self.vocab = list(vocab) if vocab is not None else build_vocab()
+        self.ids = {token: i for i, token in enumerate(self.vocab)}
+        self.pad_id = self.ids[PAD]
+        self.unk_id = self.ids[UNK]
+
+    def tokenize(self, text: str) -> List[str]:
+        return _TOKEN.findall(text)
+
+    def encode(self, text: str) -> List[int]:
+        return [self.ids.get(token, self.unk_id) for token in _TOKEN.findall(text)]
+
+    def decode(self, ids: List[int]) -> str:
+        return "".join(self.vocab[i] for i in ids if i != self.pad_id)
+
+    def encode_batch(self, texts: List[str], width: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Encodes texts into a padded int16 array.
+
+        Returns:
+            ids: Array of shape (len(texts), width), padded with the pad id.
+            lengths: Number of tokens of each text.
+
+        Raises:
+            ValueError: If a text has more than width tokens.
+        """
+        ids = np.full((len(texts), width), self.pad_id, dtype=np.int16)
+        lengths = np.empty(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            text_ids = self.encode(text)
+            if len(text_ids) > width:
+                raise ValueError(f"\"{text}\" has more than {width} tokens.")
+            ids[i, :len(text_ids)] = text_ids
+            lengths[i] = len(text_ids)
+        return ids, lengths
+
+    def decode_batch(self, ids: np.ndarray, lengths: np.ndarray) -> List[str]:
+        """Decodes a padded array of ids."""
+        vocab = self.vocab
+        return ["".join(vocab[i] for i in row[:length]) for row, length in zip(ids.tolist(), lengths.tolist())]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer() -> Tokenizer:
+    """Returns the tokenizer of the current vocabulary."""
+    return Tokenizer()
+
+
+def max_lengths(val_range: Tuple[int, int], len_range: Tuple[int, int]) -> Tuple[int, int]:
+    """Returns the maximum number of tokens of sentences and labels.
+
+    The bound is reached by the longest numbers of the range in the longest
+    list. Masking replaces at least one digit with a single mask token, so
+    masked sentences are never longer than the formatted ones.
+    """
+    longest = max(val_range[0], val_range[1] - 1, key=lambda value: len(str(value)))
+    nums = [longest] * (len_range[1] - 1)
+    tokenizer = get_tokenizer()
+    sent_width, label_width = 0, 0
+    for format_fn in formats.formats.values():
+        for task_name in config.TASKS:
+            sentence = format_fn(task_name, nums, longest)
+            sent_width = max(sent_width, len(tokenizer.tokenize(sentence)))
+            for mask_fn in masks.masks.values():
+                for sample in mask_fn(sentence):
+                    label_width = max(label_width, len(tokenizer.tokenize(sample.label)))
+    return sent_width, label_width
@@ -1 +1,159 @@
 """This file contains basic utility functions for datasets."""
+import queue
+import threading
+from itertools import product
+from typing import Generator, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+def count_combinations(val_range: Tuple[int, int], length: int) -> int:
+    """Returns the number of combinations of a given length."""
+    return (val_range[1] - val_range[0]) ** length
+
+
+def iter_combinations(val_range: Tuple[int, int], length: int) -> Iterator[Tuple[int, ...]]:
+    """Lazily yields all combinations of a given length.
+
+    Combinations are yielded one at a time in lexicographic order, i.e. the
+    last number changes fastest. Memory usage does not depend on the range.
+
+    Example:
+        iter_combinations((1, 3), 2) -> (1, 1), (1, 2), (2, 1), (2, 2)
+    """
+    return product(range(*val_range), repeat=length)
+
+
+def unrank_combinations(indices: np.ndarray, val_range: Tuple[int, int], length: int) -> np.ndarray:
+    """Returns the combinations at the given lexicographic indices.
+
+    Args:
+        indices: A 1D integer array of combination indices.
+        val_range: Tuple [start, end) representing the range of values.
+        length: The length of each combination.
+
+    Returns:
+        An int64 array of shape (len(indices), length).
+    """
+    base = val_range[1] - val_range[0]
+    rest = np.array(indices, dtype=np.int64)
+    block = np.empty((rest.shape[0], length), dtype=np.int64)
+    for col in range(length - 1, -1, -1):
+        block[:, col] = rest % base
+        rest //= base
+    return block + val_range[0]
+
+
+def combination_blocks(
+        val_range: Tuple[int, int], length: int, block_size: int,
+        start: int = 0, stop: Optional[int] = None) -> Generator[np.ndarray, None, None]:
+    """Lazily yields combinations of a given length as fixed-size NumPy blocks.
+
+    Blocks contain the combinations with indices [start, stop) in the same
+    order as iter_combinations. Only a single block is held in memory at once.
+    Indices up to stop must fit in int64, even if there are more combinations.
+
+    Args:
+        val_range: Tuple [start, end) representing the range of values.
+        length: The length of each combination.
+        block_size: The maximum number of combinations per block.
+        start: Index of the first combination. Optional.
+        stop: Index after the last combination. Defaults to all combinations.
+
+    Returns:
+        Generator of int64 arrays of shape (<= block_size, length).
+    """
+    total = count_combinations(val_range, length)
+    stop = total if stop is None else min(stop, total)
+    if stop > np.iinfo(np.int64).max:
+        raise OverflowError(f"{stop} combinations of length {length} cannot be indexed with int64.")
+    for lo in range(start, stop, block_size):
+        indices = np.arange(lo, min(lo + block_size, stop), dtype=np.int64)
+        yield unrank_combinations(indices, val_range, length)
+
+
+def count_digits(values: np.ndarray) -> np.ndarray:
+    """Returns the number of decimal digits of each value, ignoring signs."""
+    values = np.abs(np.asarray(values, dtype=np.int64))
+    digits = np.ones(values.shape, dtype=np.int64)
+    threshold = 10
+    while threshold <= values.max(initial=0):
+        digits += values >= threshold
+        threshold *= 10
+    return digits
+
+
+def digit_intervals(val_range: Tuple[int, int]) -> List[Tuple[int, int, int]]:
+    """Splits a range into intervals of values with the same number of digits.
+
+    Example:
+        digit_intervals((-12, 105)) -> [(-12, -10, 2), (-9, 9, 1), (10, 99, 2), (100, 104, 3)]
+
+    Returns:
+        List of tuples (first, last, digits), inclusive of both ends and in
+        ascending order. Signs are not counted as digits.
+    """
+    intervals = []
+    value, end = val_range[0], val_range[1] - 1
+    while value <= end:
+        digits = len(str(abs(value)))
+        if value < 0:
+            # Negative values up to -10 ** (digits - 1) have as many digits, one-digit values up to 9
+            last = -(10 ** (digits - 1)) if digits > 1 else 9
+        else:
+            last = 10 ** digits - 1
+        intervals.append((value, min(last, end), digits))
+        value = min(last, end) + 1
+    return intervals
+
+
+def length_mask(lengths: np.ndarray, max_len: int) -> np.ndarray:
+    """Returns a boolean array marking the valid entries of padded rows."""
+    return np.arange(max_len) < np.asarray(lengths)[:, None]
+
+
+def prefetch(iterable: Iterable, size: int) -> Generator:
+    """Iterates over an iterable in a background thread.
+
+    Up to size items are read ahead into a bounded queue. If the consumer
+    stops early, the thread is stopped before the generator closes. Errors in
+    the thread are raised in the consumer.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                # Wait for space unless the consumer has stopped
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            items.put((done, None))
+        except BaseException as error:
+            items.put((done, error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
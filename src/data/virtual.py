@@ -0,0 +1,297 @@
+"""This module contains a virtual dataset that renders samples on demand.
+
+Every sample of generate_all is a pure function of its task, format, mask,
+number list and masked position. VirtualDataset addresses all samples of a
+format-mask pair by index, in the order of generate_all, and renders a sample
+only when it is accessed. The combination and masked position of an index are
+found by unranking with closed-form prefix counts, so no sample is enumerated
+or stored, and ranges far too large to generate can be used.
+
+A seed shuffles the index space with a keyed bijection, such that the first
+size indices are a uniform subsample without replacement. Splits are
+contiguous ranges of the shuffled indices.
+
+Example:
+    `
+    train = VirtualDataset('format_1', 'mask_one_digit', (0, 10 ** 6), (5, 20), seed=0, size=10 ** 7, split='train')
+    sample = train[12345]
+    `
+"""
+import hashlib
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src import config
+from src.data import dataset, formats, masks, utils
+from src.data.masks import Sample
+
+
+_digit_intervals = lru_cache(maxsize=None)(utils.digit_intervals)
+
+
+@lru_cache(maxsize=config.VIRTUAL_CACHE)
+def _digit_total(val_range: Tuple[int, int], stop: int) -> int:
+    """Returns the total number of digits of the values [val_range[0], stop)."""
+    return sum(max(0, min(last, stop - 1) - first + 1) * digits
+               for first, last, digits in _digit_intervals(val_range))
+
+
+@lru_cache(maxsize=config.VIRTUAL_CACHE)
+def _target_terms(task_name: str, val_range: Tuple[int, int], prefix_range: Tuple[int, int], free: int)\
+        -> Tuple[Tuple[int, int], ...]:
+    """Returns the terms counting the digits of the targets of the blocks following a prefix.
+
+    A block with the first digit values of the range at the position has
+    sum(weight * min(digit, bound)) target digits for maximum, and
+    sum(weight * max(0, digit - bound)) for minimum. The counts of
+    combinations with a target in each digit interval telescope over the
+    interval boundaries, so every boundary contributes a single term.
+
+    Args:
+        task_name: The task of the combinations.
+        val_range: Tuple [start, end) representing the range of values.
+        prefix_range: The smallest and largest value of the prefix.
+        free: The number of values after the position.
+    """
+    lo, hi = val_range
+    intervals = _digit_intervals(val_range)
+    terms = []
+    for i, (first, last, digits) in enumerate(intervals):
+        if task_name == 'maximum':
+            # Combinations with all values up to last
+            if prefix_range[1] <= last:
+                following = intervals[i + 1][2] if i + 1 < len(intervals) else 0
+                terms.append(((digits - following) * (last - lo + 1) ** free, last - lo + 1))
+        elif task_name == 'minimum':
+            # Combinations with all values from first
+            if prefix_range[0] >= first:
+                preceding = intervals[i - 1][2] if i else 0
+                terms.append(((digits - preceding) * (hi - first) ** free, first - lo))
+        else:
+            raise KeyError(f"Task \"{task_name}\" cannot be counted in closed form.")
+    return tuple(terms)
+
+
+def _block_samples(sent_mask: str, task_name: str, val_range: Tuple[int, int], position: int, prefix_digits: int,
+                   prefix_range: Tuple[int, int], digit: int, free: int) -> int:
+    """Counts the samples of a block of combinations in closed form.
+
+    The block holds the combinations starting with a prefix of position
+    values, followed by one of the first digit values of the range and free
+    values. The prefix is summarized by its number of digits and its smallest
+    and largest value, or (val_range[1], val_range[0]) if it is empty, which
+    callers extend value by value.
+    """
+    lo, hi = val_range
+    base = hi - lo
+    count = digit * base ** free
+    length = position + 1 + free
+    if sent_mask == 'mask_one_number':
+        return count * (length + 1)
+    if sent_mask == 'mask_multiple_numbers':
+        return count * masks.count_span_sets(length + 1, config.MASK_SPANS, config.MASK_SPANS_CAP)
+    if sent_mask != 'mask_one_digit':
+        raise KeyError(f"Mask \"{sent_mask}\" does not exist.")
+    if not count:
+        return 0
+
+    # Digits of the numbers of all combinations of the block
+    total = prefix_digits * count
+    total += _digit_total(val_range, lo + digit) * base ** free
+    total += free * base ** (free - 1) * _digit_total(val_range, hi) * digit if free else 0
+
+    # Digits of the targets
+    if task_name == 'maximum':
+        total += sum(weight * min(digit, bound) for weight, bound in _target_terms(task_name, val_range, prefix_range,
+                                                                                  free))
+    else:
+        total += sum(weight * max(0, digit - bound) for weight, bound in _target_terms(task_name, val_range,
+                                                                                      prefix_range, free))
+    return total
+
+
+def _count_samples_before(sent_mask: str, task_name: str, val_range: Tuple[int, int], length: int,
+                          rank: int) -> int:
+    """Counts the samples of the combinations with an index below rank.
+
+    Combinations below rank form one block per position: the digits of rank
+    before the position, a smaller digit at the position, and free values
+    after it.
+    """
+    base = val_range[1] - val_range[0]
+    total, prefix_digits, prefix_range = 0, 0, (val_range[1], val_range[0])
+    for position in range(length):
+        free = length - 1 - position
+        # The first digit of rank equals base for rank == base ** length
+        digit = rank // base ** free if position == 0 else rank // base ** free % base
+        total += _block_samples(sent_mask, task_name, val_range, position, prefix_digits, prefix_range, digit, free)
+        value = val_range[0] + digit
+        prefix_digits += len(str(abs(value)))
+        prefix_range = (min(prefix_range[0], value), max(prefix_range[1], value))
+    return total
+
+
+def _unrank_sample(sent_mask: str, task_name: str, val_range: Tuple[int, int], length: int, offset: int)\
+        -> Tuple[List[int], int]:
+    """Returns the combination and masked position of the sample at an offset.
+
+    Each value of the combination is the largest one whose preceding block of
+    combinations ends at or before the offset. Block counts are piecewise
+    linear in the value, so it is found by interpolating between the bounds,
+    bisecting whenever two steps do not halve them. The digits and range of the
+    prefix are carried from one position to the next.
+    """
+    base = val_range[1] - val_range[0]
+    nums, prefix_digits, prefix_range = [], 0, (val_range[1], val_range[0])
+    for position in range(length):
+        free = length - 1 - position
+
+        # The value is in [low, high], with the blocks of low and high + 1 values around the offset
+        low, high, before = 0, base - 1, 0
+        after = _block_samples(sent_mask, task_name, val_range, position, prefix_digits, prefix_range, base, free)
+
+        # Widths of the bounds before the last two steps
+        widths = (2 * base, 2 * base)
+        while low < high:
+            if 2 * (high - low) > widths[0]:
+                # Bisect if the last two steps did not halve the bounds
+                middle = (low + high + 1) // 2
+            else:
+                middle = low + (offset - before) * (high + 1 - low) // (after - before)
+                middle = min(max(middle, low + 1), high)
+            widths = (widths[1], high - low)
+            samples = _block_samples(sent_mask, task_name, val_range, position, prefix_digits, prefix_range, middle,
+                                     free)
+            if samples <= offset:
+                low, before = middle, samples
+            else:
+                high, after = middle - 1, samples
+        offset -= before
+        value = val_range[0] + low
+        nums.append(value)
+        prefix_digits += len(str(abs(value)))
+        prefix_range = (min(prefix_range[0], value), max(prefix_range[1], value))
+    return nums, offset
+
+
+class _Permutation:
+    """A seeded bijection of [0, size), evaluated per index.
+
+    Indices are permuted by a Feistel network over the smallest even number of
+    bits covering size, and permuted again while they fall outside of
+    [0, size). Each step stays within a domain below 4 * size, so few steps
+    are needed.
+    """
+    ROUNDS = 4
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        self.half = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half) - 1
+        self.digest_size = min(64, (self.half + 7) // 8)
+        state = np.random.SeedSequence(seed).generate_state(self.ROUNDS, dtype=np.uint64)
+        self.keys = [int(key).to_bytes(8, 'little') for key in state]
+
+    def _round(self, value: int, key: bytes) -> int:
+        digest = hashlib.blake2b(value.to_bytes(self.digest_size, 'little'), key=key,
+                                 digest_size=self.digest_size).digest()
+        return int.from_bytes(digest, 'little') & self.mask
+
+    def __call__(self, index: int) -> int:
+        while True:
+            left, right = index >> self.half, index & self.mask
+            for key in self.keys:
+                left, right = right, left ^ self._round(right, key)
+            index = (left << self.half) | right
+            if index < self.size:
+                return index
+
+
+class VirtualDataset:
+    """All samples of a format-mask pair, rendered on demand.
+
+    Indices follow the order of generate_all: tasks, then lengths, then
+    combinations, then masked positions. Locating an index searches the value
+    of every position, taking a few block counts per position and at most
+    about 2 * log2(val_range size).
+
+    Args:
+        sent_format: The sentence format.
+        sent_mask: The method of masking.
+        val_range: Tuple [start, end) representing the range of values.
+        len_range: Tuple [start, end) representing the range of sample lengths.
+        seed: If passed, the index space is shuffled with this seed.
+            Optional.
+        size: The number of (shuffled) indices to use. Defaults to all.
+        split: The split to address, e.g. 'train'. Defaults to all indices.
+            Requires a seed, since unshuffled ranges hold a few tasks and
+            lengths only.
+        ratios: Ratios of the splits, which are consecutive ranges of the
+            shuffled indices in the order of the dictionary.
+
+    Raises:
+        ValueError: If a split is addressed without a seed.
+
+    Spaces larger than sys.maxsize cannot be passed to len(); their size is
+    available as the size attribute.
+    """
+    def __init__(self, sent_format: str, sent_mask: str,
+                 val_range: Tuple[int, int] = config.NUMS_VAL_RANGE,
+                 len_range: Tuple[int, int] = config.NUMS_LEN_RANGE,
+                 seed: Optional[int] = None, size: Optional[int] = None, split: Optional[str] = None,
+                 ratios: Dict[str, float] = config.SPLIT):
+        if sent_format not in formats.formats:
+            raise KeyError(f"Format \"{sent_format}\" does not exist.")
+        if sent_mask not in masks.masks:
+            raise KeyError(f"Mask \"{sent_mask}\" does not exist.")
+        self.sent_format = sent_format
+        self.sent_mask = sent_mask
+        self.val_range = tuple(val_range)
+        self.len_range = tuple(len_range)
+
+        # Samples of every task and length, in the order of generate_all
+        self.streams = [(task_name, length) for task_name in config.TASKS for length in range(*len_range)]
+        self.starts = [0]
+        for task_name, length in self.streams:
+            self.starts.append(self.starts[-1] + dataset._count_all_samples(sent_mask, task_name, val_range, length))
+        self.total = self.starts[-1]
+
+        self.permutation = _Permutation(self.total, seed) if seed is not None else None
+        used = self.total if size is None else min(size, self.total)
+        self.start, self.stop = 0, used
+        if split is not None:
+            if split not in ratios:
+                raise KeyError(f"Split \"{split}\" does not exist.")
+            if seed is None:
+                raise ValueError("Splits require a seed to shuffle the samples.")
+            counts = dataset._split_counts(used, ratios)
+            names = list(counts)
+            self.start = sum(counts[name] for name in names[:names.index(split)])
+            self.stop = self.start + counts[split]
+        self.size = self.stop - self.start
+
+    def __len__(self) -> int:
+        return self.size
+
+    def index(self, i: int) -> int:
+        """Returns the index in the order of generate_all of the i-th sample."""
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(f"Index {i} is out of range.")
+        i += self.start
+        return self.permutation(i) if self.permutation is not None else i
+
+    def __getitem__(self, i: int) -> Sample:
+        index = self.index(i)
+        stream = bisect_right(self.starts, index) - 1
+        task_name, length = self.streams[stream]
+        nums, position = _unrank_sample(self.sent_mask, task_name, self.val_range, length, index - self.starts[stream])
+        sentence, spans = formats.formats[self.sent_format].spans(task_name, nums, config.TASKS[task_name](nums))
+        return masks.masks_at[self.sent_mask](sentence, position, spans)
+
+    def __iter__(self):
+        return (self[i] for i in range(self.size))
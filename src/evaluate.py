@@ -0,0 +1,209 @@
+"""This module scores model predictions against the labels of the datasets.
+
+Labels list the masked parts of a sentence between consecutive mask tokens,
+e.g. "<extra_id_0> 5 <extra_id_1>" or "<extra_id_0> 12 <extra_id_1> 7
+<extra_id_2>". Predictions in the same layout are split into these spans with
+vectorized string operations, and compared by exact match and by the
+absolute error of the numbers they contain.
+
+Predictions are streamed in chunks, aligned with the rows of a table. Metrics
+are summed per format, mask, task, list length and target position, so memory
+does not depend on the number of predictions.
+
+Example:
+    `
+    h5file, datasets = load_datasets(sent_formats='format_1', sent_masks='all')
+    scorer = Scorer()
+    for group_name, group in datasets.items():
+        score_group(scorer, group, predict_chunks(group.test))
+    results = scorer.results(by=('format', 'mask'))
+    `
+"""
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from tables.group import Group
+
+from src import config
+from src.data import dataset, formats, masks
+
+# Fields results are aggregated by
+KEYS = ('format', 'mask', 'task', 'length', 'target_index')
+
+# Sums kept for every key: rows, exactly matched rows, masked spans, spans
+# predicted as numbers, and the absolute error of those spans
+_SUMS = ('count', 'exact', 'spans', 'parsed', 'abs_error')
+
+_MASK_PREFIX = config.MASK_TOKEN.split("{")[0]
+
+
+def parse_spans(labels: np.ndarray, count: int) -> np.ndarray:
+    """Returns the text between consecutive mask tokens of each label.
+
+    Example:
+        parse_spans(["<extra_id_0> 12 <extra_id_1> 7 <extra_id_2>"], 2) -> [["12", "7"]]
+
+    Args:
+        labels: Array of labels or predictions.
+        count: The number of spans to return per label.
+
+    Returns:
+        A string array of shape (len(labels), count). Spans missing from a
+        label are empty.
+    """
+    rest = np.asarray(labels, dtype=str)
+    spans = np.empty((len(rest), count), dtype=rest.dtype)
+    for i in range(count):
+        rest = np.char.partition(rest, config.MASK_TOKEN.format(i))[:, 2]
+        spans[:, i] = np.char.strip(np.char.partition(rest, config.MASK_TOKEN.format(i + 1))[:, 0])
+    return spans
+
+
+def _to_numbers(spans: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Converts spans to numbers, along with a mask of the spans that are numbers.
+
+    Only spans matching -?[0-9]+ are numbers; other spans are left at 0.
+    """
+    # Drop a single leading sign, then check that only ASCII digits remain
+    negative = np.char.startswith(spans, "-")
+    digits = np.where(negative, np.char.replace(spans, "-", "", count=1), spans)
+    valid = (np.char.str_len(digits) > 0) & (np.char.str_len(np.char.strip(digits, "0123456789")) == 0)
+    values = np.zeros(spans.shape, dtype=np.float64)
+    values[valid] = spans[valid].astype(np.float64)
+    return values, valid
+
+
+def _group_params(group_name: str) -> Tuple[str, str]:
+    """Splits a group name into its format and mask."""
+    for sent_format in formats.formats:
+        sent_mask = group_name[len(sent_format) + 1:]
+        if group_name.startswith(sent_format + "_") and sent_mask in masks.masks:
+            return sent_format, sent_mask
+    raise KeyError(f"Group \"{group_name}\" does not exist.")
+
+
+class Scorer:
+    """Sums metrics of predictions per format, mask, task, list length and target position."""
+    def __init__(self):
+        self.sums = {}
+
+    def update(self, sent_format: str, sent_mask: str, predictions: Sequence[str], labels: Sequence[str],
+               tasks: np.ndarray, lengths: np.ndarray, target_indices: np.ndarray):
+        """Scores a chunk of predictions.
+
+        Args:
+            sent_format: The format of the samples.
+            sent_mask: The mask of the samples.
+            predictions: Predicted labels.
+            labels: Gold labels.
+            tasks: Index of the task of each sample in config.TASKS.
+            lengths: The list length of each sample.
+            target_indices: Position of the target in each list.
+        """
+        labels = np.asarray(labels, dtype=str)
+        if len(predictions) != len(labels):
+            raise ValueError(f"Got {len(predictions)} predictions for {len(labels)} labels.")
+        if not len(labels):
+            return
+
+        # Only the spans of the gold labels are compared
+        counts = np.char.count(labels, _MASK_PREFIX) - 1
+        width = int(counts.max())
+        valid = np.arange(width) < counts[:, None]
+        gold, predicted = parse_spans(labels, width), parse_spans(predictions, width)
+        gold_values, _ = _to_numbers(gold)
+        predicted_values, parsed = _to_numbers(predicted)
+        parsed &= valid
+        metrics = np.stack([
+            np.ones(len(labels)),
+            np.all((gold == predicted) | ~valid, axis=1),
+            counts,
+            parsed.sum(axis=1),
+            np.where(parsed, np.abs(predicted_values - gold_values), 0).sum(axis=1),
+        ], axis=1)
+
+        # Sum the metrics of every key of the chunk
+        keys, inverse = np.unique(np.stack([tasks, lengths, target_indices], axis=1), axis=0, return_inverse=True)
+        sums = np.zeros((len(keys), len(_SUMS)))
+        np.add.at(sums, inverse.ravel(), metrics)
+        task_names = list(config.TASKS)
+        for (task, length, target_index), key_sums in zip(keys.tolist(), sums):
+            key = (sent_format, sent_mask, task_names[task], length, target_index)
+            self.sums[key] = self.sums.get(key, 0) + key_sums
+
+    def results(self, by: Sequence[str] = KEYS) -> List[Dict]:
+        """Returns the metrics aggregated by some of the keys.
+
+        Args:
+            by: The keys to aggregate by, a subset of KEYS.
+
+        Returns:
+            One dictionary per value of the keys, in sorted order, with the
+            keys, the number of samples, the exact match rate, the rate of
+            spans predicted as numbers and the mean absolute error of these
+            spans.
+        """
+        for name in by:
+            if name not in KEYS:
+                raise KeyError(f"Key \"{name}\" does not exist.")
+        aggregated = {}
+        for key, key_sums in self.sums.items():
+            values = tuple(key[KEYS.index(name)] for name in by)
+            aggregated[values] = aggregated.get(values, 0) + key_sums
+
+        results = []
+        for values in sorted(aggregated):
+            count, exact, spans, parsed, abs_error = aggregated[values].tolist()
+            result = dict(zip(by, values))
+            result.update({
+                'count': int(count),
+                'exact_match': exact / count,
+                'parse_rate': parsed / spans if spans else None,
+                'mean_abs_error': abs_error / parsed if parsed else None,
+            })
+            results.append(result)
+        return results
+
+
+def _read_chunk(table, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Reads the labels, tasks, lengths and target positions of rows of a table."""
+    rows = table.read(start, stop)
+    if 'sent' in rows.dtype.names:
+        sents, labels = np.char.decode(rows['sent']), np.char.decode(rows['label'])
+    else:
+        samples = dataset._decode_rows(table, rows)
+        sents = np.array([sample.sent for sample in samples], dtype=str)
+        labels = np.array([sample.label for sample in samples], dtype=str)
+
+    # Every sentence names its task
+    tasks = np.zeros(len(rows), dtype=np.int64)
+    for i, task_name in enumerate(config.TASKS):
+        tasks[np.char.find(sents, task_name) >= 0] = i
+    return labels, tasks, rows['length'].astype(np.int64), rows['target_index'].astype(np.int64)
+
+
+def score_group(scorer: Scorer, group: Group, predictions: Iterable[Sequence[str]], split: str = 'test'):
+    """Scores chunks of predictions against the rows of a split, in order.
+
+    Only the rows read so far are held in memory. Fewer predictions than rows
+    score the first rows.
+
+    Args:
+        scorer: The scorer to add the metrics to.
+        group: A dataset group, as returned by load_datasets.
+        predictions: Chunks of predicted labels, one per row.
+        split: The table of the group: train, val, or test.
+
+    Raises:
+        ValueError: If there are more predictions than rows.
+    """
+    sent_format, sent_mask = _group_params(group._v_name)
+    table = group[split]
+    start = 0
+    for chunk in predictions:
+        stop = start + len(chunk)
+        if stop > table.nrows:
+            raise ValueError(f"Got more predictions than the {table.nrows} rows of {group._v_name}/{split}.")
+        labels, tasks, lengths, target_indices = _read_chunk(table, start, stop)
+        scorer.update(sent_format, sent_mask, chunk, labels, tasks, lengths, target_indices)
+        start = stop
@@ -0,0 +1,156 @@
+"""This module runs several generation jobs declared in a JSON or YAML spec.
+
+A spec is a list of jobs, or a dictionary with the list of jobs under 'jobs'
+and options shared by all jobs under 'defaults'. Every job has a kind, 'all'
+or 'random', and the arguments of dataset.generate_all or
+dataset.generate_random respectively.
+
+Example:
+    `
+    defaults:
+      path: data/pretrain/dataset.h5
+      val_range: [0, 100]
+    jobs:
+      - kind: all
+        len_range: [2, 4]
+        sent_masks: [mask_one_number]
+      - kind: all
+        len_range: [2, 4]
+        sent_masks: [mask_one_digit]
+      - kind: random
+        count: 100000
+        sent_formats: [format_1, format_2]
+        seed: 0
+    `
+
+All jobs are planned and checked before any of them runs. Jobs with the same
+arguments except for their masks, or except for their formats, are merged into
+a single run, so they share the open file, the worker pool and the progress
+summary. The dataset module is only imported to run jobs, which keeps loading
+and planning a spec fast.
+"""
+import inspect
+import json
+from typing import Dict, List, Union
+
+from src.data import formats, masks
+
+# Generation function of each job kind
+_KINDS = {
+    'all': 'generate_all',
+    'random': 'generate_random',
+}
+
+# Options that can differ between merged jobs
+_MERGED = ('sent_formats', 'sent_masks')
+
+
+def load_spec(path: str) -> List[Dict]:
+    """Reads the jobs of a JSON or YAML spec, with the defaults applied."""
+    with open(path) as spec_file:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+    if isinstance(spec, list):
+        spec = {'jobs': spec}
+    defaults = spec.get('defaults', {})
+    return [dict(defaults, **job) for job in spec['jobs']]
+
+
+def _parse_names(names: Union[str, List[str]], registry: Dict, kind: str) -> List[str]:
+    # Expand 'all' and check every name
+    if names == 'all' or names == ['all']:
+        return list(registry)
+    names = [names] if isinstance(names, str) else list(names)
+    for name in names:
+        if name not in registry:
+            raise KeyError(f"{kind} \"{name}\" does not exist.")
+    return names
+
+
+def normalize_job(job: Dict) -> Dict:
+    """Returns a job with explicit formats and masks, tuple ranges and a split dictionary.
+
+    Raises:
+        KeyError: If the kind, a format or a mask does not exist.
+    """
+    job = dict(job)
+    if job.get('kind') not in _KINDS:
+        raise KeyError(f"Job kind \"{job.get('kind')}\" does not exist.")
+    job['sent_formats'] = _parse_names(job.get('sent_formats', 'all'), formats.formats, "Format")
+    job['sent_masks'] = _parse_names(job.get('sent_masks', 'all'), masks.masks, "Mask")
+    for name in ('val_range', 'len_range'):
+        if name in job:
+            job[name] = tuple(job[name])
+    if isinstance(job.get('split'), (list, tuple)):
+        job['split'] = dict(zip(('train', 'val', 'test'), job['split']))
+    return job
+
+
+def _merge_key(job: Dict) -> str:
+    return json.dumps({name: value for name, value in job.items() if name not in _MERGED}, sort_keys=True)
+
+
+def _union(names: List[str], other: List[str]) -> List[str]:
+    return names + [name for name in other if name not in names]
+
+
+def plan_jobs(jobs: List[Dict]) -> List[Dict]:
+    """Normalizes jobs and merges the ones that can run together.
+
+    A job is merged into an earlier one with the same arguments and either the
+    same formats or the same masks, which adds its masks or formats. Merged
+    runs generate the same groups as the separate jobs.
+    """
+    planned = []
+    for job in map(normalize_job, jobs):
+        key = _merge_key(job)
+        for other in planned:
+            if _merge_key(other) != key:
+                continue
+            if other['sent_formats'] == job['sent_formats']:
+                other['sent_masks'] = _union(other['sent_masks'], job['sent_masks'])
+                break
+            if other['sent_masks'] == job['sent_masks']:
+                other['sent_formats'] = _union(other['sent_formats'], job['sent_formats'])
+                break
+        else:
+            planned.append(job)
+    return planned
+
+
+def _generate_fn(kind: str):
+    from src.data import dataset
+    return getattr(dataset, _KINDS[kind])
+
+
+def _arguments(job: Dict) -> Dict:
+    """Returns the arguments of a normalized job, checked against its generation function."""
+    arguments = {name: value for name, value in job.items() if name != 'kind'}
+    parameters = inspect.signature(_generate_fn(job['kind'])).parameters
+    for name in arguments:
+        if name not in parameters:
+            raise KeyError(f"Option \"{name}\" does not exist for jobs of kind \"{job['kind']}\".")
+    return arguments
+
+
+def run_job(job: Dict) -> Dict:
+    """Runs a single job and returns the result of its generation function."""
+    job = normalize_job(job)
+    return _generate_fn(job['kind'])(**_arguments(job))
+
+
+def run_spec(jobs: List[Dict]) -> List[Dict]:
+    """Plans and runs jobs in a single process.
+
+    Every planned run is checked before the first one starts, so a mistake in
+    the last job does not fail the spec after hours of generation.
+
+    Returns:
+        The result of every planned run, in order.
+    """
+    planned = plan_jobs(jobs)
+    arguments = [_arguments(job) for job in planned]
+    return [_generate_fn(job['kind'])(**job_arguments) for job, job_arguments in zip(planned, arguments)]
@@ -0,0 +1,20 @@
+import os
+import tempfile
+import unittest
+import tables
+
+
+class DatasetFiles(unittest.TestCase):
+    """Runs every test in a temporary directory, with a default dataset path."""
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "dataset.h5")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _read(self, path):
+        # Read the rows of every table of every group
+        with tables.open_file(path) as h5file:
+            return {(group._v_name, table._v_name): table.read().tolist()
+                    for group in h5file.root.datasets for table in group}
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+from src import benchmark
+
+
+class BenchmarkRun(unittest.TestCase):
+    def test_results(self):
+        results = benchmark.run_benchmarks(samples=20, val_ranges=[(0, 100)], len_ranges=[(2, 5)], repeat=1,
+                                           names=['format', 'hdf5/read'])
+        names = set(results['results'])
+        self.assertIn("format/format_1/val=0:100/len=2:5", names, "should benchmark every format.")
+        self.assertIn("hdf5/read/canonical/val=0:100/len=2:5", names, "should benchmark the read path.")
+        self.assertFalse(any(name.startswith(("mask", "hdf5/write")) for name in names),
+                         "should only run the selected benchmarks.")
+        self.assertTrue(all(result['samples'] >= 20 and result['samples_per_sec'] > 0
+                            for result in results['results'].values()), "should count the processed samples.")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "results.json")
+            benchmark.save_results(results, path)
+            self.assertEqual(results, benchmark.load_results(path), "should store the results as JSON.")
+
+    def test_generation(self):
+        results = benchmark.run_benchmarks(samples=20, val_ranges=[(0, 100)], len_ranges=[(2, 5)], repeat=1,
+                                           names=['generate'])
+        self.assertEqual({"generate/all/val=0:100/len=2:5", "generate/random/val=0:100/len=2:5"},
+                         set(results['results']), "should keep the names of the generation benchmarks.")
+        self.assertTrue(all(result['samples'] >= 20 for result in results['results'].values()),
+                        "should generate the requested samples.")
+
+
+class BenchmarkCompare(unittest.TestCase):
+    def test_regressions(self):
+        baseline = {'results': {'a': {'samples_per_sec': 100.0}, 'b': {'samples_per_sec': 100.0},
+                                'c': {'samples_per_sec': 100.0}}}
+        results = {'results': {'a': {'samples_per_sec': 95.0}, 'b': {'samples_per_sec': 50.0},
+                               'd': {'samples_per_sec': 1.0}}}
+        regressions = benchmark.compare_results(results, baseline, threshold=0.1)
+        self.assertEqual(['b'], [regression.name for regression in regressions],
+                         "should only flag drops above the threshold.")
+        self.assertAlmostEqual(-0.5, regressions[0].change)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,30 +1,13 @@
+import io
+import json
+import os
 import unittest
-from src.data import dataset, masks
-
-
-class DatasetCombineIter(unittest.TestCase):
-    COMBINATIONS = [[1], [2]]
-    DATA = [1, 2]
-
-    def test_len(self):
-        combinations = dataset._combine_iter(self.COMBINATIONS, self.DATA)
-        self.assertEqual(len(combinations), 4, "should generate the correct number of combinations")
-
-    def test_val(self):
-        combinations = dataset._combine_iter(self.COMBINATIONS, self.DATA)
-        targets = [
-            [1, 1],
-            [1, 2],
-            [2, 1],
-            [2, 2],
-        ]
-        is_in = True
-        for target in targets:
-            if target not in combinations:
-                is_in = False
-                break
-
-        self.assertTrue(is_in, "should generate all possible combinations.")
+from unittest import mock
+import numpy as np
+import tables
+from src import config
+from src.data import dataset, formats, masks, utils
+from test.files import DatasetFiles
 
 
 class DatasetGenerate(unittest.TestCase):
@@ -38,8 +21,8 @@ class DatasetGenerate(unittest.TestCase):
         ]
         target_samples = []
         for target_sent in target_sents:
-            target_samples.extend(masks.mask_1d(target_sent))
-        samples = list(dataset._generate_samples_all('format_1', 'mask_1d', 'maximum', (1, 3), (2, 3)))
+            target_samples.extend(masks.mask_one_digit(target_sent))
+        samples = list(dataset._generate_samples_all('format_1', 'mask_one_digit', 'maximum', (1, 3), (2, 3)))
         is_in = True
         for target in target_samples:
             if target not in samples:
@@ -49,7 +32,7 @@ class DatasetGenerate(unittest.TestCase):
         self.assertTrue(is_in, "should generate all possible samples.")
 
     def test_random_len(self):
-        samples = samples = list(dataset._generate_samples_random(10, 'format_1', 'mask_1d', 'maximum', (1, 3), (2, 3)))
+        samples = samples = list(dataset._generate_samples_random(10, 'format_1', 'mask_one_digit', 'maximum', (1, 3), (2, 3)))
         self.assertEqual(10, len(samples), "should generate the correct number of samples.")
 
     def test_random_val(self):
@@ -62,11 +45,406 @@ class DatasetGenerate(unittest.TestCase):
         ]
         target_samples = []
         for target_sent in target_sents:
-            target_samples.extend(masks.mask_1d(target_sent))
-        samples = list(dataset._generate_samples_random(10, 'format_1', 'mask_1d', 'maximum', (1, 3), (2, 3)))
+            target_samples.extend(masks.mask_one_digit(target_sent))
+        samples = list(dataset._generate_samples_random(10, 'format_1', 'mask_one_digit', 'maximum', (1, 3), (2, 3)))
 
         # Check if samples are a subset of the target samples
         is_subset = set(samples).issubset(set(target_samples))
         print(samples)
         self.assertTrue(is_subset, "should generate some correct values.")
 
+
+
+class DatasetRandomBlocks(unittest.TestCase):
+    def test_seed(self):
+        samples_a = list(dataset._generate_samples_random(
+            20, 'format_1', 'mask_one_digit', 'maximum', (0, 100), (2, 6), 3, 7))
+        samples_b = list(dataset._generate_samples_random(
+            20, 'format_1', 'mask_one_digit', 'maximum', (0, 100), (2, 6), 3, 7))
+        self.assertEqual(samples_a, samples_b, "should be reproducible from a seed.")
+
+    def test_targets(self):
+        block = next(dataset._random_blocks(50, 'mask_one_number', 'minimum', (0, 100), (2, 6),
+                                            np.random.default_rng(0)))
+        for nums, length, target in zip(block.nums.tolist(), block.lengths.tolist(), block.targets.tolist()):
+            self.assertEqual(min(nums[:length]), target, "should compute targets over valid entries only.")
+
+    def test_positions(self):
+        block = next(dataset._random_blocks(50, 'mask_one_digit', 'maximum', (0, 1000), (2, 6),
+                                            np.random.default_rng(0)))
+        for sample, nums, length, target, position in zip(
+                dataset._render_block(block, 'format_1', 'mask_one_digit', 'maximum'), block.nums.tolist(),
+                block.lengths.tolist(), block.targets.tolist(), block.positions.tolist()):
+            samples = list(masks.mask_one_digit(formats.format_1('maximum', nums[:length], target)))
+            self.assertEqual(samples[position], sample, "should render the selected masked variant.")
+
+
+class DatasetChunkWriter(unittest.TestCase):
+    def setUp(self):
+        self.h5file = tables.open_file("writer.h5", mode="w", driver="H5FD_CORE", driver_core_backing_store=0)
+        self.h5file.create_group('/', 'datasets', 'Datasets')
+
+    def tearDown(self):
+        self.h5file.close()
+
+    def test_split(self):
+        split = {'train': 0.7, 'val': 0.1, 'test': 0.2}
+        assignment = dataset._assign_splits(0, 10000, split)
+        counts = np.bincount(assignment, minlength=3)
+        for count, ratio in zip(counts, split.values()):
+            self.assertAlmostEqual(count / 10000, ratio, delta=0.01, msg="should follow the split ratios.")
+        self.assertTrue(np.array_equal(assignment[2500:5000], dataset._assign_splits(2500, 2500, split)),
+                        "should depend only on the sample index.")
+
+    def test_write(self):
+        description, _, _ = dataset._storage_layout('strings', (1, 4), (2, 3))
+        data_tables = dataset._create_tables(self.h5file, 'format_1', 'mask_one_number', False, description)
+        writer = dataset._ChunkWriter(data_tables, config.SPLIT, chunk_size=7)
+        shard = next(dataset._all_shards('format_1', ('mask_one_number',), (1, 4), (2, 3)))
+        rows, _, _ = dataset._produce_shard(shard)['mask_one_number']
+        writer.write_rows(rows)
+        writer.flush()
+
+        written = [row for table in data_tables.values() for row in table.read().tolist()]
+        self.assertEqual(sorted(rows.tolist()), sorted(written), "should write every row exactly once.")
+
+
+class DatasetWorkers(DatasetFiles):
+    def test_random(self):
+        paths = [os.path.join(self.tmpdir.name, f"random_{workers}.h5") for workers in (1, 2)]
+        for workers, path in zip((1, 2), paths):
+            dataset.generate_random(50, path=path, sent_formats='format_1', sent_masks='mask_one_number',
+                                    seed=4, workers=workers)
+        self.assertEqual(self._read(paths[0]), self._read(paths[1]),
+                         "should not depend on the number of workers.")
+
+    def test_all(self):
+        paths = [os.path.join(self.tmpdir.name, f"all_{workers}.h5") for workers in (1, 2)]
+        for workers, path in zip((1, 2), paths):
+            dataset.generate_all((1, 4), (2, 4), path=path, sent_formats='format_1',
+                                 sent_masks='mask_one_number', workers=workers)
+        self.assertEqual(self._read(paths[0]), self._read(paths[1]),
+                         "should not depend on the number of workers.")
+
+
+class DatasetCanonical(DatasetFiles):
+    def _read_samples(self, path):
+        with tables.open_file(path) as h5file:
+            return {(group._v_name, table._v_name): dataset.read_samples(table)
+                    for group in h5file.root.datasets for table in group}
+
+    def test_random(self):
+        paths = [os.path.join(self.tmpdir.name, f"random_{storage}.h5") for storage in ('strings', 'canonical')]
+        for storage, path in zip(('strings', 'canonical'), paths):
+            dataset.generate_random(50, path=path, sent_formats='format_2', sent_masks='mask_one_digit',
+                                    seed=4, storage=storage)
+        self.assertEqual(self._read_samples(paths[0]), self._read_samples(paths[1]),
+                         "should render the same samples as the string layout.")
+
+    def test_all(self):
+        paths = [os.path.join(self.tmpdir.name, f"all_{storage}.h5") for storage in ('strings', 'canonical')]
+        for storage, path in zip(('strings', 'canonical'), paths):
+            dataset.generate_all((8, 12), (2, 4), path=path, sent_formats='format_1',
+                                 sent_masks='mask_one_digit', storage=storage)
+        self.assertEqual(self._read_samples(paths[0]), self._read_samples(paths[1]),
+                         "should render the same samples as the string layout.")
+
+    def test_tokens(self):
+        storages = ('strings', 'tokens', 'strings_tokens')
+        paths = [os.path.join(self.tmpdir.name, f"random_{storage}.h5") for storage in storages]
+        for storage, path in zip(storages, paths):
+            dataset.generate_random(50, (-100, 100), path=path, sent_formats='format_4',
+                                    sent_masks='mask_multiple_numbers', seed=4, storage=storage)
+        for path in paths[1:]:
+            self.assertEqual(self._read_samples(paths[0]), self._read_samples(path),
+                             "should decode the same samples as the string layout.")
+
+
+class DatasetMetadata(DatasetFiles):
+    @mock.patch.object(config, 'MASK_SPANS_CAP', 3)
+    def test_columns(self):
+        dataset.generate_random(200, (-20, 120), path=self.path, sent_formats=['format_2', 'format_5'],
+                                sent_masks='all', seed=3, storage='canonical')
+        with tables.open_file(self.path) as h5file:
+            for group in h5file.root.datasets:
+                rows = group.test.read()
+                for row, sample in zip(rows, dataset.read_samples(group.test)):
+                    nums = row['nums'][:row['length']].tolist()
+                    self.assertEqual((min(nums), max(nums)), (row['min_value'], row['max_value']),
+                                     "should store the range of the numbers.")
+                    self.assertEqual(nums.index(row['target']), row['target_index'],
+                                     "should store the index of the target.")
+                    masked = row['target'] if row['masked_index'] == -1 else nums[row['masked_index']]
+                    self.assertIn(sample.label.split()[1], str(masked), "should store the masked number.")
+
+    def test_read_where(self):
+        dataset.generate_random(300, path=self.path, sent_formats='format_1', sent_masks='mask_one_number', seed=3)
+        with tables.open_file(self.path) as h5file:
+            table = h5file.root.datasets.format_1_mask_one_number.test
+            self.assertTrue(table.cols.max_value.is_indexed, "should index the metadata columns.")
+            rows = table.read()
+            expected = rows[(rows['length'] == 7) & (rows['max_value'] >= 90) & (rows['masked_index'] != -1)]
+            selected = dataset.read_where(table, "masked_index != -1", length=7, max_value=(90, None))
+            self.assertEqual(expected.tolist(), selected.tolist(), "should select the matching rows.")
+            self.assertEqual([(sent.decode(), label.decode()) for sent, label in expected[['sent', 'label']].tolist()],
+                             [tuple(sample) for sample in dataset.read_samples_where(
+                                 table, "masked_index != -1", length=7, max_value=(90, None))],
+                             "should read the matching samples.")
+
+
+class DatasetHashSplits(DatasetFiles):
+    def _splits(self, path, with_format):
+        # Map each key to the splits it was assigned to
+        splits = {}
+        with tables.open_file(path) as h5file:
+            for group in h5file.root.datasets:
+                for table in group:
+                    for row in table.read():
+                        key = (row['task'], tuple(row['nums'][:row['length']].tolist()))
+                        key = key + (row['format'],) if with_format else key
+                        splits.setdefault(key, set()).add(table.name)
+        return splits
+
+    def test_masks(self):
+        path = os.path.join(self.tmpdir.name, "all.h5")
+        dataset.generate_all((0, 12), (2, 4), path=path, sent_formats=['format_1', 'format_3'],
+                             sent_masks=['mask_one_digit', 'mask_one_number'], storage='canonical', split_mode='hash')
+        splits = self._splits(path, with_format=False)
+        self.assertTrue(all(len(table_names) == 1 for table_names in splits.values()),
+                        "should assign all samples of a number list to one split.")
+        self.assertEqual({'train', 'val', 'test'}, set.union(*splits.values()), "should use every split.")
+
+    def test_random(self):
+        paths = [os.path.join(self.tmpdir.name, f"random_{workers}.h5") for workers in (1, 2)]
+        for workers, path in zip((1, 2), paths):
+            dataset.generate_random(300, (0, 5), (2, 4), path=path, sent_formats=['format_1', 'format_3'],
+                                    sent_masks='mask_one_number', seed=1, storage='canonical', workers=workers,
+                                    split_mode='hash_format')
+        splits = self._splits(paths[0], with_format=True)
+        self.assertTrue(all(len(table_names) == 1 for table_names in splits.values()),
+                        "should assign all samples of a number list and format to one split.")
+        self.assertEqual(splits, self._splits(paths[1], with_format=True), "should not depend on the workers.")
+
+
+class DatasetProfile(DatasetFiles):
+    def test_summary(self):
+        profile = os.path.join(self.tmpdir.name, "profile.json")
+        summary = dataset.generate_all((0, 10), (2, 4), path=self.path, sent_formats='format_1',
+                                       sent_masks='mask_one_number', profile=profile)
+        with open(profile) as profile_file:
+            self.assertEqual(summary['rows'], json.load(profile_file)['rows'], "should write the summary.")
+        group = summary['groups']['format_1_mask_one_number']
+        self.assertEqual(group['total_units'], group['units'], "should complete every combination.")
+        self.assertEqual(2 * (3 * 100 + 4 * 1000), summary['rows'], "should count every sample.")
+        self.assertEqual({'enumerate', 'format', 'mask', 'encode', 'write', 'index'}, set(group['stages']),
+                         "should time every stage.")
+
+    def test_empty(self):
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stream:
+            summary = dataset.generate_random(5, path=self.path, sent_formats=[], progress=True)
+        self.assertEqual(0, summary['rows'], "should complete a run without groups.")
+        self.assertIn("[total] 0/0", stream.getvalue(), "should report the totals of the run.")
+
+
+class DatasetEstimate(DatasetFiles):
+    def test_counts(self):
+        cases = [((-12, 15), 'maximum', 2), ((-12, 15), 'minimum', 3), ((5, 105), 'maximum', 2)]
+        for val_range, task_name, length in cases:
+            nums = np.array([list(combination) for combination in utils.iter_combinations(val_range, length)])
+            lengths = np.full(len(nums), length)
+            targets = dataset._block_targets(task_name, nums, lengths)
+            self.assertEqual(dataset._count_candidates('mask_one_digit', nums, lengths, targets).sum(),
+                             dataset._count_all_samples('mask_one_digit', task_name, val_range, length),
+                             "should count the samples of every combination.")
+
+    def test_dry_run(self):
+        estimate = dataset.generate_all((0, 12), (2, 4), path=self.path, sent_formats='format_1',
+                                        sent_masks='mask_one_digit', dry_run=True)
+        self.assertFalse(os.path.exists(self.path), "should not generate samples.")
+        summary = dataset.generate_all((0, 12), (2, 4), path=self.path, sent_formats='format_1',
+                                       sent_masks='mask_one_digit')
+        self.assertEqual(summary['rows'], estimate['samples'], "should count every sample exactly.")
+        group = estimate['groups']['format_1_mask_one_digit']
+        self.assertEqual(estimate['samples'], sum(group['splits'].values()), "should split every sample.")
+        self.assertGreater(estimate['bytes'], 0, "should estimate the size.")
+
+    def test_budget(self):
+        with self.assertRaises(ValueError):
+            dataset.generate_all((0, 12), (2, 4), path=self.path, sent_formats='format_1',
+                                 sent_masks='mask_one_digit', max_bytes=1)
+        self.assertFalse(os.path.exists(self.path), "should refuse the run before writing.")
+
+    def test_oversized(self):
+        # More combinations of length 10 than int64 can index
+        estimate = dataset.estimate_all((0, 200), (9, 11), 'format_1', 'mask_one_number', sample_size=10)
+        self.assertEqual(len(config.TASKS) * (200 ** 9 * 10 + 200 ** 10 * 11), estimate['samples'],
+                         "should count the samples exactly.")
+        self.assertGreater(estimate['bytes'], 0, "should estimate the size.")
+        with self.assertRaises(ValueError):
+            dataset.generate_all((0, 200), (9, 11), path=self.path, sent_formats='format_1',
+                                 sent_masks='mask_one_number', max_bytes=1)
+
+
+class DatasetIncremental(DatasetFiles):
+    def _generate(self, sent_masks, **kwargs):
+        return dataset.generate_random(20, path=self.path, sent_formats='format_1', sent_masks=sent_masks, seed=0,
+                                       incremental=True, **kwargs)
+
+    def _read(self, group_name):
+        with tables.open_file(self.path) as h5file:
+            return h5file.root.datasets[group_name].train.read().tolist()
+
+    def test_skip(self):
+        self._generate('mask_one_number')
+        rows = self._read('format_1_mask_one_number')
+        summary = self._generate(['mask_one_number', 'mask_one_digit'])
+        self.assertEqual(['format_1_mask_one_number'], summary['skipped'], "should skip up-to-date groups.")
+        self.assertEqual(2 * 20, summary['rows'], "should only generate the missing group.")
+        self.assertEqual(rows, self._read('format_1_mask_one_number'), "should keep skipped groups.")
+        with tables.open_file(self.path) as h5file:
+            manifest = h5file.root.datasets.format_1_mask_one_digit._v_attrs.manifest
+        self.assertEqual(0, manifest['seed'], "should record the seed.")
+        self.assertEqual(2 * 20, sum(manifest['counts'].values()), "should record the row counts.")
+
+    def test_stale(self):
+        self._generate('mask_one_number')
+        summary = self._generate('mask_one_number', split_mode='hash')
+        self.assertEqual([], summary['skipped'], "should rebuild groups of other parameters.")
+        with mock.patch.object(dataset, '_code_hash', return_value='changed'):
+            summary = self._generate('mask_one_number', split_mode='hash')
+        self.assertEqual([], summary['skipped'], "should rebuild groups of other code.")
+
+
+class DatasetPipeline(DatasetFiles):
+    def _generate(self, name, **kwargs):
+        path = os.path.join(self.tmpdir.name, name)
+        dataset.generate_random(30, path=path, sent_formats='format_1',
+                                sent_masks=['mask_one_digit', 'mask_one_number'], seed=3, **kwargs)
+        return self._read(path)
+
+    @mock.patch.object(config, 'SHARD_SIZE', 4)
+    def test_output(self):
+        self.assertEqual(self._generate("serial.h5"), self._generate("pipelined.h5", pipeline=True, queue_size=1),
+                         "should write the same file as the serial loop.")
+
+    @mock.patch.object(config, 'SHARD_SIZE', 4)
+    def test_writer_error(self):
+        with mock.patch.object(dataset._ChunkWriter, 'write_rows', side_effect=IOError("disk full")):
+            with self.assertRaises(IOError):
+                self._generate("failed.h5", pipeline=True, queue_size=1)
+
+    @mock.patch.object(config, 'SHARD_SIZE', 4)
+    def test_retry(self):
+        # Keep the traceback of the failure alive while retrying, as a caller handling it would
+        with mock.patch.object(dataset._ChunkWriter, 'write_rows', side_effect=IOError("disk full")):
+            try:
+                self._generate("retried.h5", pipeline=True, queue_size=1, workers=2)
+                error = None
+            except IOError as caught:
+                error = caught
+        self.assertIsNotNone(error, "should raise the error of the writer.")
+        self.assertEqual(self._generate("serial.h5"), self._generate("retried.h5", resume=True, workers=2),
+                         "should release the file once the writer fails.")
+
+
+class DatasetFanOut(DatasetFiles):
+    def _generate(self, name, sent_masks):
+        path = os.path.join(self.tmpdir.name, name)
+        dataset.generate_random(40, path=path, sent_formats='format_2', sent_masks=sent_masks, seed=5)
+        return self._read(path)
+
+    @mock.patch.object(config, 'SHARD_SIZE', 16)
+    def test_masks(self):
+        together = self._generate("together.h5", 'all')
+        for sent_mask in masks.masks:
+            alone = self._generate(f"{sent_mask}.h5", sent_mask)
+            self.assertEqual(alone, {key: rows for key, rows in together.items() if key in alone},
+                             "should generate the same group whichever masks are generated with it.")
+
+    @mock.patch.object(config, 'SHARD_SIZE', 16)
+    def test_spans_batch(self):
+        spans_batch = formats.Format.spans_batch
+        with mock.patch.object(formats.Format, 'spans_batch', autospec=True, side_effect=spans_batch) as patched:
+            dataset.generate_all((0, 6), (2, 3), path=os.path.join(self.tmpdir.name, "all.h5"),
+                                 sent_formats='format_1')
+        self.assertEqual(patched.call_count, len(config.TASKS) * 3, "should format every block once for all masks.")
+
+
+class DatasetResume(DatasetFiles):
+    def _interrupt(self, generate, path, after):
+        produce_shard = dataset._produce_shard
+        calls = []
+
+        def produce_or_fail(shard):
+            calls.append(shard)
+            if len(calls) > after:
+                raise KeyboardInterrupt
+            return produce_shard(shard)
+
+        with mock.patch.object(dataset, '_produce_shard', produce_or_fail):
+            with self.assertRaises(KeyboardInterrupt):
+                generate(path, False)
+
+        # Rows written after the last checkpoint must be discarded
+        with tables.open_file(path, mode="a") as h5file:
+            table = next(iter(h5file.root.datasets)).train
+            table.append(table.read(0, 1))
+
+    def _check(self, generate):
+        path_full = os.path.join(self.tmpdir.name, "full.h5")
+        path_resumed = os.path.join(self.tmpdir.name, "resumed.h5")
+        generate(path_full, False)
+        self._interrupt(generate, path_resumed, 3)
+        generate(path_resumed, True)
+        self.assertEqual(self._read(path_full), self._read(path_resumed),
+                         "should resume to the same output as an uninterrupted run.")
+
+    @mock.patch.object(config, 'SHARD_SIZE', 4)
+    def test_random(self):
+        self._check(lambda path, resume: dataset.generate_random(
+            10, path=path, sent_formats='format_1', sent_masks=['mask_one_digit', 'mask_one_number'],
+            seed=2, resume=resume))
+
+    @mock.patch.object(config, 'SHARD_SIZE', 2)
+    def test_all(self):
+        self._check(lambda path, resume: dataset.generate_all(
+            (1, 4), (2, 3), path=path, sent_formats='format_1', sent_masks='mask_one_number', resume=resume))
+
+
+class DatasetBatches(DatasetFiles):
+    def setUp(self):
+        super().setUp()
+        dataset.generate_random(40, path=self.path, sent_formats=['format_1', 'format_2'],
+                                sent_masks='mask_one_number', seed=0)
+        self.h5file, self.datasets = dataset.load_datasets(self.path, sent_formats=['format_1', 'format_2'],
+                                                           sent_masks='mask_one_number')
+
+    def tearDown(self):
+        self.h5file.close()
+        super().tearDown()
+
+    def test_shuffled(self):
+        batches = list(dataset.iter_batches(self.datasets, 'train', batch_size=8, read_size=5,
+                                            shuffle_buffer=16, seed=1))
+        rows = [row for group in self.datasets.values() for row in group.train.read()['sent'].tolist()]
+        self.assertEqual(sorted(rows), sorted(row for batch in batches for row in batch['sent'].tolist()),
+                         "should yield every row exactly once.")
+        self.assertTrue(all(len(batch) == 8 for batch in batches[:-1]), "should yield fixed-size batches.")
+
+    def test_seed(self):
+        def read():
+            return [batch['sent'].tolist() for batch in dataset.iter_batches(
+                self.datasets, 'train', batch_size=4, read_size=3, shuffle_buffer=8, seed=1)]
+        first = read()
+        for _ in range(5):
+            self.assertEqual(first, read(), "should yield the same batches for a seed.")
+        with self.assertRaises(ValueError):
+            next(dataset.iter_batches(self.datasets, weights={name: 1 for name in self.datasets}, shuffle_buffer=0))
+
+    def test_ordered(self):
+        batches = list(dataset.iter_batches(self.datasets, 'val', batch_size=3, columns=['label'],
+                                            read_size=4, shuffle_buffer=0))
+        rows = [row for group in self.datasets.values() for row in group.val.read()['label'].tolist()]
+        self.assertEqual(rows, [row for batch in batches for row in batch['label'].tolist()],
+                         "should yield rows in order without shuffling.")
+        self.assertEqual(('label',), batches[0].dtype.names, "should only read the requested columns.")
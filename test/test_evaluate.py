@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+from src import evaluate
+from src.data import dataset
+from test.files import DatasetFiles
+
+
+class EvaluateSpans(unittest.TestCase):
+    def test_parse(self):
+        spans = evaluate.parse_spans(["<extra_id_0> 12 <extra_id_1> 7 <extra_id_2>", "<extra_id_0> 5 <extra_id_1>",
+                                      "12"], 2)
+        self.assertEqual(spans.tolist(), [["12", "7"], ["5", ""], ["", ""]],
+                         "should split spans between consecutive mask tokens.")
+
+    def test_update(self):
+        scorer = evaluate.Scorer()
+        labels = ["<extra_id_0> 12 <extra_id_1> 7 <extra_id_2>", "<extra_id_0> 5 <extra_id_1>",
+                  "<extra_id_0> 5 <extra_id_1>"]
+        predictions = ["<extra_id_0> 12 <extra_id_1> 4 <extra_id_2>", "<extra_id_0> 5 <extra_id_1>", "five"]
+        scorer.update('format_1', 'mask_one_number', predictions, labels, np.array([0, 0, 1]), np.array([2, 2, 2]),
+                      np.array([0, 0, 1]))
+        results = {result['task']: result for result in scorer.results(by=('task',))}
+        self.assertEqual((results['minimum']['count'], results['maximum']['count']), (2, 1),
+                         "should aggregate by task.")
+        self.assertEqual(results['minimum']['exact_match'], 0.5, "should match all spans of a label.")
+        self.assertEqual(results['minimum']['mean_abs_error'], 1.0, "should average the error of numeric spans.")
+        self.assertEqual((results['maximum']['parse_rate'], results['maximum']['mean_abs_error']), (0.0, None),
+                         "should count spans that are not numbers.")
+
+    def test_garbage(self):
+        scorer = evaluate.Scorer()
+        labels = ["<extra_id_0> 5 <extra_id_1>"] * 5
+        predictions = ["<extra_id_0> --5 <extra_id_1>", "<extra_id_0> \u00b2 <extra_id_1>",
+                       "<extra_id_0> 5- <extra_id_1>", "<extra_id_0> - <extra_id_1>", "<extra_id_0> -7 <extra_id_1>"]
+        scorer.update('format_1', 'mask_one_number', predictions, labels, np.zeros(5, dtype=np.int64),
+                      np.full(5, 2), np.zeros(5, dtype=np.int64))
+        result, = scorer.results(by=())
+        self.assertEqual((result['parse_rate'], result['mean_abs_error']), (0.2, 12.0),
+                         "should count malformed spans as not parsed.")
+
+
+class EvaluateGroups(DatasetFiles):
+    def test_gold(self):
+        for storage in ('strings', 'canonical', 'tokens'):
+            dataset.generate_random(300, path=self.path, sent_formats='format_2', sent_masks='all', seed=4,
+                                    storage=storage, rewrite=True)
+            h5file, datasets = dataset.load_datasets(self.path, 'format_2', 'all')
+            scorer = evaluate.Scorer()
+            for group in datasets.values():
+                labels = [sample.label for sample in dataset.read_samples(group.test)]
+                evaluate.score_group(scorer, group, [labels[i:i + 16] for i in range(0, len(labels), 16)])
+                with self.assertRaises(ValueError):
+                    evaluate.score_group(evaluate.Scorer(), group, [labels + ["<extra_id_0> 1 <extra_id_1>"]])
+            h5file.close()
+            results = scorer.results(by=('mask',))
+            self.assertEqual(len(results), 3, f"should score every mask of {storage} storage.")
+            self.assertTrue(all(result['exact_match'] == 1 and result['mean_abs_error'] == 0 for result in results),
+                            "should score gold labels as exact.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import pickle
+import unittest
+import tables
+from src.data import dataset, export
+from test.files import DatasetFiles
+
+
+class ExportShards(DatasetFiles):
+    def setUp(self):
+        super().setUp()
+        self.group_name = 'format_3_mask_one_number'
+
+    def _check(self, storage, layout):
+        dataset.generate_random(200, path=self.path, sent_formats='format_3', sent_masks='mask_one_number',
+                                seed=2, storage=storage, rewrite=True)
+        directory = os.path.join(self.tmpdir.name, f"{storage}_{layout}")
+        meta = export.export_group(self.path, self.group_name, directory, layout=layout, shard_size=64,
+                                   read_size=50)
+        with tables.open_file(self.path) as h5file:
+            for table in h5file.root.datasets[self.group_name]:
+                samples = dataset.read_samples(table)
+                mapped = export.MappedDataset(directory, table.name)
+                self.assertEqual(len(samples), len(mapped), "should export every row.")
+                self.assertEqual(samples, [mapped.sample(i) for i in range(len(mapped))],
+                                 f"should restore the samples of {storage} storage as {layout}.")
+        self.assertTrue(all(size <= 64 for sizes in meta['splits'].values() for size in sizes),
+                        "should limit the size of shards.")
+
+    def test_strings(self):
+        self._check('strings', 'strings')
+        self._check('canonical', 'strings')
+
+    def test_tokens(self):
+        self._check('tokens', 'tokens')
+        self._check('strings', 'tokens')
+
+    def test_views(self):
+        dataset.generate_random(20, path=self.path, sent_formats='format_3', sent_masks='mask_one_number', seed=2)
+        directory = os.path.join(self.tmpdir.name, "export")
+        export.export_group(self.path, self.group_name, directory)
+        mapped = export.MappedDataset(directory, 'train')
+        sent, _ = mapped[-1]
+        self.assertFalse(sent.flags.owndata, "should return views of the mapped shards.")
+        self.assertEqual(mapped.sample(-1), pickle.loads(pickle.dumps(mapped)).sample(-1),
+                         "should map the shards again after pickling.")
+        with self.assertRaises(IndexError):
+            mapped[len(mapped)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 from src.data import formats
 
 
@@ -6,3 +7,37 @@ class Format1(unittest.TestCase):
     def test_formatting(self):
         sent = formats.format_1('maximum', [1, 2, 3], 3)
         self.assertEqual("The maximum value among 1, 2, and 3 is 3.", sent, "should create the correct sentence.")
+
+
+class FormatSpans(unittest.TestCase):
+    def test_sentence(self):
+        for name, format_fn in formats.formats.items():
+            sent, _ = formats.format_spans[name]('minimum', [12, -3, 7], -3)
+            self.assertEqual(format_fn('minimum', [12, -3, 7], -3), sent, f"should match {name}.")
+
+    def test_spans(self):
+        sent, spans = formats.format_spans['format_1']('maximum', [12, -3, 7], 12)
+        self.assertEqual(["12", "3", "7", "12"], [sent[start:end] for start, end in spans],
+                         "should return the digits of every number in order.")
+
+
+class FormatBatch(unittest.TestCase):
+    NUMS = np.array([[1, 2, 3], [40, -5, 6], [7, 8, 0]])
+    LENGTHS = np.array([3, 2, 3])
+    TARGETS = np.array([3, 40, 8])
+
+    def test_batch(self):
+        for name, format_fn in formats.formats.items():
+            sents = format_fn.format_batch('maximum', self.NUMS, self.TARGETS, self.LENGTHS)
+            targets = [format_fn('maximum', nums[:length], target) for nums, length, target
+                       in zip(self.NUMS.tolist(), self.LENGTHS.tolist(), self.TARGETS.tolist())]
+            self.assertEqual(targets, sents, f"should render every row with {name}.")
+
+    def test_spans_batch(self):
+        for name, format_fn in formats.formats.items():
+            sents, spans = format_fn.spans_batch('maximum', self.NUMS, self.TARGETS, self.LENGTHS)
+            for nums, length, target, sent, sent_spans in zip(
+                    self.NUMS.tolist(), self.LENGTHS.tolist(), self.TARGETS.tolist(), sents, spans):
+                self.assertEqual(format_fn.spans('maximum', nums[:length], target),
+                                 (sent, [tuple(span) for span in sent_spans]),
+                                 f"should compute the spans of every row with {name}.")
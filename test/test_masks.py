@@ -1,12 +1,15 @@
 import unittest
-from src.data import masks
+from itertools import combinations
+from unittest import mock
+from src import config
+from src.data import formats, masks
 from src.data.masks import Sample
 
 
 class Mask1d(unittest.TestCase):
     def test_len(self):
         sent = "1, 21, 35, 4"
-        samples = list(masks.mask_1d(sent))
+        samples = list(masks.mask_one_digit(sent))
         self.assertEqual(len(samples), 6)
 
     def test_val(self):
@@ -16,7 +19,7 @@ class Mask1d(unittest.TestCase):
             Sample(sent="2<extra_id_0>, 3", label="<extra_id_0> 1 <extra_id_1>"),
             Sample(sent="21, <extra_id_0>", label="<extra_id_0> 3 <extra_id_1>"),
         ]
-        samples = list(masks.mask_1d(sent))
+        samples = list(masks.mask_one_digit(sent))
 
         is_in = True
         for target in targets:
@@ -24,3 +27,56 @@ class Mask1d(unittest.TestCase):
                 is_in = False
 
         self.assertTrue(is_in, "should generate the correct samples.")
+
+
+class MaskAt(unittest.TestCase):
+    SENT = "The maximum value among 311, 42, 5, and 70 is 311."
+
+    def test_count(self):
+        for name, mask in masks.masks.items():
+            self.assertEqual(len(list(mask(self.SENT))), masks.counts[name](self.SENT),
+                             f"should count the samples of {name}.")
+
+    def test_val(self):
+        for name, mask in masks.masks.items():
+            samples = [masks.masks_at[name](self.SENT, k) for k in range(masks.counts[name](self.SENT))]
+            self.assertEqual(list(mask(self.SENT)), samples, f"should build each sample of {name}.")
+
+    def test_out_of_range(self):
+        with self.assertRaises(IndexError):
+            masks.mask_one_number_at(self.SENT, 5)
+
+
+class MaskSpanSets(unittest.TestCase):
+    def test_all(self):
+        subsets = list(masks.span_sets(6, 3))
+        self.assertEqual(list(combinations(range(6), 3)), subsets, "should yield every subset in order.")
+        self.assertEqual(subsets, [masks.span_set_at(6, 3, k) for k in range(masks.count_span_sets(6, 3))],
+                         "should build each subset by its index.")
+
+    def test_sample(self):
+        subsets = list(masks.span_sets(10, 3, cap=7, key="a"))
+        self.assertEqual(7, len(set(subsets)), "should sample distinct subsets up to the cap.")
+        self.assertEqual(subsets, sorted(subsets), "should yield sampled subsets in order.")
+        self.assertEqual(subsets, [masks.span_set_at(10, 3, k, cap=7, key="a") for k in range(7)],
+                         "should sample the same subsets for a key.")
+        self.assertNotEqual(subsets, list(masks.span_sets(10, 3, cap=7, key="b")), "should vary with the key.")
+        with self.assertRaises(ValueError):
+            masks.span_set_at(10, 3, 0, cap=7)
+
+    @mock.patch.object(config, 'MASK_SPANS', 3)
+    def test_tokens(self):
+        sample = masks.mask_multiple_numbers_at("1, 22, 3", 0)
+        self.assertEqual(Sample(sent="<extra_id_0>, <extra_id_1>, <extra_id_2>",
+                                label="<extra_id_0> 1 <extra_id_1> 22 <extra_id_2> 3 <extra_id_3>"), sample,
+                         "should number the mask tokens in order.")
+        with self.assertRaises(ValueError):
+            masks.mask_spans("1", [(0, 1)] * config.MASK_SENTINELS, range(config.MASK_SENTINELS))
+
+
+class MaskSpans(unittest.TestCase):
+    def test_val(self):
+        sent, spans = formats.format_spans['format_3']('maximum', [311, 42, 5], 311)
+        for name, mask in masks.masks.items():
+            self.assertEqual(list(mask(sent)), list(mask(sent, spans)),
+                             f"should mask the same spans as the regex search for {name}.")
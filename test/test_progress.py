@@ -0,0 +1,28 @@
+import io
+import unittest
+from unittest import mock
+from src.data import progress
+
+
+class ProgressTracker(unittest.TestCase):
+    def test_report(self):
+        stream = io.StringIO()
+        tracker = progress.Tracker({'a': 100, 'b': 100}, show=True, interval=0, stream=stream)
+        tracker.resume('a', 50)
+        with mock.patch.object(progress.time, 'perf_counter', return_value=tracker.start + 10):
+            tracker.update('b', 50, 200, {'mask': 1.0, 'format': 3.0})
+        self.assertIn("100/200 (50.0%)", stream.getvalue(), "should count resumed units as complete.")
+        self.assertIn("20 samples/s", stream.getvalue(), "should report the throughput of the run.")
+        self.assertIn("ETA 00:00:20", stream.getvalue(), "should estimate from the units of the run.")
+
+    def test_summary(self):
+        tracker = progress.Tracker({'a': 10})
+        tracker.update('a', 10, 40, {'write': 1.0, 'enumerate': 1.0})
+        tracker.add_times('a', {'index': 2.0})
+        summary = tracker.summary()['groups']['a']
+        self.assertEqual(['enumerate', 'write', 'index'], list(summary['stages']), "should order the stages.")
+        self.assertEqual(10.0, summary['samples_per_sec'], "should divide the rows by the time of all stages.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import multiprocessing
+import pickle
+import unittest
+from multiprocessing import shared_memory
+import tables
+from src.data import dataset, shared
+from test.files import DatasetFiles
+
+
+def _read_samples(data):
+    return [data.sample(i) for i in range(len(data))]
+
+
+class SharedSplit(DatasetFiles):
+    def setUp(self):
+        super().setUp()
+        self.group_name = 'format_2_mask_one_digit'
+
+    def _samples(self, split):
+        with tables.open_file(self.path) as h5file:
+            return dataset.read_samples(h5file.root.datasets[self.group_name][split])
+
+    def test_layouts(self):
+        for storage, layout in [('strings', 'strings'), ('tokens', 'tokens'), ('canonical', 'tokens')]:
+            dataset.generate_random(60, path=self.path, sent_formats='format_2', sent_masks='mask_one_digit',
+                                    seed=1, storage=storage, rewrite=True)
+            with shared.share_split(self.path, self.group_name, 'val', layout=layout, read_size=7) as data:
+                self.assertEqual(self._samples('val'), _read_samples(data),
+                                 f"should share the samples of {storage} storage as {layout}.")
+
+    def test_workers(self):
+        dataset.generate_random(40, path=self.path, sent_formats='format_2', sent_masks='mask_one_digit', seed=1)
+        data = shared.share_split(self.path, self.group_name)
+        names = [block_name for block_name, _, _ in data.descriptor.blocks.values()]
+        self.assertLess(len(pickle.dumps(data)), 4096, "should only pickle the descriptor.")
+        with multiprocessing.get_context('spawn').Pool(2) as pool:
+            self.assertEqual(_read_samples(data), pool.apply(_read_samples, (data,)),
+                             "should attach to the blocks in workers.")
+        data.close()
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=names[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+import tables
+from src import spec
+
+
+class SpecPlan(unittest.TestCase):
+    def test_merge(self):
+        jobs = [
+            {'kind': 'all', 'len_range': [2, 3], 'sent_formats': 'format_1', 'sent_masks': 'mask_one_number'},
+            {'kind': 'all', 'len_range': [2, 3], 'sent_formats': 'format_1', 'sent_masks': 'mask_one_digit'},
+            {'kind': 'all', 'len_range': [2, 4], 'sent_formats': 'format_1', 'sent_masks': 'mask_one_digit'},
+            {'kind': 'random', 'count': 10, 'sent_formats': 'format_2', 'sent_masks': 'all', 'split': [1, 0, 0]},
+        ]
+        planned = spec.plan_jobs(jobs)
+        self.assertEqual(3, len(planned), "should merge jobs that only differ in their masks.")
+        self.assertEqual(['mask_one_number', 'mask_one_digit'], planned[0]['sent_masks'], "should merge the masks.")
+        self.assertEqual({'train': 1, 'val': 0, 'test': 0}, planned[2]['split'], "should parse the split.")
+        self.assertEqual(3, len(planned[2]['sent_masks']), "should expand all masks.")
+
+    def test_invalid(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "dataset.h5")
+            jobs = [{'kind': 'random', 'count': 10, 'path': path}, {'kind': 'all', 'path': path, 'seed': 0}]
+            with self.assertRaises(KeyError):
+                spec.run_spec(jobs)
+            self.assertFalse(os.path.exists(path), "should check all jobs before running any.")
+        with self.assertRaises(KeyError):
+            spec.plan_jobs([{'kind': 'all', 'sent_formats': 'format_0'}])
+
+
+class SpecRun(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "dataset.h5")
+            spec_path = os.path.join(tmpdir, "spec.json")
+            with open(spec_path, 'w') as spec_file:
+                json.dump({'defaults': {'path': path, 'val_range': [0, 10], 'len_range': [2, 3],
+                                        'sent_formats': 'format_1'},
+                           'jobs': [{'kind': 'all', 'sent_masks': 'mask_one_number'},
+                                    {'kind': 'all', 'sent_masks': 'mask_one_digit'},
+                                    {'kind': 'random', 'count': 5, 'sent_formats': 'format_2', 'seed': 0,
+                                     'sent_masks': 'mask_one_number'}]}, spec_file)
+            results = spec.run_spec(spec.load_spec(spec_path))
+            with tables.open_file(path) as h5file:
+                groups = set(h5file.root.datasets._v_children)
+        self.assertEqual(2, len(results), "should run the merged jobs together.")
+        self.assertEqual({'format_1_mask_one_number', 'format_1_mask_one_digit', 'format_2_mask_one_number'}, groups,
+                         "should generate the groups of every job.")
+
+
+if __name__ == '__main__':
+    unittest.main()
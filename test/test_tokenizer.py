@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+from src import config
+from src.data import formats, masks, tokenizer
+
+
+class TokenizerRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = tokenizer.get_tokenizer()
+
+    def test_samples(self):
+        for name, format_fn in formats.formats.items():
+            sentence = format_fn('minimum', [12, -3, 7], -3)
+            for sample in masks.mask_one_digit(sentence):
+                for text in sample:
+                    ids = self.tokenizer.encode(text)
+                    self.assertNotIn(self.tokenizer.unk_id, ids, f"should cover every token of {name}.")
+                    self.assertEqual(text, self.tokenizer.decode(ids), "should restore the text.")
+
+    def test_digits(self):
+        self.assertEqual(["1", "2", ",", " ", config.MASK_TOKEN.format(0)],
+                         self.tokenizer.tokenize("12, " + config.MASK_TOKEN.format(0)),
+                         "should split numbers into digits and keep mask tokens whole.")
+
+    def test_vocab(self):
+        self.assertEqual(tokenizer.build_vocab(), tokenizer.Tokenizer().vocab, "should build the same vocabulary.")
+        self.assertEqual(tokenizer.PAD, self.tokenizer.vocab[0], "should use id 0 for padding.")
+
+
+class TokenizerBatch(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = tokenizer.get_tokenizer()
+
+    def test_padding(self):
+        texts = ["The maximum value", "12."]
+        ids, lengths = self.tokenizer.encode_batch(texts, 8)
+        self.assertEqual((2, 8), ids.shape, "should pad to the width.")
+        self.assertEqual([5, 3], lengths.tolist(), "should return the number of tokens.")
+        self.assertTrue(np.all(ids[1, 3:] == self.tokenizer.pad_id), "should pad with the pad id.")
+        self.assertEqual(texts, self.tokenizer.decode_batch(ids, lengths), "should restore the texts.")
+
+    def test_too_long(self):
+        with self.assertRaises(ValueError):
+            self.tokenizer.encode_batch(["The maximum value"], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
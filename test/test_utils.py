@@ -0,0 +1,39 @@
+import unittest
+from src.data import utils
+
+
+class UtilsCombinations(unittest.TestCase):
+    VAL_RANGE = (1, 3)
+
+    def test_len(self):
+        combinations = list(utils.iter_combinations(self.VAL_RANGE, 2))
+        self.assertEqual(len(combinations), 4, "should generate the correct number of combinations")
+        self.assertEqual(utils.count_combinations(self.VAL_RANGE, 2), 4, "should count the combinations.")
+
+    def test_val(self):
+        combinations = [list(combination) for combination in utils.iter_combinations(self.VAL_RANGE, 2)]
+        targets = [
+            [1, 1],
+            [1, 2],
+            [2, 1],
+            [2, 2],
+        ]
+        self.assertEqual(targets, combinations, "should generate all combinations in order.")
+
+    def test_blocks(self):
+        combinations = [list(combination) for combination in utils.iter_combinations((0, 4), 3)]
+        blocks = list(utils.combination_blocks((0, 4), 3, 5))
+        self.assertEqual(combinations, [row for block in blocks for row in block.tolist()],
+                         "should match the lazy enumerator.")
+        self.assertTrue(all(len(block) <= 5 for block in blocks), "should respect the block size.")
+
+    def test_blocks_range(self):
+        combinations = [list(combination) for combination in utils.iter_combinations((0, 4), 3)]
+        blocks = list(utils.combination_blocks((0, 4), 3, 4, start=7, stop=13))
+        self.assertEqual(combinations[7:13], [row for block in blocks for row in block.tolist()],
+                         "should yield the requested index range.")
+
+    def test_digit_intervals(self):
+        intervals = utils.digit_intervals((-12, 105))
+        self.assertEqual([(-12, -10, 2), (-9, 9, 1), (10, 99, 2), (100, 104, 3)], intervals,
+                         "should split the range by number of digits.")
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+import numpy as np
+from src import config
+from src.data import dataset, utils, virtual
+
+
+class VirtualOrder(unittest.TestCase):
+    VAL_RANGE = (-3, 12)
+    LEN_RANGE = (2, 3)
+
+    @mock.patch.object(config, 'MASK_SPANS_CAP', 2)
+    def test_samples(self):
+        for sent_mask in ('mask_one_digit', 'mask_one_number', 'mask_multiple_numbers'):
+            samples = list(virtual.VirtualDataset('format_2', sent_mask, self.VAL_RANGE, self.LEN_RANGE))
+            expected = [sample for task_name in config.TASKS for sample in dataset._generate_samples_all(
+                'format_2', sent_mask, task_name, self.VAL_RANGE, self.LEN_RANGE)]
+            self.assertEqual(expected, samples, "should render the samples of generate_all in order.")
+
+    def test_prefix_counts(self):
+        nums = np.array([list(combination) for combination in utils.iter_combinations(self.VAL_RANGE, 3)])
+        lengths = np.full(len(nums), 3)
+        for task_name in config.TASKS:
+            candidates = dataset._count_candidates('mask_one_digit', nums, lengths,
+                                                   dataset._block_targets(task_name, nums, lengths))
+            for rank in range(0, len(nums) + 1, 97):
+                self.assertEqual(candidates[:rank].sum(), virtual._count_samples_before(
+                    'mask_one_digit', task_name, self.VAL_RANGE, 3, rank), "should count the preceding samples.")
+
+    def test_unrank(self):
+        rng = np.random.default_rng(0)
+        for task_name in config.TASKS:
+            for rank in rng.integers(0, 1000 ** 3, size=20).tolist():
+                offset = virtual._count_samples_before('mask_one_digit', task_name, (0, 1000), 3, rank)
+                self.assertEqual((utils.unrank_combinations([rank], (0, 1000), 3)[0].tolist(), 1),
+                                 virtual._unrank_sample('mask_one_digit', task_name, (0, 1000), 3, offset + 1),
+                                 "should find the combination and position of an offset.")
+
+
+class VirtualSubsample(unittest.TestCase):
+    def test_splits(self):
+        splits = {split: virtual.VirtualDataset('format_1', 'mask_one_digit', (0, 20), (2, 4), seed=3, size=1000,
+                                                split=split) for split in config.SPLIT}
+        indices = [splits[split].index(i) for split in config.SPLIT for i in range(len(splits[split]))]
+        self.assertEqual(1000, len(set(indices)), "should draw distinct samples across splits.")
+        self.assertEqual(700, len(splits['train']), "should follow the split ratios.")
+        again = virtual.VirtualDataset('format_1', 'mask_one_digit', (0, 20), (2, 4), seed=3, size=1000, split='val')
+        self.assertEqual([splits['val'][i] for i in range(10)], [again[i] for i in range(10)],
+                         "should be deterministic for a seed.")
+        with self.assertRaises(ValueError):
+            virtual.VirtualDataset('format_1', 'mask_one_digit', (0, 20), (2, 4), split='val')
+
+    def test_large(self):
+        data = virtual.VirtualDataset('format_1', 'mask_one_number', (0, 10 ** 6), (5, 30), seed=0)
+        self.assertGreater(data.size, np.iinfo(np.int64).max, "should address spaces beyond int64.")
+        sample = data[data.size - 1]
+        self.assertIn(config.MASK_TOKEN.format(0), sample.sent, "should render samples anywhere in the space.")
+
+
+if __name__ == '__main__':
+    unittest.main()